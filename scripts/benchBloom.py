@@ -0,0 +1,42 @@
+# Check of the Bloom filter FPR models of the bloomTuner - builds filters of random rules with
+# BloomFilter, queries them with random headers through BloomQuery and compares the measured false
+# positive rate with the model the tuner picks configurations by. The blocked sizes include word
+# counts that are not powers of two, which the tuner's whole-BRAM sizes and bloomExactSize give.
+#
+# Usage: python -m scripts.benchBloom [--rules 3000] [-k 4] [--words 500 512 520 1000 1024] [--queries 400000]
+
+import argparse
+import numpy as np
+
+from scripts.memModels import BloomFilter, BLOOM_BLOCK_BITS
+from scripts.bloomQuery import BloomQuery, randomKeys, memberMask
+from scripts.bloomTuner import blockedFpr
+
+# Measured FPR allowed over the model, on top of 4 standard deviations of the sampling noise
+MODEL_SLACK = 1.5
+
+def measureBlocked(n, k, words, queries, seed):
+	rng = np.random.default_rng(seed)
+	ipAndProtocolList = list(rng.integers(0, 256, (9, n), dtype=np.uint8))
+	bloom = BloomFilter(n, 0.01, ipAndProtocolList, [rng.integers(0, 1 << 16, n)], [rng.integers(0, 1 << 16, n)], "", words*BLOOM_BLOCK_BITS, k, "blocked")
+	m = bloom.size
+	bq = BloomQuery(bloom.buildMemories(m), m, k, "blocked")
+	keys = randomKeys(queries, rng)
+	return bq.report(keys, memberMask(keys, bloom.getKeys()))["measuredFpr"]
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Compare the measured FPR of blocked Bloom filters with the bloomTuner model")
+	parser.add_argument("--rules", type=int, default=3000, help="Rules in every filter")
+	parser.add_argument("-k", type=int, default=4, help="Hash count")
+	parser.add_argument("--words", type=int, nargs="+", default=[500, 512, 520, 1000, 1024], help="Sizes of one memory in BLOOM_BLOCK_BITS bit words")
+	parser.add_argument("--queries", type=int, default=400000, help="Random headers per filter")
+	parser.add_argument("--seed", type=int, default=1, help="Seed for the rules and the headers")
+	args = parser.parse_args()
+
+	print("blocked layout, {} rules, k={}".format(args.rules, args.k))
+	print("{:>8} {:>12} {:>12} {:>8}".format("words", "model FPR", "measured", "ratio"))
+	for words in args.words:
+		model = blockedFpr(words*BLOOM_BLOCK_BITS, args.k, args.rules, BLOOM_BLOCK_BITS) ** 2
+		measured = measureBlocked(args.rules, args.k, words, args.queries, args.seed)
+		print("{:>8} {:>12.6f} {:>12.6f} {:>8.2f}".format(words, model, measured, measured/model))
+		assert measured <= MODEL_SLACK*model + 4*np.sqrt(model/args.queries), "measured FPR is over the model at {} words".format(words)
@@ -0,0 +1,129 @@
+# Benchmark for the rules validator - compares the indexed contradiction search, the tiled
+# subset search and the sweep line overlap search against the pairwise references on
+# generated rule sets.
+#
+# Usage: python -m scripts.benchValidator [--sizes 1000 10000 100000] [--pairwise-limit 10000] [--tile-bytes N]
+
+import time
+import random
+import argparse
+import numpy as np
+
+from scripts.rulesValidator import RulesValidator, DEFAULT_TILE_BYTES, sweepOverlaps
+
+# Rules are drawn from a small pool of subnets and services so that the generated
+# set contains overlapping rules, wildcards and contradictions like a real firewall.
+def generateRules(numberOfRules, seed):
+	rng = random.Random(seed)
+	subnets = [[str(rng.randint(1,223)), str(rng.randint(0,255)), str(rng.randint(0,255))] for _ in range(max(4, numberOfRules//50))]
+	protocols = ["6", "17", "1", "47"]
+	services = [22, 25, 53, 80, 123, 443, 993, 3306, 8080]
+
+	rules = []
+	for i in range(numberOfRules):
+		if rules and rng.random() < 0.1:
+			# re-state an earlier rule, possibly broader or with the opposite action
+			rule = dict(rng.choice(rules))
+			(low, high) = (int(rule["src_port_min"]), int(rule["src_port_max"]))
+			if rng.random() < 0.3 and low < high < 65535:
+				# the opposite action on a source port range that overlaps the earlier one without
+				# either containing the other, what findOverlaps reports
+				rule["src_port_min"] = str(rng.randint(low+1, high))
+				rule["src_port_max"] = str(rng.randint(high+1, 65535))
+				rule["action"] = "REJECT" if rule["action"] == "ACCEPT" else "ACCEPT"
+				rules.append(rule)
+				continue
+			if rng.random() < 0.5:
+				rule["src_ip"] = ".".join(rule["src_ip"].split(".")[:3] + ['*'])
+			if rng.random() < 0.5:
+				rule["src_port_min"] = "0"
+				rule["src_port_max"] = "65535"
+			rule["action"] = rng.choice(["ACCEPT","REJECT"])
+			rules.append(rule)
+			continue
+
+		src = rng.choice(subnets) + [str(rng.randint(0,15))]
+		dst = rng.choice(subnets) + [str(rng.randint(0,15))]
+		if rng.random() < 0.1:
+			src[3] = '*'
+		if rng.random() < 0.05:
+			dst[2] = '*'
+			dst[3] = '*'
+
+		if rng.random() < 0.7:
+			srcport_min = srcport_max = rng.randint(1024,65535)
+		else:
+			srcport_min = rng.randint(0,32767)
+			srcport_max = rng.randint(srcport_min,65535)
+		if rng.random() < 0.8:
+			dstport_min = dstport_max = rng.choice(services)
+		else:
+			dstport_min = rng.randint(0,1023)
+			dstport_max = rng.randint(dstport_min,65535)
+
+		rules.append({"src_ip":".".join(src), "dst_ip":".".join(dst), "protocol":rng.choice(protocols),
+			"src_port_min":str(srcport_min), "src_port_max":str(srcport_max),
+			"dst_port_min":str(dstport_min), "dst_port_max":str(dstport_max),
+			"action":rng.choice(["ACCEPT","REJECT"])})
+	# mix the broader re-stated rules in with the rest, so some of them come first and shadow
+	rng.shuffle(rules)
+	return rules
+
+def timeIt(function, *args):
+	start = time.perf_counter()
+	result = function(*args)
+	return result, time.perf_counter()-start
+
+# Times a search against its pairwise reference for every size, one row per size.
+# The reference is only run up to pairwiseLimit rules, larger sizes are extrapolated.
+# With expectPairs the search has to find pairs, so the comparison is not of two empty results.
+def benchmark(title, sizes, pairwiseLimit, prepare, reference, search, expectPairs=False):
+	print(title)
+	print("{:>8} {:>14} {:>14} {:>10} {:>10}".format("rules", "pairwise (s)", "new (s)", "speedup", "pairs"))
+	pairwiseRate = None
+	for n in sizes:
+		(rv, table) = prepare(n)
+		result, searchTime = timeIt(search(rv), table)
+		assert not expectPairs or len(result) > 0, "the generated rules have no pairs to find"
+		if n <= pairwiseLimit:
+			pairwise, pairwiseTime = timeIt(reference(rv), table)
+			assert pairwise == result, "search disagrees with the pairwise reference"
+			pairwiseRate = pairwiseTime/(len(table)**2)
+			pairwiseCol = "{:.3f}".format(pairwiseTime)
+		elif pairwiseRate is not None:
+			# the pairwise search is quadratic, so scale the last measured rate
+			pairwiseTime = pairwiseRate*(len(table)**2)
+			pairwiseCol = "~{:.0f} (est.)".format(pairwiseTime)
+		else:
+			pairwiseTime = None
+			pairwiseCol = "skipped"
+
+		speedup = "-" if pairwiseTime is None else "{:.0f}x".format(pairwiseTime/searchTime)
+		print("{:>8} {:>14} {:>14.3f} {:>10} {:>10}".format(n, pairwiseCol, searchTime, speedup, len(result)))
+	print("")
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark RulesValidator contradiction and subset detection")
+	parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Rule set sizes to benchmark")
+	parser.add_argument("--pairwise-limit", type=int, default=10000, help="Largest size the pairwise reference is run on, larger sizes are extrapolated")
+	parser.add_argument("--tile-bytes", type=int, default=DEFAULT_TILE_BYTES, help="Peak memory of one findSubsets block")
+	parser.add_argument("--seed", type=int, default=1, help="Seed for the rule generator")
+	args = parser.parse_args()
+
+	def uniqueRules(n):
+		rv = RulesValidator(generateRules(n, args.seed), True, True, True, True, args.tile_bytes)
+		return (rv, rv.unique_rules())
+
+	def contradictionFree(n):
+		(rv, table) = uniqueRules(n)
+		# findSubsets runs on what is left after the contradictions are removed
+		keep = np.ones(len(table), dtype=bool)
+		keep[[i for pair in rv.indexedContradictions(table) for i in pair]] = False
+		return (rv, table[keep])
+
+	benchmark("findContradiction: pairwise loop vs indexed search", args.sizes, args.pairwise_limit, uniqueRules,
+		lambda rv: rv.pairwiseContradictions, lambda rv: rv.indexedContradictions)
+	benchmark("findSubsets: pairwise loop vs tiled search", args.sizes, args.pairwise_limit, contradictionFree,
+		lambda rv: rv.pairwiseSubsets, lambda rv: rv.tiledSubsets)
+	benchmark("findOverlaps: pairwise loop vs sweep line", args.sizes, args.pairwise_limit, uniqueRules,
+		lambda rv: rv.pairwiseOverlaps, lambda rv: sweepOverlaps, expectPairs=True)
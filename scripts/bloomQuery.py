@@ -0,0 +1,130 @@
+#--------------------------------------------------------------------------------------------------
+#Details:
+#
+#Software model of the Bloom filter lookup of BF_PACKET_MATCH. It loads a generated bloomfilter.mem,
+#runs the same seeded Jenkins hashes on batches of packet headers and reports how the filter
+#behaves on them: measured false positive rate, bit occupancy and the load of every hash lookup.
+#
+#Usage: python -m scripts.bloomQuery --mem out/memfiles/bloomfilter_wrm/bloomfilter.mem -k 4 \
+#	--rules rules.json [--layout replicated] [--hashing jenkins] [--headers headers.json] [--random 1000000] [--seed 1]
+#The partitioned and blocked layouts take all their bloomfilter<i>.mem files, in order, after --mem.
+#--------------------------------------------------------------------------------------------------
+
+import argparse
+import numpy as np
+
+from scripts.memModels import BLOOM_LAYOUTS, BLOOM_HASHINGS, BLOOM_BLOCK_BITS, bloomLookups, readBitsMem
+from scripts.ruleTable import RuleTable
+
+# Headers hashed per batch, bounds the temporaries to a few arrays of this length
+QUERY_BATCH = 1 << 20
+
+class BloomQuery:
+	# memories are the packBits arrays of m bits of the layout (bloomMemFiles), hashCount the k of
+	# the generated BF_PACKET_MATCH
+	def __init__(self, memories, m, hashCount, layout="replicated", hashing="jenkins"):
+		self.memories = memories
+		self.m = m
+		self.hashCount = hashCount
+		self.layout = layout
+		self.hashing = hashing
+
+	# Reads the .mem files written by BloomFilter.generateMemory
+	@classmethod
+	def fromMem(cls, paths, hashCount, layout="replicated", hashing="jenkins"):
+		width = BLOOM_BLOCK_BITS if layout == "blocked" else 1
+		memories = [readBitsMem(path, width) for path in paths]
+		return cls([bits for (bits, m) in memories], memories[0][1], hashCount, layout, hashing)
+
+	# Fraction of set bits over all memories
+	def occupancy(self):
+		return float(sum(np.unpackbits(bits, bitorder="little")[:self.m].sum() for bits in self.memories)) / (self.m*len(self.memories))
+
+	# Bits read by the 2k lookups of BF_PACKET_MATCH for every header, shape (2k, n)
+	# Rows 0..k-1 are the hash72 lookups of the ips and protocol, rows k..2k-1 the hash32 port lookups.
+	def lookups(self, keys):
+		n = len(keys[0])
+		found = np.zeros((2*self.hashCount, n), dtype=bool)
+		for start in range(0, n, QUERY_BATCH):
+			batch = [key[start:start+QUERY_BATCH] for key in keys]
+			for (lookup, memory, indices) in bloomLookups(self.layout, batch, self.m, self.hashCount, self.hashing):
+				found[lookup, start:start+QUERY_BATCH] = self.bitsAt(self.memories[memory], indices)
+		return found
+
+	def bitsAt(self, bits, indices):
+		indices = indices.astype(np.int64)
+		return ((bits[indices >> 3] >> (indices & 7).astype(np.uint8)) & 1).astype(bool)
+
+	# result of BF_PACKET_MATCH for every header, the and of all 2k lookups
+	def contains(self, keys):
+		return self.lookups(keys).all(axis=0)
+
+	# members marks the headers that are rules of the filter, everything else that passes is a false positive
+	def report(self, keys, members):
+		found = self.lookups(keys)
+		passed = found.all(axis=0)
+		negatives = ~members
+		report = {"m":self.m, "k":self.hashCount, "layout":self.layout, "occupancy":self.occupancy(),
+			"queries":len(passed), "members":int(members.sum()),
+			"falsePositives":int((passed & negatives).sum()), "falseNegatives":int((~passed & members).sum())}
+		# a random header passes when all 2k bits it reads are set (an estimate for the blocked layout,
+		# whose words are not filled evenly)
+		report["expectedFpr"] = report["occupancy"] ** (2*self.hashCount)
+		report["measuredFpr"] = report["falsePositives"] / float(max(1, negatives.sum()))
+		# fraction of the non member headers for which each lookup reads a set bit
+		report["hashLoad"] = (found[:, negatives].mean(axis=1) if negatives.any() else np.zeros(len(found))).tolist()
+		return report
+
+# Bloom filter keys of the rules (or headers) of a RuleTable, the min ports are the packet ports
+def tableKeys(table):
+	(src_ip, src_wild) = table.packedSrc()
+	(dst_ip, dst_wild) = table.packedDst()
+	k01 = (table.src_port_min.astype(np.uint32) << 16) | table.dst_port_min.astype(np.uint32)
+	return [src_ip, dst_ip, table.protocol.astype(np.uint32), k01]
+
+def randomKeys(n, rng):
+	return [rng.integers(0, 1 << 32, n, dtype=np.uint32), rng.integers(0, 1 << 32, n, dtype=np.uint32),
+		rng.integers(0, 256, n, dtype=np.uint32), rng.integers(0, 1 << 32, n, dtype=np.uint32)]
+
+# Marks the keys that equal the key of one of the rules
+def memberMask(keys, ruleKeys):
+	def rows(k):
+		columns = np.ascontiguousarray(np.stack([np.asarray(c, dtype=np.uint32) for c in k], axis=1))
+		return columns.view(np.dtype((np.void, 16))).ravel()
+	return np.isin(rows(keys), rows(ruleKeys))
+
+# Rules the BFTop filter is built from: ACCEPT rules without port ranges
+def filterRules(table):
+	single = (table.src_port_min == table.src_port_max) & (table.dst_port_min == table.dst_port_max)
+	return table[(table.action == table.actionCode("ACCEPT")) & single]
+
+def printReport(report):
+	print("Filter bits (m):", report["m"], " hash functions (k):", report["k"], " layout:", report["layout"])
+	print("Bit occupancy: {:.4f}".format(report["occupancy"]))
+	print("Headers: {}  members: {}  false positives: {}  false negatives: {}".format(report["queries"], report["members"], report["falsePositives"], report["falseNegatives"]))
+	print("Measured FPR: {:.6f}  expected FPR from occupancy: {:.6f}".format(report["measuredFpr"], report["expectedFpr"]))
+	k = report["k"]
+	print("Hash load (set bits read by non member headers):")
+	for i in range(k):
+		print("  h{}: ip/protocol {:.4f}  ports {:.4f}".format(i+1, report["hashLoad"][i], report["hashLoad"][k+i]))
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Query a generated bloomfilter.mem and measure its false positive rate")
+	parser.add_argument("--mem", required=True, nargs="+", help="bloomfilter.mem written by the classifier, or all bloomfilter<i>.mem files of a partitioned or blocked filter")
+	parser.add_argument("-k", type=int, required=True, help="Hash count of the filter (printed by the classifier)")
+	parser.add_argument("--layout", choices=BLOOM_LAYOUTS, default="replicated", help="Memory layout of the filter")
+	parser.add_argument("--hashing", choices=BLOOM_HASHINGS, default="jenkins", help="Hashing of the filter")
+	parser.add_argument("--rules", required=True, help="Rules file the filter was generated from, its exact port ACCEPT rules are the members")
+	parser.add_argument("--headers", help="Headers to query, in the rules file format (the min ports are used)")
+	parser.add_argument("--random", type=int, default=0, help="Number of uniformly random headers to query")
+	parser.add_argument("--seed", type=int, default=1, help="Seed for the random headers")
+	args = parser.parse_args()
+
+	bq = BloomQuery.fromMem(args.mem, args.k, args.layout, args.hashing)
+	ruleKeys = tableKeys(filterRules(RuleTable.fromFile(args.rules)))
+	keys = [np.zeros(0, dtype=np.uint32) for _ in range(4)]
+	if args.headers:
+		keys = [np.concatenate(pair) for pair in zip(keys, tableKeys(RuleTable.fromFile(args.headers)))]
+	if args.random:
+		keys = [np.concatenate(pair) for pair in zip(keys, randomKeys(args.random, np.random.default_rng(args.seed)))]
+	printReport(bq.report(keys, memberMask(keys, ruleKeys)))
@@ -0,0 +1,127 @@
+#--------------------------------------------------------------------------------------------------
+#Details:
+#
+#Chooses the Bloom filter parameters for BFTop: the filter size m, the hash count k and the memory
+#layout. Every candidate is costed with an analytical model of BRAM use, lookup latency and false
+#positive rate under the fpga_constraints BRAM budget. The cheapest candidate that meets the target
+#FPR (and latency budget) is chosen, optionally after measuring the FPR of the built filter.
+#--------------------------------------------------------------------------------------------------
+
+import math
+import collections
+
+from scripts.memModels import BLOOM_BLOCK_BITS, HASH_PIPELINE_LATENCY
+
+# Cycles of the hash/hash_port pipeline of bf_packet_match before the BRAM address is ready
+HASH_LATENCY = HASH_PIPELINE_LATENCY
+BRAM_READ_LATENCY = 1
+MAX_HASH_COUNT = 16
+# Share of max_BRAMs the filter may take, as for the other memory models
+BRAM_UTILISATION = 0.8
+# Candidates whose measured FPR is checked before giving up on the empirical check
+MAX_EMPIRICAL_TRIES = 8
+
+BloomConfig = collections.namedtuple("BloomConfig", ["m", "k", "layout", "brams", "latency", "fpr"])
+
+# One BRAM holds bram_width * 2**bram_input_size bits, as BFTop counts it
+def bitsPerBram(fpga_constraints):
+	return int(fpga_constraints["bram_width"]) * (2**int(fpga_constraints["bram_input_size"]))
+
+def bramBudget(fpga_constraints):
+	return int(BRAM_UTILISATION*int(fpga_constraints["max_BRAMs"]))
+
+# FPR of a filter of m bits where each of n rules sets 2k bits (k for the ips and protocol, k for
+# the ports) and a header passes when all 2k bits it reads are set
+def sharedFpr(m, k, n):
+	occupancy = 1.0 - math.exp(-2.0*k*n/m)
+	return occupancy ** (2*k)
+
+# FPR of one blocked memory: n keys each set k bits of one of m/blockBits words, the number of keys
+# in the word a header reads is Poisson distributed
+def blockedFpr(m, k, n, blockBits):
+	load = float(n)*blockBits/m
+	spread = int(10*math.sqrt(load))+10
+	fpr = 0.0
+	for keys in range(max(0, int(load)-spread), int(load)+spread):
+		weight = math.exp(keys*math.log(load) - load - math.lgamma(keys+1))
+		fpr += weight * (1.0 - (1.0-1.0/blockBits)**(k*keys)) ** k
+	return fpr
+
+# Layout models: (m, k, n, fpga_constraints) -> (BRAMs, read cycles, FPR), or None if the layout
+# cannot be built with these parameters. m is the size of one memory of the layout.
+# replicated: today's BF_PACKET_MATCH, every one of the 2k lookups reads its own copy of the filter
+def replicatedLayout(m, k, n, fpga_constraints):
+	return (2*k*int(math.ceil(m/float(bitsPerBram(fpga_constraints)))), BRAM_READ_LATENCY, sharedFpr(m, k, n))
+
+# partitioned: lookup i reads its own filter, in which every rule sets a single bit
+def partitionedLayout(m, k, n, fpga_constraints):
+	return (2*k*int(math.ceil(m/float(bitsPerBram(fpga_constraints)))), BRAM_READ_LATENCY, (1.0-math.exp(-float(n)/m)) ** (2*k))
+
+# blocked: one memory of BLOOM_BLOCK_BITS bit words for the ips and protocol and one for the ports,
+# a word spans ceil(BLOOM_BLOCK_BITS/bram_width) BRAMs side by side
+def blockedLayout(m, k, n, fpga_constraints):
+	if m < 2*BLOOM_BLOCK_BITS or m % BLOOM_BLOCK_BITS or k > BLOOM_BLOCK_BITS:
+		return None
+	words = m//BLOOM_BLOCK_BITS
+	side = int(math.ceil(BLOOM_BLOCK_BITS/float(fpga_constraints["bram_width"])))
+	depth = int(math.ceil(words/float(2**int(fpga_constraints["bram_input_size"]))))
+	return (2*side*depth, BRAM_READ_LATENCY, blockedFpr(m, k, n, BLOOM_BLOCK_BITS) ** 2)
+
+LAYOUTS = collections.OrderedDict([("replicated", replicatedLayout), ("partitioned", partitionedLayout), ("blocked", blockedLayout)])
+
+# Filter sizes worth trying: powers of two, and the sizes that fill whole BRAMs, one bit or one
+# blocked word wide (other sizes than powers of two are indexed by multiply-shift, see reduceDigest)
+def candidateSizes(maxBits, fpga_constraints):
+	sizes = set()
+	m = 2
+	while m <= maxBits:
+		sizes.add(m)
+		m *= 2
+	for unit in (bitsPerBram(fpga_constraints), (2**int(fpga_constraints["bram_input_size"]))*BLOOM_BLOCK_BITS):
+		sizes.update(range(unit, maxBits+1, unit))
+	return sorted(sizes)
+
+# Every (m, k, layout) within the BRAM budget and the latency budget, cheapest first
+def candidates(n, fpga_constraints, maxLatency=None, layouts=None):
+	budget = bramBudget(fpga_constraints)
+	found = []
+	for layout in (layouts or LAYOUTS):
+		model = LAYOUTS[layout]
+		for m in candidateSizes(budget*bitsPerBram(fpga_constraints), fpga_constraints):
+			for k in range(1, MAX_HASH_COUNT+1):
+				cost = model(m, k, max(1, n), fpga_constraints)
+				if cost is None:
+					continue
+				(brams, readCycles, fpr) = cost
+				latency = HASH_LATENCY + readCycles
+				if brams > budget or (maxLatency is not None and latency > maxLatency):
+					continue
+				found.append(BloomConfig(m, k, layout, brams, latency, fpr))
+	found.sort(key=lambda c: (c.brams, c.fpr, c.m, c.k))
+	return found
+
+# Picks the configuration for n rules and the target FPR
+# measure(config) optionally builds the filter and returns its measured FPR; a candidate is only
+# taken if the measurement meets the target too. Without a candidate that meets the target the one
+# with the lowest FPR is returned, and None if nothing fits in the BRAM budget at all.
+def tuneBloom(n, targetFpr, fpga_constraints, maxLatency=None, layouts=None, measure=None):
+	found = candidates(n, fpga_constraints, maxLatency, layouts)
+	if not found:
+		return None
+	meeting = [c for c in found if c.fpr <= targetFpr]
+	if measure is not None:
+		for config in meeting[:MAX_EMPIRICAL_TRIES]:
+			measured = measure(config)
+			print("Tuner: m={} k={} {} model FPR {:.6f} measured {:.6f}".format(config.m, config.k, config.layout, config.fpr, measured))
+			if measured <= targetFpr:
+				return config
+		meeting = []
+	if meeting:
+		return meeting[0]
+	print("Tuner: no configuration within the BRAM budget meets FPR", targetFpr)
+	return min(found, key=lambda c: (c.fpr, c.brams))
+
+# Comment block written at the top of the generated bloom filter module
+def configComment(config):
+	return "// Bloom filter configuration: m={} k={} layout={} BRAMs={} latency={} cycles expected FPR={:.6g}\n".format(
+		config.m, config.k, config.layout, config.brams, config.latency, config.fpr)
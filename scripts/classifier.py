@@ -1,12 +1,19 @@
 ## Copy of original classifier.py
 
 import os
+import copy
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 # from scripts import memModels, rulesValidator, templates
 # Import specific names from the modules if needed
 from scripts.templates import *
 from scripts.memModels import *
 from scripts.rulesValidator import *
+from scripts.ruleTable import *
+from scripts.ruleCache import *
+from scripts.outputManifest import *
+from scripts.bloomQuery import *
+from scripts.bloomTuner import *
 
 
 templates_loc = "templates/"
@@ -26,6 +33,7 @@ class Classifier:
 		#+++++++++++++++++++++++
 		# Output file locations
 		#+++++++++++++++++++++++	
+		self.output_loc = argso
 		self.memfiles_loc = argso+"memfiles/"
 		self.srcfiles_loc = argso+"srcfiles/"
 
@@ -41,14 +49,26 @@ class Classifier:
 		#+++++++++++++++++++++++
 		# Parse the inputs
 		#+++++++++++++++++++++++
-		rfile_handle = open(rules_file,"r")
-		self.rules = json.load(rfile_handle)["rules"]
-
 		ffile_handle = open(fpga_constraints_file,"r")
 		self.fpga_constraints = json.load(ffile_handle)["fpga_constraints"]
 
 		ufile_handle = open(user_constraints_file,"r")
 		self.user_constraints = json.load(ufile_handle)["user_constraints"]	
+
+		# with a ruleCache directory an unchanged rules file gives back the validated rules directly
+		self.ruleCache = None
+		cached = None
+		if self.user_constraints.get("ruleCache", ""):
+			self.ruleCache = RuleCache(self.user_constraints["ruleCache"])
+			self.ruleCacheKey = cacheKey(rules_file, self.validationChecks())
+			cached = self.ruleCache.load(self.ruleCacheKey)
+		self.rulesValidated = cached is not None
+		if self.rulesValidated:
+			(self.no_of_rules, self.rules) = cached
+		else:
+			# streamed straight into the columns, {"rules":[...]} or NDJSON
+			self.rules = RuleTable.fromFile(rules_file)
+			self.no_of_rules = len(self.rules)
 		
 		is_ipv6 = (self.user_constraints["ipv6"]=="yes")
 		if(not is_ipv6):
@@ -61,44 +81,85 @@ class Classifier:
 	
 	def validateRules(self):
 		print("Validating Rules...")
-		rv = RulesValidator(self.rules, self.user_constraints["srcIpCheck"]=="yes", self.user_constraints["dstIpCheck"]=="yes", self.user_constraints["protocolCheck"]=="yes", self.user_constraints["portCheck"]=="yes")
+		# validationProcesses > 1 shards the validation over a process pool, the result is the same
+		processes = int(self.user_constraints.get("validationProcesses", "1"))
+		checks = self.validationChecks()
+		# with a validatorIndex directory only the difference to the last validated rules is checked
+		indexPath = self.user_constraints.get("validatorIndex", "")
+		if indexPath:
+			self.rules = self.validateIncrementally(indexPath, checks)
+			return
+		rv = RulesValidator(self.rules, *checks, processes=processes)
 		self.rules = rv.findSubsets(rv.findContradiction())		
 
+	def validationChecks(self):
+		return [self.user_constraints[check]=="yes" for check in ["srcIpCheck", "dstIpCheck", "protocolCheck", "portCheck"]]
+
+	def validateIncrementally(self, indexPath, checks):
+		if os.path.isdir(indexPath):
+			iv = IncrementalValidator.load(indexPath)
+			if iv.checks != checks:
+				iv = IncrementalValidator(self.rules, *checks)
+			else:
+				report = iv.sync(self.rules)
+				print(len(report["ids"]), 'rules changed since the last validation')
+				if report["contradictions"]:
+					print('Below is the list of new rule ids that are correlations of each other')
+					print(report["contradictions"])
+				if report["shadowed"]:
+					print('Below is the list of new rule ids that are simply shadowed')
+					print(report["shadowed"])
+		else:
+			iv = IncrementalValidator(self.rules, *checks)
+		iv.save(indexPath)
+		rules = iv.validRules()
+		print('There are total', len(rules), 'rules after validation')
+		return rules
+
 	#+++++++++++++++++++++++
 	# analyser inputs
 	#+++++++++++++++++++++++
 
 	def classify(self):
 		# number of rules
-		no_of_rules = len(self.rules) 
+		no_of_rules = self.no_of_rules
 		print("No. of rules:", no_of_rules)
 
-		whitelist_rules = []
-		for i in range(no_of_rules):
-			if(self.rules[i]["action"] == "ACCEPT"):
-				whitelist_rules.append(self.rules[i])
-				
-		self.rules = whitelist_rules
-		self.validateRules()
+		if self.rulesValidated:
+			print("Validated rules loaded from the rule cache")
+		else:
+			# overlapCheck reports ACCEPT/REJECT rules with partially overlapping ports, indices are rule file positions
+			if self.user_constraints.get("overlapCheck", "no") == "yes":
+				RulesValidator(self.rules, True, True, True, True).findOverlaps(self.rules)
+			self.rules = self.rules[self.rules.action == self.rules.actionCode("ACCEPT")]
+			self.validateRules()
+			if self.ruleCache is not None:
+				self.ruleCache.save(self.ruleCacheKey, no_of_rules, self.rules)
 		no_of_rules = len(self.rules)
 		self.useComparator = self.user_constraints["useComparator"]=="yes"
 
 		assert no_of_rules!=0, "Insufficient number of rules to generate firewall"
 		
-		rulesWithRangeMatching=[]
-		rulesWithOutRangeMatching=[]
-		
-		for i in range(no_of_rules):
-			if((self.rules[i]["src_port_max"] == self.rules[i]["src_port_min"]) & 
-				(self.rules[i]["dst_port_max"] == self.rules[i]["dst_port_min"])):
-				rulesWithOutRangeMatching.append(self.rules[i])
-			else:
-				rulesWithRangeMatching.append(self.rules[i])
+		withoutRanges = ((self.rules.src_port_max == self.rules.src_port_min) & 
+			(self.rules.dst_port_max == self.rules.dst_port_min))
+		rulesWithOutRangeMatching = self.rules[withoutRanges]
+		rulesWithRangeMatching = self.rules[~withoutRanges]
 
 		no_of_rules = len(rulesWithRangeMatching)
 		if no_of_rules != 0:
 			print("No. of rules with range matching:", no_of_rules)
 			
+		# the generated files go through the output manifest, unchanged ones are not rewritten
+		manifest = OutputManifest(self.output_loc)
+		previous = setManifest(manifest)
+		try:
+			self.generate(rulesWithRangeMatching, rulesWithOutRangeMatching)
+		finally:
+			setManifest(previous)
+		# only a finished run deletes the files of the last run it did not write again
+		manifest.finish()
+
+	def generate(self, rulesWithRangeMatching, rulesWithOutRangeMatching):
 		rmNeeded=False
 		wrmNeeded=False	
 		####### range matching not required?
@@ -108,7 +169,10 @@ class Classifier:
 		    
 		if(len(rulesWithOutRangeMatching) > 0):
 			wrmNeeded = True
-			if(self.fp_accepted > 0):
+			# filterBackend "cuckoo" replaces the bloom filter with a cuckoo filter
+			if(self.fp_accepted > 0 and self.user_constraints.get("filterBackend", "bloom") == "cuckoo"):
+				self.CFTop(rulesWithOutRangeMatching, self.fp_accepted)
+			elif(self.fp_accepted > 0):
 				self.BFTop(rulesWithOutRangeMatching, self.fp_accepted)
 			else:
 				self.FSBVTop(rulesWithOutRangeMatching, rangeMatching = False)
@@ -122,22 +186,10 @@ class Classifier:
 
 		# TODO - Add support to generate tb.v from template
 	
+	# ruleSet : the rules of instance i, FSBVTop splits them by DRAM_maxRules
 	def FSBV_DRAM(self, ruleSet, i, rangeMatching):
 		stride = int(self.fpga_constraints["no_inp_to_LUTS"])
 		dram_depth = int(self.fpga_constraints["dram_depth"])
-		maxRules = int(self.fpga_constraints["DRAM_maxRules"])
-	    
-		if (maxRules != -1):
-			startIndex = i*maxRules
-			endIndex = (i+1)*maxRules 
-		    
-			if (endIndex > len(ruleSet)): 
-				endIndex = len(ruleSet)
-			else:
-				startIndex = 0
-				endIndex = len(ruleSet)
-		
-			ruleSet = ruleSet[startIndex : endIndex]
 		
 		no_of_rules = len(ruleSet)
 		if(rangeMatching):
@@ -145,7 +197,7 @@ class Classifier:
 		else:
 			memfilespath = self.memfiles_loc+"ipprot_module"+str(i)+"_wrm/"
 			
-		fsbv = FSBV(self.header_width, stride, getIPAndProtocolLists(ruleSet), memfilespath)
+		fsbv = FSBV(self.header_width, stride, getIPAndProtocolLists(ruleSet), memfilespath, getIPAndProtocolWildLists(ruleSet))
 		## generate FSBV memory files
 		fsbv.generateMemory()
 	
@@ -255,27 +307,17 @@ class Classifier:
 		fm = FinalMatch(template_file, self.srcfiles_loc, W, self.W1, stride, no_of_rules, keyword1)
 		fm.generateSource()
 
+	# ruleSet : the rules of instance i, FSBVTop splits them by BRAM_maxRules
 	def FSBV_BRAM(self, ruleSet, i, rangeMatching):
 		stride = int(self.fpga_constraints["bram_input_size"])
 		bram_width = int(self.fpga_constraints["bram_width"])
-		maxRules = int(self.fpga_constraints["BRAM_maxRules"])
-	    
-		if(maxRules != -1):
-			startIndex = i*maxRules
-			endIndex = (i+1)*maxRules 
-			if(endIndex > len(ruleSet)): 
-				endIndex = len(ruleSet)
-			else:
-				startIndex = 0
-				endIndex = len(ruleSet)
-			
-		ruleSet = ruleSet[startIndex : endIndex]
+		
 		no_of_rules = len(ruleSet)
 		if(rangeMatching):
 			memfilespath = self.memfiles_loc+"ipprot_module"+str(i)+"_rm/"
 		else:
 			memfilespath = self.memfiles_loc+"ipprot_module"+str(i)+"_wrm/"		
-		fsbv = FSBV(self.header_width, stride, getIPAndProtocolLists(ruleSet), memfilespath)
+		fsbv = FSBV(self.header_width, stride, getIPAndProtocolLists(ruleSet), memfilespath, getIPAndProtocolWildLists(ruleSet))
 		## generate FSBV memory files
 		fsbv.generateMemory()
 		
@@ -411,15 +453,16 @@ class Classifier:
 		DRAM_maxRules = int(self.fpga_constraints["DRAM_maxRules"])
 		BRAM_maxRules = int(self.fpga_constraints["BRAM_maxRules"])
 		if(useDRAM):
+			maxRules = DRAM_maxRules
 			if(DRAM_maxRules != -1):
 				noOfInstances = int(math.ceil(no_of_rules/float(DRAM_maxRules)))
 			else:
 				noOfInstances = 1
-				
-			for i in range(noOfInstances):
-				self.FSBV_DRAM(ruleSet, i, rangeMatching)
+			instanceStride = int(self.fpga_constraints["no_inp_to_LUTS"])
 		else:
+			maxRules = BRAM_maxRules
 			max_brams = int(self.fpga_constraints["max_BRAMs"])
+			bram_width = int(self.fpga_constraints["bram_width"])
 			if(BRAM_maxRules != -1):
 				noOfInstances = int(math.ceil(no_of_rules/float(BRAM_maxRules)))
 				# ASSUME THAT RAM_maxRules is less BRAM Width.
@@ -429,9 +472,14 @@ class Classifier:
 				noOfInstances = 1
 				if(int(math.ceil(no_of_rules/float(bram_width))) > 0.8*max_brams):
 					raise InSufficientBRAMsError; 
-				
-			for i in range(noOfInstances):
-				self.FSBV_BRAM(ruleSet, i, rangeMatching)
+			instanceStride = int(self.fpga_constraints["bram_input_size"])
+		
+		if(maxRules == -1):
+			maxRules = no_of_rules
+		instanceRules = [ruleSet[i*maxRules : (i+1)*maxRules] for i in range(noOfInstances)]
+		# port width padded to whole strides, the instances set it too but may run in other processes
+		self.W1 = -(-self.port_width//instanceStride)*instanceStride
+		self.generateInstances(instanceRules, rangeMatching, useDRAM)
 		
 		W = 9*self.header_width
 		stride = int(self.fpga_constraints["no_inp_to_LUTS"]);
@@ -440,7 +488,35 @@ class Classifier:
 		cns = Consolidator(template_file, self.srcfiles_loc, W, self.W1, stride, noOfInstances, rangeMatching)
 		cns.generateSource()
 	
+	# Runs FSBV_DRAM or FSBV_BRAM for every instance. With generationProcesses > 1 the instances are
+	# built in a process pool, each one writes its own memfiles directories and srcfiles modules.
+	def generateInstances(self, instanceRules, rangeMatching, useDRAM):
+		processes = min(int(self.user_constraints.get("generationProcesses", "1")), len(instanceRules))
+		if(processes <= 1):
+			for (i, rules) in enumerate(instanceRules):
+				(self.FSBV_DRAM if useDRAM else self.FSBV_BRAM)(rules, i, rangeMatching)
+			return
+		
+		# directories shared by the instances are made before the workers race for them
+		for path in ["srcfiles/", "dramfiles/" if useDRAM else "bramfiles/"]:
+			os.makedirs(self.srcfiles_loc+path, exist_ok=True)
+		# workers get a copy without the whole rule table, and the rules of their instance only
+		worker = copy.copy(self)
+		worker.rules = None
+		manifest = getManifest()
+		with ProcessPoolExecutor(max_workers=processes) as pool:
+			futures = [pool.submit(runWithManifest, manifest, worker.FSBV_DRAM if useDRAM else worker.FSBV_BRAM, rules, i, rangeMatching) for (i, rules) in enumerate(instanceRules)]
+			for future in futures:
+				written = future.result()
+				if manifest is not None:
+					manifest.current.update(written)
+	
 	def BFTop(self, ruleSet, fp_accepted):
+		# rules with wildcard (or prefix) addresses or protocol get one filter per wildcard pattern
+		groups = getWildcardGroups(ruleSet)
+		if len(groups) > 1 or groups[0][0] != KEY_CARE_MASK:
+			self.BFGroupsTop(groups, fp_accepted)
+			return
 		print("Generating Bloom Filter...")
 		no_of_rules=len(ruleSet)
 		memfilespath = self.memfiles_loc+"bloomfilter_wrm/"
@@ -450,13 +526,50 @@ class Classifier:
 		srcPortList = getSrcPortList(ruleSet)
 		dstPortList = getDstPortList(ruleSet)
 		ipProtocolLists = getIPAndProtocolLists(ruleSet)
-		bloom1=BloomFilter(no_of_rules, fp_accepted, ipProtocolLists, srcPortList, dstPortList, memfilespath)
-		[m, k] = bloom1.generateMemory()
+		# bloomTuning picks m, k and the layout under the BRAM budget instead of get_size/get_hash_count
+		# bloomLayout fixes the layout, without tuning an empty bloomLayout is the replicated one
+		# bloomHashing "double" derives the k hashes from two (h1 + i*h2)
+		# bloomExactSize "yes" keeps the filter size the FPR needs instead of the next power of two
+		self.bloomConfig = None
+		self.bloomLayout = self.user_constraints.get("bloomLayout", "")
+		self.bloomHashing = self.user_constraints.get("bloomHashing", "jenkins")
+		if self.user_constraints.get("bloomTuning", "no") == "yes":
+			self.bloomConfig = self.tuneBloomFilter(ruleSet, fp_accepted)
+			self.bloomLayout = self.bloomConfig.layout
+			bloom1=BloomFilter(no_of_rules, fp_accepted, ipProtocolLists, srcPortList, dstPortList, memfilespath, self.bloomConfig.m, self.bloomConfig.k, self.bloomLayout, self.bloomHashing)
+		else:
+			self.bloomLayout = self.bloomLayout or "replicated"
+			bloom1=BloomFilter(no_of_rules, fp_accepted, ipProtocolLists, srcPortList, dstPortList, memfilespath, layout=self.bloomLayout, hashing=self.bloomHashing, exactSize=self.user_constraints.get("bloomExactSize", "no") == "yes")
+		# bloomMemFormat "hex" adds bloomfilter.hex, a compact copy of bloomfilter.mem in 32 bit words
+		[m, k] = bloom1.generateMemory(self.user_constraints.get("bloomMemFormat", "bin"))
+		if self.bloomConfig is not None:
+			with openOutput(memfilespath+"bloomfilter.json", "w") as fh:
+				json.dump(self.bloomConfig._asdict(), fh, indent=4)
 		print("Memory required:", m)
 		print("Hash count:", k)
+		# exactMatchConfirm "yes" puts an exact-match table of the rules behind the filter, a header
+		# that passes the filter is only accepted if it is a rule
+		self.exactTable = None
+		if self.user_constraints.get("exactMatchConfirm", "no") == "yes":
+			self.exactTable = ExactMatchTable(bloom1.getKeys(), memfilespath)
+			[buckets, slots] = self.exactTable.generateMemory()
+			print("Exact match buckets:", buckets)
+		# bloomQueryCheck > 0 queries the built filter with that many random headers
+		samples = int(self.user_constraints.get("bloomQueryCheck", "0"))
+		if samples > 0:
+			bq = BloomQuery.fromMem([memfilespath+name for name in bloomMemFiles(self.bloomLayout, k)], k, self.bloomLayout, self.bloomHashing)
+			keys = randomKeys(samples, np.random.default_rng(1))
+			members = memberMask(keys, tableKeys(ruleSet))
+			printReport(bq.report(keys, members))
+			if self.exactTable is not None:
+				accepted = bq.contains(keys) & self.exactTable.contains(keys)
+				print("False positives after exact match confirmation:", int((accepted & ~members).sum()))
 		self.W1 = 16 ####################### Added based on class BF_PACKET_MATCH - if optim required then can be modified
 
-		if(self.parallelBFRequired):
+		if self.bloomConfig is not None or self.bloomLayout != "replicated":
+			# the tuned and the partitioned/blocked layouts already read all lookups in parallel
+			noOfInstances = 1
+		elif(self.parallelBFRequired):
 			requiredMem = 2*k*m 
 			bramSize = bram_width* (2**bram_input_size)
 			if(requiredMem > bramSize):
@@ -477,20 +590,151 @@ class Classifier:
 		cns.generateSource()
 				        		
         		
+	# Runs the bloomTuner, with bloomMaxLatency as the lookup latency budget in cycles and
+	# bloomTuningSamples random headers for the empirical check of the chosen candidate
+	def tuneBloomFilter(self, ruleSet, fp_accepted):
+		maxLatency = self.user_constraints.get("bloomMaxLatency", "")
+		maxLatency = int(maxLatency) if maxLatency else None
+		samples = int(self.user_constraints.get("bloomTuningSamples", "0"))
+		measure = None
+		if samples > 0:
+			keys = randomKeys(samples, np.random.default_rng(1))
+			members = memberMask(keys, tableKeys(ruleSet))
+			def measure(config):
+				bloom = BloomFilter(len(ruleSet), fp_accepted, getIPAndProtocolLists(ruleSet), getSrcPortList(ruleSet), getDstPortList(ruleSet), "", config.m, config.k, config.layout, self.bloomHashing)
+				return BloomQuery(bloom.buildMemories(config.m), config.m, config.k, config.layout, self.bloomHashing).report(keys, members)["measuredFpr"]
+		layouts = [self.user_constraints["bloomLayout"]] if self.user_constraints.get("bloomLayout", "") else None
+		config = tuneBloom(len(ruleSet), fp_accepted, self.fpga_constraints, maxLatency, layouts, measure)
+		if config is None:
+			raise InSufficientBRAMsError
+		print("Bloom filter tuned:", configComment(config)[3:].strip())
+		return config
+
+	# Rules with wildcard (or prefix) addresses or protocol get one cuckoo filter per wildcard pattern,
+	# probed with the masked header as the groups of BFGroupsTop
+	def CFTop(self, ruleSet, fp_accepted):
+		groups = getWildcardGroups(ruleSet)
+		grouped = len(groups) > 1 or groups[0][0] != KEY_CARE_MASK
+		if grouped:
+			print("Generating Cuckoo Filters for", len(groups), "wildcard groups...")
+		else:
+			print("Generating Cuckoo Filter...")
+		rangeMatching = False
+		# a header is probed in every group, each one gets an equal share of the FPR
+		groupFpr = fp_accepted/len(groups)
+		# bloomQueryCheck > 0 queries the built filters with that many random headers
+		samples = int(self.user_constraints.get("bloomQueryCheck", "0"))
+		keys = randomKeys(samples, np.random.default_rng(1))
+		passed = np.zeros(samples, dtype=bool)
+		members = np.zeros(samples, dtype=bool)
+		for (i, (mask, rules)) in enumerate(groups):
+			memfilespath = self.memfiles_loc+("cuckoofilter"+str(i)+"_wrm/" if grouped else "cuckoofilter_wrm/")
+			cuckoo = CuckooFilter(len(rules), groupFpr, getIPAndProtocolLists(rules), getSrcPortList(rules), getDstPortList(rules), memfilespath)
+			[buckets, fingerprintBits] = cuckoo.generateMemory()
+			if grouped:
+				print("Group {}: care mask {:018x}, {} rules".format(i, mask, len(rules)))
+			print("Buckets:", buckets)
+			print("Fingerprint bits:", fingerprintBits)
+			print("Bits per rule: {:.2f}".format(cuckoo.bitsPerRule()))
+			if samples > 0:
+				masked = maskKeys(keys, mask)
+				passed |= cuckoo.contains(masked)
+				members |= memberMask(masked, tableKeys(rules))
+
+			# the bucket memory of a filter is a single dual port bram read at both buckets
+			keyword1 = str(i)+"_wrm"
+			stride = max(1, int(math.ceil(math.log(buckets, 2))))
+			bram = BRAM(self.templates_loc+"bram_cuckoo", self.srcfiles_loc, memfilespath, stride, stride, cuckoo.slots*fingerprintBits, "cuckoo", keyword1, buckets)
+			bram.generateSource()
+			cuckooCode = CF_PACKET_MATCH(self.templates_loc, self.srcfiles_loc, buckets, fingerprintBits, cuckoo.slots, keyword1, mask if grouped else None)
+			cuckooCode.generateSource()
+		if samples > 0:
+			negatives = ~members
+			print("Measured FPR: {:.6f}".format((passed & negatives).sum() / float(max(1, negatives.sum()))))
+		self.W1 = 16
+
+		template_file = self.templates_loc+"consolidator"
+		W = 9*self.header_width
+		cns = Consolidator(template_file, self.srcfiles_loc, W, self.W1, 1, len(groups), rangeMatching, "cuckoofilter_")
+		cns.generateSource()
+
 	def BF_BRAM(self, noOfInstances, rangeMatching, m, k):
 		if(rangeMatching==False):
-			## Generate BRAM files
-			template_file = self.templates_loc+"bram_bf"	
-			stride = int(math.ceil(math.log(m,2)))
-			#print("bloom filter size :" + str(m))
-			
 			for i in range(noOfInstances):
-				keyword1 = str(i)+"_wrm"
-				bram = BRAM(template_file, self.srcfiles_loc, self.memfiles_loc+"bloomfilter_wrm/", stride, stride, int(1), "bloom", keyword1)
-				bram.generateSource()		
+				self.bloomInstance(str(i)+"_wrm", self.memfiles_loc+"bloomfilter_wrm/", m, k)
 
-				bloomCode = BF_PACKET_MATCH(self.templates_loc, self.srcfiles_loc, m, k, keyword1)
-				bloomCode.generateSource()	
+	# BRAM modules and BF_PACKET_MATCH of one filter, mask (72 bits, see BF_PACKET_MATCH) for a wildcard group
+	def bloomInstance(self, keyword1, memfilespath, m, k, mask=None):
+		## Generate BRAM files
+		template_file = self.templates_loc+"bram_bf"	
+		stride = int(math.ceil(math.log(m,2)))
+		#print("bloom filter size :" + str(m))
+		# one bram module per memory of the layout: bram_bloom<i>_<instance> reads bloomfilter<i>.mem
+		memories = len(bloomMemFiles(self.bloomLayout, k))
+		bram_width = 1
+		depth = m
+		if(self.bloomLayout == "blocked"):
+			template_file = self.templates_loc+"bram_bf_blocked"
+			bram_width = BLOOM_BLOCK_BITS
+			depth = m//BLOOM_BLOCK_BITS
+			stride = int(math.ceil(math.log(depth,2)))
+		
+		bram = BRAM(template_file, self.srcfiles_loc, memfilespath, memories*stride, stride, bram_width, "bloom", keyword1, depth)
+		bram.generateSource()		
+
+		header = "" if self.bloomConfig is None else configComment(self.bloomConfig)
+		confirm = None
+		if self.exactTable is not None:
+			# dual port bram of one bucket per word, bram_exact0_<instance> reads exactmatch.mem
+			confirm = (self.exactTable.buckets, self.exactTable.slots)
+			exactStride = max(1, int(math.ceil(math.log(self.exactTable.buckets, 2))))
+			bram = BRAM(self.templates_loc+"bram_cuckoo", self.srcfiles_loc, memfilespath, exactStride, exactStride, self.exactTable.slots*EXACT_SLOT_BITS, "exact", keyword1, self.exactTable.buckets)
+			bram.generateSource()
+		bloomCode = BF_PACKET_MATCH(self.templates_loc, self.srcfiles_loc, m, k, keyword1, header, self.bloomLayout, self.bloomHashing, confirm, mask)
+		bloomCode.generateSource()	
+
+	# One filter per wildcard pattern of the rules, like the per prefix length filters of LPM. A
+	# header is masked with the pattern of each group and probed in all of them in parallel, the
+	# groups are the instances the consolidator ors.
+	def BFGroupsTop(self, groups, fp_accepted):
+		print("Generating Bloom Filters for", len(groups), "wildcard groups...")
+		self.bloomConfig = None
+		self.bloomLayout = self.user_constraints.get("bloomLayout", "") or "replicated"
+		self.bloomHashing = self.user_constraints.get("bloomHashing", "jenkins")
+		if self.user_constraints.get("bloomTuning", "no") == "yes":
+			print("bloomTuning is not used for wildcard groups, each group is sized for its share of the FPR")
+		# a header is probed in every group, each one gets an equal share of the FPR
+		groupFpr = fp_accepted/len(groups)
+		samples = int(self.user_constraints.get("bloomQueryCheck", "0"))
+		keys = randomKeys(samples, np.random.default_rng(1))
+		passed = np.zeros(samples, dtype=bool)
+		members = np.zeros(samples, dtype=bool)
+		for (i, (mask, rules)) in enumerate(groups):
+			memfilespath = self.memfiles_loc+"bloomfilter"+str(i)+"_wrm/"
+			bloom = BloomFilter(len(rules), groupFpr, getIPAndProtocolLists(rules), getSrcPortList(rules), getDstPortList(rules), memfilespath, layout=self.bloomLayout, hashing=self.bloomHashing, exactSize=self.user_constraints.get("bloomExactSize", "no") == "yes")
+			[m, k] = bloom.generateMemory(self.user_constraints.get("bloomMemFormat", "bin"))
+			print("Group {}: care mask {:018x}, {} rules, memory {}, hash count {}".format(i, mask, len(rules), m, k))
+			self.exactTable = None
+			if self.user_constraints.get("exactMatchConfirm", "no") == "yes":
+				self.exactTable = ExactMatchTable(bloom.getKeys(), memfilespath)
+				self.exactTable.generateMemory()
+			if samples > 0:
+				masked = maskKeys(keys, mask)
+				bq = BloomQuery.fromMem([memfilespath+name for name in bloomMemFiles(self.bloomLayout, k)], k, self.bloomLayout, self.bloomHashing)
+				found = bq.contains(masked)
+				if self.exactTable is not None:
+					found &= self.exactTable.contains(masked)
+				passed |= found
+				members |= memberMask(masked, tableKeys(rules))
+			self.bloomInstance(str(i)+"_wrm", memfilespath, m, k, mask)
+		if samples > 0:
+			negatives = ~members
+			print("Measured FPR over all groups: {:.6f}".format((passed & negatives).sum() / float(max(1, negatives.sum()))))
+		self.W1 = 16
+		template_file = self.templates_loc+"consolidator"
+		W = 9*self.header_width
+		cns = Consolidator(template_file, self.srcfiles_loc, W, self.W1, 1, len(groups), False)
+		cns.generateSource()
 
 class InSufficientBRAMsError(Exception):
     """Exception raised for errors in the input salary.
@@ -503,52 +747,41 @@ class InSufficientBRAMsError(Exception):
         self.message = message
         super().__init__(self.message)
 	
+# The helpers below take a RuleTable and return views of its columns, no values are copied or re-parsed
 def getSrcPortList(rules):
-	srcPortList = []	
-	no_of_rules = len(rules)
-	for i in range(no_of_rules):
-		srcPortList.append(rules[i]["src_port_min"])
-	
-	return [srcPortList]
+	return [rules.src_port_min]
 	
 def getDstPortList(rules):
-	dstPortList = []	
-	no_of_rules = len(rules)
-	for i in range(no_of_rules):
-		dstPortList.append(rules[i]["dst_port_min"])
-	
-	return [dstPortList]	
+	return [rules.dst_port_min]	
 
+def getSrcPortListWithRanges(rules):
+	return [rules.src_port_min, rules.src_port_max]
+
+def getDstPortListWithRanges(rules):
+	return [rules.dst_port_min, rules.dst_port_max]
 	
 def getIPAndProtocolLists(rules):
 	# 1 Rule is represented by 9 Decimal Values 4 each of Src IP and Dst IP and 1 of Protocol field
-	# The loop converts decimal value of Src IP, Dst IP, Protocol from header fields into binary values and merges them to produce 72 bit rule
-	src_ip_field0 = []
-	src_ip_field1 = []
-	src_ip_field2 = []
-	src_ip_field3 = []
-	dst_ip_field0 = []
-	dst_ip_field1 = []
-	dst_ip_field2 = []
-	dst_ip_field3 = []
-	protocol = []
-	no_of_rules = len(rules)
-	for i in range(no_of_rules):		
-		src_ip_fields = rules[i]["src_ip"].split(".")
-		src_ip_field0.append(src_ip_fields[0])
-		src_ip_field1.append(src_ip_fields[1])
-		src_ip_field2.append(src_ip_fields[2])
-		src_ip_field3.append(src_ip_fields[3])
-
-		dst_ip_fields = rules[i]["dst_ip"].split(".")
-		dst_ip_field0.append(dst_ip_fields[0])
-		dst_ip_field1.append(dst_ip_fields[1])
-		dst_ip_field2.append(dst_ip_fields[2])
-		dst_ip_field3.append(dst_ip_fields[3])
-
-		protocol.append(rules[i]["protocol"])
-	
-	return [src_ip_field0,src_ip_field1,src_ip_field2,src_ip_field3,dst_ip_field0,dst_ip_field1,dst_ip_field2,dst_ip_field3,protocol]
+	# Each list is a uint8 column, the memory generators merge them into the 72 bit rule
+	return [rules.src_ip[:,0],rules.src_ip[:,1],rules.src_ip[:,2],rules.src_ip[:,3],rules.dst_ip[:,0],rules.dst_ip[:,1],rules.dst_ip[:,2],rules.dst_ip[:,3],rules.protocol]
+
+# Don't care bits of the getIPAndProtocolLists columns, the FSBV tables match every value in them
+def getIPAndProtocolWildLists(rules):
+	return [rules.src_wild[:,0],rules.src_wild[:,1],rules.src_wild[:,2],rules.src_wild[:,3],rules.dst_wild[:,0],rules.dst_wild[:,1],rules.dst_wild[:,2],rules.dst_wild[:,3],rules.protocol_wild*np.uint8(0xff)]
+
+# (care mask, rules) of every wildcard pattern of the rules, the patterns with the most care bits first
+# The mask has the ip_pro layout of BF_PACKET_MATCH: src ip in bits 71-40, dst ip 39-8, protocol 7-0.
+def getWildcardGroups(rules):
+	(src_ip, src_wild) = rules.packedSrc()
+	(dst_ip, dst_wild) = rules.packedDst()
+	patterns = np.stack([src_wild, dst_wild, rules.protocol_wild.astype(np.uint32)], axis=1)
+	(unique, inverse) = np.unique(patterns, axis=0, return_inverse=True)
+	groups = []
+	for (g, (srcWild, dstWild, protocolWild)) in enumerate(unique.tolist()):
+		mask = KEY_CARE_MASK & ~((srcWild << 40) | (dstWild << 8) | (0xff if protocolWild else 0))
+		groups.append((mask, rules[np.flatnonzero(inverse.ravel() == g)]))
+	groups.sort(key=lambda group: -bin(group[0]).count("1"))
+	return groups
 
 if __name__ == "__main__":
 	## getting inputs
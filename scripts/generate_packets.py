@@ -1,23 +1,30 @@
 # Python code to generate in_eth testing packets - This is to be repeated for each ethernet port
-import json
 import random
 import argparse
 from array import array
 import os
+import sys
+
+# Run as python -m scripts.generate_packets or as python scripts/generate_packets.py, the latter
+# needs the repository root on the path for the scripts package
+try:
+	from scripts.ruleTable import RuleTable
+except ImportError:
+	sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+	from scripts.ruleTable import RuleTable
 
 accept_rules = []
 reject_rules = []
 
+# The rules are streamed into a RuleTable, indexing it gives back a rule dict,
+# so random.choices picks headers from it like from a list of rules
 def read_rules(rules_file):
-	rfile_handle = open(rules_file,"r")
-	rules = json.load(rfile_handle)["rules"]
-
-	for rule in rules:
-		action_type = rule.pop('action')
-		if action_type == "ACCEPT":
-			accept_rules.append(rule)
-		else:
-			reject_rules.append(rule)
+	global accept_rules, reject_rules
+	rules = RuleTable.fromFile(rules_file)
+
+	accept = rules.action == rules.actionCode("ACCEPT")
+	accept_rules = rules[accept]
+	reject_rules = rules[~accept]
 
 def random_header_generator(n):
 	rand_headers = []
@@ -35,333 +35,342 @@
 
 import os
 import re
+import json
 import math
+import numpy as np
+
+from scripts.outputManifest import openOutput
+
+# Bits per line of the compact hex form of bloomfilter.mem
+BLOOM_HEX_WIDTH = 32
+# Bits per block when a .mem file is written
+MEM_WRITE_BLOCK = 1 << 20
+# Memory layouts of the bloom filter:
+# replicated - every one of the 2k lookups reads its own copy of one m bit filter
+# partitioned - lookup i reads its own m bit filter, which only lookup i sets
+# blocked - the k ip/protocol bits and the k port bits of a key each fall in one BLOOM_BLOCK_BITS bit
+#   word of an m bit memory, so both memories are read once per lookup
+BLOOM_LAYOUTS = ("replicated", "partitioned", "blocked")
+BLOOM_BLOCK_BITS = 64
+# Cycles of the hash/hash_port cores of bf_packet_match from the header to the digest
+HASH_PIPELINE_LATENCY = 9
+# Hashing of the bloom filter:
+# jenkins - k seeded Jenkins hashes per key
+# double - two Jenkins hashes h1, h2 per key and the k digests h1 + i*h2 (h2 made odd)
+BLOOM_HASHINGS = ("jenkins", "double")
+
+# Bit array of nbits with the given positions set, 8 bits per byte with bit i at (i>>3, i&7)
+def packBits(indices, nbits):
+	packed = np.zeros((nbits+7)//8, dtype=np.uint8)
+	setBits(packed, indices)
+	return packed
+
+def setBits(packed, indices):
+	indices = np.asarray(indices, dtype=np.int64).ravel()
+	np.bitwise_or.at(packed, indices >> 3, (np.uint8(1) << (indices & 7).astype(np.uint8)))
+
+# Writes the first nbits of a packBits array in the $readmemb format, as "0 "/"1 " per bit or, for
+# a width bit wide memory, one word per line with bit i at bit i%width of word i//width
+def writeBitsMem(filename, packed, nbits, width=1):
+	step = MEM_WRITE_BLOCK - MEM_WRITE_BLOCK % width
+	with openOutput(filename, "wb") as outfile:
+		for start in range(0, nbits, step):
+			end = min(start+step, nbits)
+			bits = np.unpackbits(packed[start//8:(end+7)//8], bitorder="little")[:end-start]
+			if width == 1:
+				text = np.full(2*len(bits), ord(" "), dtype=np.uint8)
+				text[0::2] = bits + ord("0")
+			else:
+				text = np.full((len(bits)//width, width+1), ord("\n"), dtype=np.uint8)
+				text[:, :width] = bits.reshape(-1, width)[:, ::-1] + ord("0")
+			outfile.write(text.tobytes())
+
+# Reads a file written by writeBitsMem back into (packBits array, number of bits)
+def readBitsMem(filename, width=1):
+	text = np.fromfile(filename, dtype=np.uint8)
+	digits = text[(text == ord("0")) | (text == ord("1"))] - ord("0")
+	bits = digits.reshape(-1, width)[:, ::-1].ravel()
+	return (np.packbits(bits, bitorder="little"), len(bits))
+
+# Writes a packBits array as one width bit hex word per line, for $readmemh into a width bit wide
+# memory. Bit i of the array is bit i%width of word i//width; the last word is padded with 0s.
+def writeBitsHex(filename, packed, nbits, width):
+	wordBytes = width//8
+	words = -(-nbits // width)
+	data = np.zeros(words*wordBytes, dtype=np.uint8)
+	data[:(nbits+7)//8] = packed[:(nbits+7)//8]
+	text = data.reshape(words, wordBytes)[:, ::-1].tobytes().hex()
+	digits = 2*wordBytes
+	blockChars = MEM_WRITE_BLOCK - MEM_WRITE_BLOCK % digits
+	with openOutput(filename, "w") as outfile:
+		for start in range(0, len(text), blockChars):
+			block = text[start:start+blockChars]
+			outfile.write("".join(block[i:i+digits]+"\n" for i in range(0, len(block), digits)))
+
+# Initial (a, b, c) of the Jenkins hash for hash function i, the b0 of the hash cores of BF_PACKET_MATCH
+def jenkinsSeed(i):
+	return (np.uint32(0xdeadbef8), np.uint32(int("deadbef"+"{}".format(i+1),16) & 0xffffffff), np.uint32(0xdeadbef8))
+
+def rot(x, k):
+	return (x << np.uint32(k)) | (x >> np.uint32(32-k))
+
+# Final mixing of the Jenkins hash on uint32 arrays, as the hash and hash_port cores for every element.
+# a, b, c already hold the seed plus the key words; uint32 arithmetic wraps like the 32 bit registers.
+def jenkinsFinal(a, b, c):
+	a = np.asarray(a, dtype=np.uint32)
+	b = np.asarray(b, dtype=np.uint32)
+	c = np.asarray(c, dtype=np.uint32)
+	c = (c ^ b) - rot(b, 14)
+	a = (a ^ c) - rot(c, 11)
+	b = (b ^ a) - rot(a, 25)
+	c = (c ^ b) - rot(b, 16)
+	a = (a ^ c) - rot(c, 4)
+	b = (b ^ a) - rot(a, 14)
+	c = (c ^ b) - rot(b, 24)
+	return c
+
+# (hash72, hash32) digests of hash function i, as computed by the hash/hash_port cores of BF_PACKET_MATCH
+# keys are the uint32 arrays [src ip, dst ip, protocol, src port << 16 | dst port]
+def bloomDigests(i, keys):
+	[k0, k1, k2, k01] = keys
+	(a0, b0, c0) = jenkinsSeed(i)
+	return (jenkinsFinal(a0 + k0, b0 + k1, c0 + (k2 & 0xff)),
+		jenkinsFinal(a0 + k01, np.full_like(k01, b0), np.full_like(k01, c0)))
+
+# Number of memories and their .mem files for a layout with k hash functions
+def bloomMemFiles(layout, k):
+	if layout not in BLOOM_LAYOUTS:
+		raise ValueError("Unknown bloom filter layout "+layout)
+	if layout == "replicated":
+		return ["bloomfilter.mem"]
+	return ["bloomfilter{}.mem".format(i) for i in range(2*k if layout == "partitioned" else 2)]
+
+# Index of each digest in a memory of size entries from its low bits bits: the low bits for a power
+# of two, else the multiply-shift reduction (low bits * size) >> bits
+def reduceDigest(digest, size, bits=32):
+	if size & (size-1) == 0:
+		return digest & np.uint32(size-1)
+	low = digest.astype(np.uint64) & np.uint64((1 << bits)-1)
+	return ((low * np.uint64(size)) >> np.uint64(bits)).astype(np.uint32)
+
+# (hash72, hash32) digests of the k hash functions in turn
+def hashSequence(keys, k, hashing="jenkins"):
+	if hashing not in BLOOM_HASHINGS:
+		raise ValueError("Unknown bloom filter hashing "+hashing)
+	if hashing == "jenkins":
+		for i in range(k):
+			yield bloomDigests(i, keys)
+		return
+	h1 = bloomDigests(0, keys)
+	h2 = [digest | np.uint32(1) for digest in bloomDigests(1, keys)] if k > 1 else h1
+	for i in range(k):
+		yield tuple(a + np.uint32(i)*b for (a, b) in zip(h1, h2))
+
+# The 2k lookups of BF_PACKET_MATCH for the keys as (lookup, memory, bit indices)
+# Lookups 0..k-1 use the hash72 digests of the ips and protocol, k..2k-1 the hash32 digests of the
+# ports. m is the size of one memory; in the blocked layout the word comes from the low bits of the
+# first digest and the bit in the word from the high bits of each digest. The word is reduced from
+# the low 32-log2(blockBits) bits only, so it stays independent of the first digest's bit offset.
+def bloomLookups(layout, keys, m, k, hashing="jenkins", blockBits=BLOOM_BLOCK_BITS):
+	memories = len(bloomMemFiles(layout, k))
+	shift = np.uint32(32-int(math.log(blockBits, 2)))
+	for (i, digests) in enumerate(hashSequence(keys, k, hashing)):
+		if i == 0 and layout == "blocked":
+			words = [reduceDigest(digest, m//blockBits, int(shift)).astype(np.int64)*blockBits for digest in digests]
+		for (half, digest) in enumerate(digests):
+			lookup = half*k+i
+			if layout == "blocked":
+				yield (lookup, half, words[half] + (digest >> shift))
+			else:
+				yield (lookup, lookup % memories, reduceDigest(digest, m))
+
+# Digit values of the hex characters, 255 for anything else
+HEX_DIGITS = np.full(256, 255, dtype=np.uint32)
+HEX_DIGITS[np.frombuffer(b"0123456789", dtype=np.uint8)] = np.arange(10)
+HEX_DIGITS[np.frombuffer(b"abcdef", dtype=np.uint8)] = np.arange(10, 16)
+HEX_DIGITS[np.frombuffer(b"ABCDEF", dtype=np.uint8)] = np.arange(10, 16)
+
+# Column of hex strings (or of integers) as uint32, without a Python int() per value
+def hexColumn(values):
+	values = np.asarray(values)
+	if values.dtype.kind in "iu":
+		return values.astype(np.uint32)
+	if values.dtype.kind not in "US":
+		values = values.astype(str)
+	# one code per character, unicode strings are UCS4, padded with 0s on the right
+	codeType = np.uint32 if values.dtype.kind == "U" else np.uint8
+	width = values.dtype.itemsize//np.dtype(codeType).itemsize
+	chars = np.ascontiguousarray(values).view(codeType).reshape(len(values), width)
+	column = np.zeros(len(values), dtype=np.uint32)
+	for j in range(width):
+		present = chars[:, j] != 0
+		digit = HEX_DIGITS[np.minimum(chars[:, j], 255)]
+		if (present & (digit == 255)).any():
+			raise ValueError("Invalid hex value in IPv6 address column")
+		column = np.where(present, (column << np.uint32(4)) | digit, column)
+	return column
+
+# (sip96, dip96, hash72, hash32) digests of hash function i for the getKeys_ip6 keys
+def bloomDigests_ip6(i, keys):
+	[k0_0, k0_1, k0_2, k1_0, k1_1, k1_2, k2_0, k2_1, k2_2, k01] = keys
+	(a0, b0, c0) = jenkinsSeed(i)
+	return (jenkinsFinal(a0 + k0_0, b0 + k0_1, c0 + k0_2),
+		jenkinsFinal(a0 + k1_0, b0 + k1_1, c0 + k1_2),
+		jenkinsFinal(a0 + k2_0, b0 + k2_1, c0 + (k2_2 & 0xff)),
+		jenkinsFinal(a0 + k01, np.full_like(k01, b0), np.full_like(k01, c0)))
+
+IP6_KEY_NAMES = ["k0_0", "k0_1", "k0_2", "k1_0", "k1_1", "k1_2", "k2_0", "k2_1", "k2_2", "k01"]
+IP6_DIGEST_NAMES = ["digest_sip96", "digest_dip96", "digest72", "digest32"]
+
+# One JSON line per rule: its keys and, per hash function, its four digests (the bits it sets)
+def writeDebug_ip6(outfile, keys, digests):
+	for rule in range(len(keys[0])):
+		line = dict((name, int(key[rule])) for (name, key) in zip(IP6_KEY_NAMES, keys))
+		line["rule"] = rule
+		line["digests"] = [dict((name, int(digest[rule])) for (name, digest) in zip(IP6_DIGEST_NAMES, indices)) for indices in digests]
+		outfile.write(json.dumps(line)+"\n")
+
+# Keys of every rule as uint32 arrays: src ip, dst ip and protocol as 32/32/8 bit words and both ports as one 32 bit word
+# ipAndProtocolList and the port lists are the uint8/uint16 columns of a RuleTable
+def ruleKeys(ipAndProtocolList, srcPortList, dstPortList):
+	src = [np.asarray(ipAndProtocolList[f], dtype=np.uint32) for f in range(4)]
+	dst = [np.asarray(ipAndProtocolList[f], dtype=np.uint32) for f in range(4,8)]
+	k0 = (src[0] << 24) | (src[1] << 16) | (src[2] << 8) | src[3]
+	k1 = (dst[0] << 24) | (dst[1] << 16) | (dst[2] << 8) | dst[3]
+	k2 = np.asarray(ipAndProtocolList[8], dtype=np.uint32)
+	k01 = (np.asarray(srcPortList[0], dtype=np.uint32) << 16) | np.asarray(dstPortList[0], dtype=np.uint32)
+	return [k0, k1, k2, k01]
+
+# Care bits of the 72 bit ip_pro key of BF_PACKET_MATCH: src ip in bits 71-40, dst ip 39-8, protocol 7-0
+KEY_CARE_MASK = (1 << 72) - 1
+
+# Keys (as in ruleKeys) with the don't care bits of a wildcard group cleared, mask as KEY_CARE_MASK
+def maskKeys(keys, mask):
+	return [np.asarray(keys[0], dtype=np.uint32) & np.uint32((mask >> 40) & 0xffffffff),
+		np.asarray(keys[1], dtype=np.uint32) & np.uint32((mask >> 8) & 0xffffffff),
+		np.asarray(keys[2], dtype=np.uint32) & np.uint32(mask & 0xff),
+		np.asarray(keys[3], dtype=np.uint32)]
 
 #Class for Bloom filter, using jenkins hash function
 class BloomFilter(object):
 
-	def __init__(self, no_of_rules, fp_prob, ipAndProtocolList, srcPortList, dstPortList, memfiles_loc):
+	def __init__(self, no_of_rules, fp_prob, ipAndProtocolList, srcPortList, dstPortList, memfiles_loc, m=None, k=None, layout="replicated", hashing="jenkins", exactSize=False):
 		
 		#items_count : (int) Number of rules expected to be stored in bloom filter
 		# fp_prob : (float) False Positive probability in decimal given in the user_constraint file
+		# m, k : size of one memory and hash count chosen by the bloomTuner, computed from fp_prob if not given
+		# layout : one of BLOOM_LAYOUTS, hashing : one of BLOOM_HASHINGS
+		# exactSize : (bool) keep the size fp_prob needs instead of rounding it up to a power of two
 		
 		# False positive probability in decimal
 		self.fp_prob = fp_prob
+		if layout not in BLOOM_LAYOUTS:
+			raise ValueError("Unknown bloom filter layout "+layout)
+		self.layout = layout
+		if hashing not in BLOOM_HASHINGS:
+			raise ValueError("Unknown bloom filter hashing "+hashing)
+		self.hashing = hashing
 
 		# Size of bit array to use
-		self.size = self.get_size(no_of_rules, fp_prob)
+		if m is not None:
+			self.size = m
+		elif exactSize:
+			self.size = int(math.ceil(-(no_of_rules * math.log(fp_prob))/(math.log(2)**2)))
+		else:
+			self.size = self.get_size(no_of_rules, fp_prob)
 
 		# number of hash functions to use
-		self.hash_count = self.get_hash_count(self.size, no_of_rules)
+		self.hash_count = self.get_hash_count(self.size, no_of_rules) if k is None else k
+		if m is None and layout == "partitioned":
+			# each lookup sets 1 bit per rule in its own filter, 1/2k of the shared filter keeps its FPR
+			self.size = max(2, int(math.ceil(self.size/(2.0*self.hash_count))) if exactSize else self.size//(2*self.hash_count))
+		elif m is None and layout == "blocked":
+			# whole words
+			self.size = max(2*BLOOM_BLOCK_BITS, -(-self.size//BLOOM_BLOCK_BITS)*BLOOM_BLOCK_BITS)
+		if m is None and not exactSize:
+			self.size = 1 << int(math.ceil(math.log(self.size,2)))
 		self.ipAndProtocolList = ipAndProtocolList
 		self.dstPortList = dstPortList		
 		self.srcPortList = srcPortList
 		self.memfiles_loc = memfiles_loc
 		self.no_of_rules = no_of_rules
 		
-	def generateMemory(self):
-		mem_array=[]
-		str1=0
-		bitsReqd = int(math.ceil(math.log(self.size,2)))
-		memSize = (1 << bitsReqd)
-		for i in range(memSize):
-			mem_array.append(str1)
-
-		for i in range(self.no_of_rules):
-			k0= int("{0:08b}".format(int(self.ipAndProtocolList[0][i]))+"{0:08b}".format(int(self.ipAndProtocolList[1][i]))+"{0:08b}".format(int(self.ipAndProtocolList[2][i]))+"{0:08b}".format(int(self.ipAndProtocolList[3][i])),2)
-			k1= int("{0:08b}".format(int(self.ipAndProtocolList[4][i]))+"{0:08b}".format(int(self.ipAndProtocolList[5][i]))+"{0:08b}".format(int(self.ipAndProtocolList[6][i]))+"{0:08b}".format(int(self.ipAndProtocolList[7][i])),2)
-			k2= int("{0:08b}".format(int(self.ipAndProtocolList[8][i])),2)
-			k01=int("{0:016b}".format(int(self.srcPortList[0][i]))+"{0:016b}".format(int(self.dstPortList[0][i])),2)
-			self.add_rule(k0,k1,k2,k01,mem_array)	
+	# Writes one .mem file per memory of the layout (bloomMemFiles), the blocked ones as BLOOM_BLOCK_BITS bit words
+	# memFormat "hex" also writes a .hex file of each, the same bits as BLOOM_HEX_WIDTH (or block) bit words
+	def generateMemory(self, memFormat="bin"):
+		memSize = self.size
+		memories = self.buildMemories(memSize)
+		width = BLOOM_BLOCK_BITS if self.layout == "blocked" else 1
         	
 		path=self.memfiles_loc
 		if(os.path.isdir(path) is False):
 			os.mkdir(path)		
 
-		outfile = open(path+"bloomfilter" + ".mem","w+")
-		str1="0 "
-		str2="1 "
-		for i in range(0,memSize):
-			if(mem_array[i]==1):
-				outfile.write(str2)
-			else:
-				outfile.write(str1)
-		outfile.close()	
+		for (name, mem_array) in zip(bloomMemFiles(self.layout, self.hash_count), memories):
+			writeBitsMem(path+name, mem_array, memSize, width)
+			if memFormat == "hex":
+				writeBitsHex(path+name[:-len(".mem")]+".hex", mem_array, memSize, max(width, BLOOM_HEX_WIDTH))
 		return [memSize, self.hash_count]
 	
-	def generateMemory_ip6(self):
-		mem_array=[]
-		str1=0
+	# IPv6 filter, all rules at once with NumPy like generateMemory, the 4 digests of every hash function set a bit each
+	# debug, a writable file, gets one JSON line per rule with its keys and the digests of every hash function
+	def generateMemory_ip6(self, debug=None):
 		bitsReqd = int(math.ceil(math.log(self.size,2)))
 		memSize = (1 << bitsReqd)
-		for i in range(memSize):
-			mem_array.append(str1)
-	
-		
-		for i in range(self.no_of_rules):
-			k0_0= int("{0:016b}".format(int(self.ipAndProtocolList[0][i],16))+"{0:016b}".format(int(self.ipAndProtocolList[1][i],16)),2)
-			
-			k0_1= int("{0:016b}".format(int(self.ipAndProtocolList[2][i],16))+"{0:016b}".format(int(self.ipAndProtocolList[3][i],16)),2)
-			
-			k0_2= int("{0:016b}".format(int(self.ipAndProtocolList[4][i],16))+"{0:016b}".format(int(self.ipAndProtocolList[5][i],16)),2)
-			
-			k1_0= int("{0:016b}".format(int(self.ipAndProtocolList[10][i],16))+"{0:016b}".format(int(self.ipAndProtocolList[11][i],16)),2)
-			
-			
-			k1_1= int("{0:016b}".format(int(self.ipAndProtocolList[12][i],16))+"{0:016b}".format(int(self.ipAndProtocolList[13][i],16)),2)
-			
-			k1_2= int("{0:016b}".format(int(self.ipAndProtocolList[6][i],16))+"{0:016b}".format(int(self.ipAndProtocolList[7][i],16)),2)
-			
-			k2_0= int("{0:016b}".format(int(self.ipAndProtocolList[8][i],16))+"{0:016b}".format(int(self.ipAndProtocolList[9][i],16)),2)
-		
-			k2_1= int("{0:016b}".format(int(self.ipAndProtocolList[14][i],16))+"{0:016b}".format(int(self.ipAndProtocolList[15][i],16)),2)
-			
-			k2_2= int("{0:08b}".format(int(self.ipAndProtocolList[16][i])),2)
-			
-			src_port=(self.srcPortList[0][i])
-			#print("srcport:",src_port)
-			
-			dst_port=(self.dstPortList[0][i])
-			#print("dstport:",dst_port)
-			
-			k01=int("{0:016b}".format(int(src_port))+"{0:016b}".format(int(dst_port)),2)
-			print("k0_0:",k0_0)
-			print("k0_1:",k0_1)
-			print("k0_2:",k0_2)
-			print("k1_0:",k1_0)
-			print("k1_1:",k1_1)
-			print("k1_2:",k1_2)
-			print("k2_0:",k2_0)
-			print("k2_1:",k2_1)
-			print("k2_2:",k2_2)
-			print("k01:",k01)
-			self.add_rule_ip6(k0_0,k0_1,k0_2,k1_0,k1_1,k1_2,k2_0,k2_1,k2_2,k01,mem_array)	
+		mem_array = packBits([], memSize)
+		keys = self.getKeys_ip6()
+		digests = []
+		for i in range(self.hash_count):
+			indices = [digest % np.uint32(self.size) for digest in bloomDigests_ip6(i, keys)]
+			for index in indices:
+				setBits(mem_array, index)
+			if debug is not None:
+				digests.append(indices)
+		if debug is not None:
+			writeDebug_ip6(debug, keys, digests)
 			
 		path=self.memfiles_loc
 		if(os.path.isdir(path) is False):
 			os.mkdir(path)		
 		
-		outfile = open(path+"bloomfilter" + ".mem","w+")
-		str1="0 "
-		str2="1 "
-		for i in range(0,memSize):
-			if(mem_array[i]==1):
-				outfile.write(str2)
-			else:
-				outfile.write(str1)
-		outfile.close()	
+		writeBitsMem(path+"bloomfilter" + ".mem", mem_array, memSize)
 		return [memSize, self.hash_count]
-				
-	
-
-	def add_rule(self,k0,k1,k2,k01,mem_array):
-		digests = []
-		bitsReqd = int(math.ceil(math.log(self.size,2)))
-		memSize = (1 << bitsReqd)
-		for i in range(self.hash_count):
-			a0 = 0xdeadbef8
-			#b0 = 0xdeadbef8
-			b0 = (int("deadbef"+"{}".format(i+1),16))
-			c0 = 0xdeadbef8
-			
-			# create digest for given rule using jenkins hash
-			digest72= self.hash72(k0,k1,k2,a0,b0,c0) 
-			digests.append(digest72)
-			
-			digest32= self.hash32(k01,a0,b0,c0) 
-			digests.append(digest32)
-			index72 = digest72 & (memSize-1)
-			index32 = digest32 & (memSize-1)
-							
-			# set the bit True in bit_array
-			mem_array[index72] = 1
-			mem_array[index32] = 1
-		
-		return mem_array
 
-
-	# Function for adding a rule to the bloomfilter
-	def add_rule_ip6(self,k0_0,k0_1,k0_2,k1_0,k1_1,k1_2,k2_0,k2_1,k2_2,k01,mem_array):
-		digests = []
-		bitsReqd = int(math.ceil(math.log(self.size,2)))
-		memSize = (1 << bitsReqd)
-		for i in range(0,self.hash_count):
-					
-			a0 = 0xdeadbef8
-			#b0 = 0xdeadbef8
-			b0 = (int("deadbef"+"{}".format(i+1),16))
-		
-			c0 = 0xdeadbef8
-			
-			# create digest for given rule using jenkins hash
-			digest_sip96= self.hash_sip96(k0_0,k0_1,k0_2,a0,b0,c0) % self.size
-			digests.append(digest_sip96)
-			print("digest_sip96:",digest_sip96)
-			digest_dip96= self.hash_dip96(k1_0,k1_1,k1_2,a0,b0,c0) % self.size
-			digests.append(digest_dip96)
-			print("digest_dip96:",digest_dip96)
-			digest72= self.hash72(k2_0,k2_1,k2_2,a0,b0,c0) % self.size
-			digests.append(digest72)
-			print("digest72:",digest72)
-			digest32= self.hash32(k01,a0,b0,c0) % self.size
-			digests.append(digest32)
-			print("digest32:",digest32)
-			
-
-			"""index_sip96 = digest_sip96 & (memSize-1)
-			index_dip96 = digest_dip96 & (memSize-1)
-			index72 = digest72 & (memSize-1)
-			index32 = digest32 & (memSize-1)
-			print("digest_sip96:",index_sip96)
-			print("digest_dip96:",index_dip96)
-			print("digest72:",index72)
-			print("digest32:",index32)
-                                
-				# set the bit True in bit_array
-			mem_array[index_sip96] = 1
-			mem_array[index_sip96] = 1
-			mem_array[index72] = 1
-			mem_array[index32] = 1"""
-
-			mem_array[digest_sip96] = 1
-			mem_array[digest_dip96] = 1
-			mem_array[digest72] = 1
-			mem_array[digest32] = 1
-				
-		return mem_array
-
-	def get_size(self, n, p):
-		m = -(n * math.log(p))/(math.log(2)**2)
-		stride=math.ceil(math.log(m,2))
-		return int(m)                    
-	
-	# Function to Return the hashkey for 72 bit input
-	def hash_sip96(self,k0_0,k0_1,k0_2,a0,b0,c0):
-		a  = ((a0 + k0_0)& 0xffffffff)
-		b  = ((b0 + k0_1)& 0xffffffff)
-		c  = ((c0 + k0_2)& 0xffffffff)
-		
-
-		c1  = ((c ^ b)& 0xffffffff) 
-		c11 = ((c1 - (b<<14|b>>18))& 0xffffffff)
-		
-		a1 = ((a ^ c11)& 0xffffffff) 
-		a11 = ((a1 - (c11<<11|c11>>21))& 0xffffffff)
-		
-		b1 = ((b ^ a11)& 0xffffffff)
-		b11= ((b1 - (a11<<25|a11>>7))& 0xffffffff)
-		
-		c2 = ((c11 ^ b11)& 0xffffffff)
-		c21 = ((c2 - (b11<<16|b11>>16))& 0xffffffff)
-		
-		a2 = ((a11 ^ c21)& 0xffffffff)
-		a21= ((a2 - (c21<<4|c21>>28))& 0xffffffff)
-		
-		b2 = ((b11 ^ a21)& 0xffffffff) 
-		b21= ((b2 - (a21<<14|a21>>18))& 0xffffffff)
-		
-		c3 = ((c21 ^ b21)& 0xffffffff)
-		c31= ((c3 - (b21<<24|b21>>8))& 0xffffffff)
-		
-		hashkey = c31
-		print("hashkey_sip96:",hashkey)
-		return hashkey
-	
-	def hash_dip96(self,k1_0,k1_1,k1_2,a0,b0,c0):
-		a  = ((a0 + k1_0)& 0xffffffff)
-		b  = ((b0 + k1_1)& 0xffffffff)
-		c  = ((c0 + k1_2)& 0xffffffff)
-		
-
-		c1  = ((c ^ b)& 0xffffffff) 
-		c11 = ((c1 - (b<<14|b>>18))& 0xffffffff)
-		
-		a1 = ((a ^ c11)& 0xffffffff) 
-		a11 = ((a1 - (c11<<11|c11>>21))& 0xffffffff)
-		
-		b1 = ((b ^ a11)& 0xffffffff)
-		b11= ((b1 - (a11<<25|a11>>7))& 0xffffffff)
-		
-		c2 = ((c11 ^ b11)& 0xffffffff)
-		c21 = ((c2 - (b11<<16|b11>>16))& 0xffffffff)
-		
-		a2 = ((a11 ^ c21)& 0xffffffff)
-		a21= ((a2 - (c21<<4|c21>>28))& 0xffffffff)
-		
-		b2 = ((b11 ^ a21)& 0xffffffff) 
-		b21= ((b2 - (a21<<14|a21>>18))& 0xffffffff)
-		
-		c3 = ((c21 ^ b21)& 0xffffffff)
-		c31= ((c3 - (b21<<24|b21>>8))& 0xffffffff)
-		
-		hashkey = c31
-		print("hashkey_dip96:",hashkey)
-		return hashkey
-	
-
-	def hash72(self,k2_0,k2_1,k2_2,a0,b0,c0):
-		a  = ((a0 + k2_0)& 0xffffffff)
-		b  = ((b0+k2_1)& 0xffffffff)
-		ck = ((k2_2 & 0xff))
-		c  = (( ck + c0)& 0xffffffff)
-		
-
-		c1  = ((c ^ b)& 0xffffffff) 
-		c11 = ((c1 - (b<<14|b>>18))& 0xffffffff)
-		
-		a1 = ((a ^ c11)& 0xffffffff) 
-		a11 = ((a1 - (c11<<11|c11>>21))& 0xffffffff)
-		
-		b1 = ((b ^ a11)& 0xffffffff)
-		b11= ((b1 - (a11<<25|a11>>7))& 0xffffffff)
-		
-		c2 = ((c11 ^ b11)& 0xffffffff)
-		c21 = ((c2 - (b11<<16|b11>>16))& 0xffffffff)
-		
-		a2 = ((a11 ^ c21)& 0xffffffff)
-		a21= ((a2 - (c21<<4|c21>>28))& 0xffffffff)
-		
-		b2 = ((b11 ^ a21)& 0xffffffff) 
-		b21= ((b2 - (a21<<14|a21>>18))& 0xffffffff)
-		
-		c3 = ((c21 ^ b21)& 0xffffffff)
-		c31= ((c3 - (b21<<24|b21>>8))& 0xffffffff)
-		
-		hashkey = c31
-		print("hashkey72:",hashkey)
-		return hashkey
-
-	# Function to Return the hashkey for 32 bit input
-	def hash32(self,k01,a0,b0,c0):
-
-		a  = ((a0 + k01)& 0xffffffff)
-		b  = ((b0)& 0xffffffff)
-		c  = (( c0)& 0xffffffff)
-		
-		c1  = ((c ^ b)& 0xffffffff) 
-		c11 = ((c1 - (b<<14|b>>18))& 0xffffffff)
-		
-		a1 = ((a ^ c11)& 0xffffffff) 
-		a11 = ((a1 - (c11<<11|c11>>21))& 0xffffffff)
-		
-		b1 = ((b ^ a11)& 0xffffffff)
-		b11= ((b1 - (a11<<25|a11>>7))& 0xffffffff)
-		
-		c2 = ((c11 ^ b11)& 0xffffffff)
-		c21 = ((c2 - (b11<<16|b11>>16))& 0xffffffff)
-		
-		a2 = ((a11 ^ c21)& 0xffffffff)
-		a21= ((a2 - (c21<<4|c21>>28))& 0xffffffff)
-		
-		b2 = ((b11 ^ a21)& 0xffffffff) 
-		b21= ((b2 - (a21<<14|a21>>18))& 0xffffffff)
-		
-		c3 = ((c21 ^ b21)& 0xffffffff)
-		c31= ((c3 - (b21<<24|b21>>8))& 0xffffffff)
-		
-		hashkey = c31
-		print("hashkey32:",hashkey)
-		return hashkey
+	# IPv6 keys of every rule as the uint32 arrays [k0_0, k0_1, k0_2, k1_0, k1_1, k1_2, k2_0, k2_1, k2_2, k01]
+	# ipAndProtocolList holds 16 columns of 16 bit groups, as hex strings or integers,
+	# and the protocol column; each key word is two groups.
+	def getKeys_ip6(self):
+		groups = [hexColumn(self.ipAndProtocolList[f]) for f in range(16)]
+		def word(high, low):
+			return (groups[high] << 16) | groups[low]
+		protocol = np.asarray(self.ipAndProtocolList[16]).astype(np.int64).astype(np.uint32)
+		srcPort = np.asarray(self.srcPortList[0]).astype(np.int64).astype(np.uint32)
+		dstPort = np.asarray(self.dstPortList[0]).astype(np.int64).astype(np.uint32)
+		return [word(0,1), word(2,3), word(4,5), word(10,11), word(12,13), word(6,7), word(8,9), word(14,15), protocol, (srcPort << 16) | dstPort]
+
+	# Memories of memSize bits (any size, see reduceDigest) of the layout as packBits arrays
+	# all rules at once, one hash function at a time
+	def buildMemories(self, memSize):
+		memories = [packBits([], memSize) for _ in bloomMemFiles(self.layout, self.hash_count)]
+		for (lookup, memory, indices) in bloomLookups(self.layout, self.getKeys(), memSize, self.hash_count, self.hashing):
+			setBits(memories[memory], indices)
+		return memories
+
+	def getKeys(self):
+		return ruleKeys(self.ipAndProtocolList, self.srcPortList, self.dstPortList)
+
+	# Digests of every rule for every hash function, shape (hash_count, 2, no_of_rules)
+	# [i][0] is hash72 of the ips and protocol, [i][1] hash32 of the ports, seeded by jenkinsSeed or double hashed
+	def getDigests(self):
+		keys = self.getKeys()
+		digests = np.empty((self.hash_count, 2, len(keys[0])), dtype=np.uint32)
+		for (i, digest) in enumerate(hashSequence(keys, self.hash_count, self.hashing)):
+			digests[i] = digest
+		return digests
+
+	# Bit positions the rules set in a replicated filter of memSize bits
+	def getIndices(self, memSize):
+		return reduceDigest(self.getDigests(), memSize)
 
 	# Function to Return the size of the bloomfilter(m) to be used				
 	@classmethod
@@ -378,6 +387,451 @@ class BloomFilter(object):
 		print("k:",k)
 		return int(k)
 
+# Cuckoo filter: buckets of CUCKOO_SLOTS fingerprints, every key may sit in one of two buckets.
+# The first bucket comes from the seed 0 Jenkins digests of the key (hash72 ^ hash32), the fingerprint
+# from the seed 1 digests and the other bucket is (H(fingerprint) - bucket) mod buckets, so either
+# bucket gives back the other one from the fingerprint alone and any number of buckets works.
+CUCKOO_SLOTS = 4
+# Share of the slots a table is sized for, and the growth of the bucket count when a build fails
+CUCKOO_LOAD = 0.94
+CUCKOO_GROWTH = 1.02
+# Evictions before an insert gives up
+CUCKOO_MAX_KICKS = 500
+# Odd multiplier giving H(fingerprint), a 32 bit product as in CF_PACKET_MATCH
+CUCKOO_FP_MULTIPLIER = 0x5bd1e995
+
+class CuckooFilterFullError(Exception):
+	def __init__(self, message="No free slot for the key after the maximum number of kicks"):
+		self.message = message
+		super().__init__(self.message)
+
+# (buckets, fingerprint bits) for n keys at the target FPR: a header that is not a rule passes
+# when one of the 2*slots fingerprints it is compared with matches, about 2*slots/2**f
+def cuckooParams(n, fp_prob, slots=CUCKOO_SLOTS):
+	fingerprintBits = max(1, int(math.ceil(math.log(2.0*slots/fp_prob, 2))))
+	buckets = max(2, int(math.ceil(n/(slots*CUCKOO_LOAD))))
+	return (buckets, fingerprintBits)
+
+# Other bucket of a fingerprint in the given bucket, for uint32 arrays or, in the kicks, Python ints
+def cuckooAltBucket(bucket, fingerprint, buckets):
+	if isinstance(fingerprint, int):
+		digest = (fingerprint*CUCKOO_FP_MULTIPLIER) & 0xffffffff
+		offset = digest & (buckets-1) if buckets & (buckets-1) == 0 else (digest*buckets) >> 32
+		return (offset - bucket) % buckets
+	offset = reduceDigest(np.asarray(fingerprint, dtype=np.uint32)*np.uint32(CUCKOO_FP_MULTIPLIER), buckets)
+	return (offset.astype(np.int64) - bucket) % buckets
+
+# (first bucket, fingerprint, second bucket) of every key, keys as in ruleKeys
+def cuckooLookups(keys, buckets, fingerprintBits):
+	(index72, index32) = bloomDigests(0, keys)
+	(fp72, fp32) = bloomDigests(1, keys)
+	fingerprints = (fp72 ^ fp32) & np.uint32((1 << fingerprintBits)-1)
+	# 0 marks an empty slot
+	fingerprints[fingerprints == 0] = 1
+	first = reduceDigest(index72 ^ index32, buckets).astype(np.int64)
+	return (first, fingerprints, cuckooAltBucket(first, fingerprints, buckets))
+
+#Class for the cuckoo filter, an alternative to the bloom filter that needs fewer bits per rule at
+#low FPR and lets rules be deleted
+class CuckooFilter(object):
+
+	def __init__(self, no_of_rules, fp_prob, ipAndProtocolList, srcPortList, dstPortList, memfiles_loc, buckets=None, fingerprintBits=None, slots=CUCKOO_SLOTS):
+
+		# buckets, fingerprintBits : table size and fingerprint width, computed from fp_prob if not given
+		# slots : fingerprints per bucket, one bucket is one BRAM word of slots*fingerprintBits bits
+		(defaultBuckets, defaultBits) = cuckooParams(no_of_rules, fp_prob, slots)
+		self.buckets = defaultBuckets if buckets is None else buckets
+		self.fingerprintBits = defaultBits if fingerprintBits is None else fingerprintBits
+		self.slots = slots
+		self.fp_prob = fp_prob
+		self.ipAndProtocolList = ipAndProtocolList
+		self.dstPortList = dstPortList
+		self.srcPortList = srcPortList
+		self.memfiles_loc = memfiles_loc
+		self.no_of_rules = no_of_rules
+		self.table = None
+
+	# Filter of the table in a cuckoofilter.mem written by generateMemory, to delete or add rules
+	@classmethod
+	def fromMem(cls, filename, fingerprintBits, slots=CUCKOO_SLOTS, memfiles_loc=""):
+		(packed, nbits) = readBitsMem(filename, slots*fingerprintBits)
+		bits = np.unpackbits(packed, bitorder="little")[:nbits].reshape(-1, slots, fingerprintBits)
+		cf = cls(0, 1.0, None, None, None, memfiles_loc, len(bits), fingerprintBits, slots)
+		cf.table = (bits.astype(np.uint32) << np.arange(fingerprintBits, dtype=np.uint32)).sum(axis=2, dtype=np.uint32)
+		return cf
+
+	# Writes cuckoofilter.mem, one bucket of slots*fingerprintBits bits per line with slot j in bits
+	# [j*fingerprintBits +: fingerprintBits]
+	def generateMemory(self):
+		if self.table is None:
+			self.buildTable()
+		width = self.slots*self.fingerprintBits
+		bits = (self.table[:, :, None] >> np.arange(self.fingerprintBits, dtype=np.uint32)) & np.uint32(1)
+		packed = np.packbits(bits.astype(np.uint8).ravel(), bitorder="little")
+
+		path=self.memfiles_loc
+		if(os.path.isdir(path) is False):
+			os.mkdir(path)
+
+		writeBitsMem(path+"cuckoofilter.mem", packed, self.buckets*width, width)
+		return [self.buckets, self.fingerprintBits]
+
+	# Inserts all rules, with CUCKOO_GROWTH times more buckets each time one does not fit
+	def buildTable(self):
+		keys = ruleKeys(self.ipAndProtocolList, self.srcPortList, self.dstPortList)
+		while True:
+			self.table = np.zeros((self.buckets, self.slots), dtype=np.uint32)
+			try:
+				self.insert(keys)
+				return self.table
+			except CuckooFilterFullError:
+				self.buckets = int(math.ceil(self.buckets*CUCKOO_GROWTH))
+
+	# Adds the keys (as in ruleKeys). A key that does not fit after CUCKOO_MAX_KICKS evictions undoes
+	# its evictions and raises CuckooFilterFullError, the keys before it stay in the table.
+	def insert(self, keys, seed=1):
+		rng = np.random.default_rng(seed)
+		(first, fingerprints, second) = cuckooLookups(keys, self.buckets, self.fingerprintBits)
+		table = self.table.tolist()
+		try:
+			for (bucket, fingerprint, other) in zip(first.tolist(), fingerprints.tolist(), second.tolist()):
+				if not (self.place(table, bucket, fingerprint) or self.place(table, other, fingerprint)):
+					self.kick(table, other if rng.integers(0, 2) else bucket, fingerprint, rng)
+		finally:
+			self.table = np.array(table, dtype=np.uint32).reshape(self.buckets, self.slots)
+
+	def place(self, table, bucket, fingerprint):
+		slots = table[bucket]
+		if 0 in slots:
+			slots[slots.index(0)] = fingerprint
+			return True
+		return False
+
+	# Evicts a random fingerprint of the bucket into its other bucket until one has a free slot
+	def kick(self, table, bucket, fingerprint, rng):
+		evictions = []
+		for kick in range(CUCKOO_MAX_KICKS):
+			slot = int(rng.integers(0, self.slots))
+			evictions.append((bucket, slot))
+			(table[bucket][slot], fingerprint) = (fingerprint, table[bucket][slot])
+			bucket = cuckooAltBucket(bucket, fingerprint, self.buckets)
+			if self.place(table, bucket, fingerprint):
+				return
+		for (bucket, slot) in reversed(evictions):
+			(table[bucket][slot], fingerprint) = (fingerprint, table[bucket][slot])
+		raise CuckooFilterFullError
+
+	# Deletes one copy of the fingerprint of every key from either of its buckets. Only keys that were
+	# inserted may be removed, a false positive would take out the fingerprint of another rule.
+	# Returns the mask of the keys that were found.
+	def remove(self, keys):
+		(first, fingerprints, second) = cuckooLookups(keys, self.buckets, self.fingerprintBits)
+		removed = np.zeros(len(fingerprints), dtype=bool)
+		for (i, (bucket, fingerprint, other)) in enumerate(zip(first.tolist(), fingerprints.tolist(), second.tolist())):
+			for b in (bucket, other):
+				hits = np.flatnonzero(self.table[b] == fingerprint)
+				if len(hits):
+					self.table[b, hits[0]] = 0
+					removed[i] = True
+					break
+		return removed
+
+	# CF_PACKET_MATCH for every key: the fingerprint is in one of the two buckets
+	def contains(self, keys):
+		(first, fingerprints, second) = cuckooLookups(keys, self.buckets, self.fingerprintBits)
+		return ((self.table[first] == fingerprints[:, None]).any(axis=1) |
+			(self.table[second] == fingerprints[:, None]).any(axis=1))
+
+	def bitsPerRule(self):
+		return self.buckets*self.slots*self.fingerprintBits/float(max(1, self.no_of_rules))
+
+# Exact-match confirmation table behind the bloom filter: a cuckoo hash table of the full 104 bit
+# keys, CONFIRM_SLOTS per bucket. A key may sit in the bucket of its seed 0 Jenkins digests or in
+# that of its seed 1 digests (hash72 ^ hash32 of each), the digests the bloom filter lookup already has.
+CONFIRM_SLOTS = 2
+CONFIRM_LOAD = 0.85
+# Bits of a slot: ports (src port << 16 | dst port) in bits 0-31, protocol 32-39, dst ip 40-71,
+# src ip 72-103 and the valid bit 104, {1'b1, ip_pro, port_no1, port_no2} in BF_PACKET_MATCH
+EXACT_KEY_FIELDS = ((3, 32), (2, 8), (1, 32), (0, 32))
+EXACT_SLOT_BITS = 105
+
+# (first bucket, second bucket) of every key, keys as in ruleKeys
+def exactMatchBuckets(keys, buckets):
+	return tuple(reduceDigest(np.bitwise_xor(*bloomDigests(i, keys)), buckets).astype(np.int64) for i in range(2))
+
+class ExactMatchTable(object):
+
+	# keys as in ruleKeys, repeated keys are stored once
+	def __init__(self, keys, memfiles_loc, buckets=None, slots=CONFIRM_SLOTS):
+		rows = np.unique(np.stack([np.asarray(key, dtype=np.uint32) for key in keys], axis=1), axis=0)
+		self.keys = [rows[:, f] for f in range(4)]
+		self.buckets = max(2, int(math.ceil(len(rows)/(slots*CONFIRM_LOAD)))) if buckets is None else buckets
+		self.slots = slots
+		self.memfiles_loc = memfiles_loc
+		self.table = None
+
+	# Rule index of every slot, -1 for an empty one. Rules are placed with bounded kicks like the
+	# cuckoo filter, with CUCKOO_GROWTH times more buckets each time one does not fit.
+	def buildTable(self, seed=1):
+		while True:
+			rng = np.random.default_rng(seed)
+			(first, second) = [b.tolist() for b in exactMatchBuckets(self.keys, self.buckets)]
+			table = [[-1]*self.slots for _ in range(self.buckets)]
+			if all(self.place(table, rule, first, second, rng) for rule in range(len(first))):
+				self.table = np.array(table, dtype=np.int64)
+				return self.table
+			self.buckets = int(math.ceil(self.buckets*CUCKOO_GROWTH))
+
+	def place(self, table, rule, first, second, rng):
+		bucket = first[rule]
+		for kick in range(CUCKOO_MAX_KICKS):
+			for b in (bucket, second[rule] if bucket == first[rule] else first[rule]):
+				if -1 in table[b]:
+					table[b][table[b].index(-1)] = rule
+					return True
+			slot = int(rng.integers(0, self.slots))
+			(table[bucket][slot], rule) = (rule, table[bucket][slot])
+			# the evicted rule moves on to its other bucket
+			bucket = second[rule] if bucket == first[rule] else first[rule]
+		return False
+
+	# Writes exactmatch.mem, one bucket of slots*EXACT_SLOT_BITS bits per line with slot j in bits
+	# [j*EXACT_SLOT_BITS +: EXACT_SLOT_BITS]
+	def generateMemory(self):
+		if self.table is None:
+			self.buildTable()
+		used = self.table >= 0
+		rules = np.where(used, self.table, 0)
+		fields = [(np.where(used, self.keys[f][rules], 0), width) for (f, width) in EXACT_KEY_FIELDS] + [(used.astype(np.uint32), 1)]
+		bits = np.concatenate([(values[:, :, None] >> np.arange(width, dtype=np.uint32)) & np.uint32(1) for (values, width) in fields], axis=2)
+		packed = np.packbits(bits.astype(np.uint8).ravel(), bitorder="little")
+		width = self.slots*EXACT_SLOT_BITS
+
+		path=self.memfiles_loc
+		if(os.path.isdir(path) is False):
+			os.mkdir(path)
+
+		writeBitsMem(path+"exactmatch.mem", packed, self.buckets*width, width)
+		return [self.buckets, self.slots]
+
+	# The confirmation of BF_PACKET_MATCH for every key: the key is in one of its two buckets
+	def contains(self, keys):
+		if self.table is None:
+			self.buildTable()
+		keys = [np.asarray(key, dtype=np.uint32) for key in keys]
+		found = np.zeros(len(keys[0]), dtype=bool)
+		for bucket in exactMatchBuckets(keys, self.buckets):
+			rules = self.table[bucket]
+			match = rules >= 0
+			for (f, width) in EXACT_KEY_FIELDS:
+				match &= self.keys[f][np.maximum(rules, 0)] == keys[f][:, None]
+			found |= match.any(axis=1)
+		return found
+
+# Writes a (rows, bytes) packed bit matrix as one width bit word per line in the $readmemb format,
+# bit r of a row (bit r&7 of byte r>>3) is bit r of its word, as the rule vectors of the FSBV tables
+def writeMatrixMem(filename, matrix, width):
+	rowsPerBlock = max(1, MEM_WRITE_BLOCK//max(1, width))
+	with openOutput(filename, "wb") as outfile:
+		for start in range(0, len(matrix), rowsPerBlock):
+			bits = np.unpackbits(matrix[start:start+rowsPerBlock], axis=1, bitorder="little")[:, :width]
+			text = np.full((len(bits), width+1), ord("\n"), dtype=np.uint8)
+			text[:, :width] = bits[:, ::-1] + ord("0")
+			outfile.write(text.tobytes())
+
+#Class for the field split bit vector (FSBV) tables of the DRAM/BRAM matchers
+class FSBV(object):
+
+	# fieldWidth : bits of every field, fieldLists : one column per field, the first one is the most
+	# significant in the key (src ip octets, dst ip octets, protocol as in ip_pro, or a port)
+	# wildLists : optional columns of don't care bits of the fields, as the *_wild columns of a RuleTable
+	def __init__(self, fieldWidth, stride, fieldLists, memfiles_loc, wildLists=None):
+		self.fieldWidth = fieldWidth
+		self.stride = stride
+		self.fieldLists = fieldLists
+		self.wildLists = wildLists
+		self.memfiles_loc = memfiles_loc
+		self.no_of_rules = len(fieldLists[0])
+		# the key is padded with 0s up to whole strides, as W1 for the ports
+		self.W = -(-fieldWidth*len(fieldLists)//stride)*stride
+
+	# Bits [i*stride, (i+1)*stride) of the key of every rule and their don't care bits, block 0 is the
+	# lowest. Padding bits above the key are don't care.
+	def blockColumns(self, i):
+		value = np.zeros(self.no_of_rules, dtype=np.int64)
+		wild = np.zeros(self.no_of_rules, dtype=np.int64)
+		fields = len(self.fieldLists)
+		for (f, column) in enumerate(self.fieldLists):
+			low = (fields-1-f)*self.fieldWidth
+			# part of field f in the block, shifted to its place in the block
+			start = max(low, i*self.stride)
+			end = min(low+self.fieldWidth, (i+1)*self.stride)
+			if start >= end:
+				continue
+			part = (1 << (end-start))-1
+			shift = start-i*self.stride
+			value |= ((np.asarray(column, dtype=np.int64) >> (start-low)) & part) << shift
+			if self.wildLists is not None:
+				wild |= ((np.asarray(self.wildLists[f], dtype=np.int64) >> (start-low)) & part) << shift
+		keyBits = fields*self.fieldWidth - i*self.stride
+		if keyBits < self.stride:
+			wild |= ((1 << self.stride)-1) & ~((1 << keyBits)-1)
+		return (value & ~wild, wild)
+
+	# Table of block i as a (2**stride, ceil(n/8)) packed bit matrix, bit r of row v is set when rule r
+	# matches the value v of the block's key bits
+	def blockTable(self, i):
+		rows = 1 << self.stride
+		rowBits = -(-self.no_of_rules//8)*8
+		(value, wild) = self.blockColumns(i)
+		rules = np.arange(self.no_of_rules, dtype=np.int64)
+		patterns = np.unique(wild).tolist()
+		table = None
+		for pattern in patterns:
+			selected = rules if len(patterns) == 1 else np.flatnonzero(wild == pattern)
+			# one hot rows of the rules of this don't care pattern, row v then gets the rules whose value
+			# is v without its don't care bits
+			onehot = np.zeros((rows, rowBits//8), dtype=np.uint8)
+			setBits(onehot.reshape(-1), value[selected]*rowBits + selected)
+			if pattern != 0:
+				onehot = onehot[np.arange(rows) & ~pattern]
+			table = onehot if table is None else table | onehot
+		return table
+
+	# Writes stride<stride>_<W>bit<i>.mem for every block, the #PATH# of the dram and bram modules, with
+	# one line of no_of_rules bits per value of the block (rule r in bit r)
+	def generateMemory(self):
+		path=self.memfiles_loc
+		if(os.path.isdir(path) is False):
+			os.makedirs(path)
+		blocks = self.W//self.stride
+		for i in range(blocks):
+			writeMatrixMem(path+"stride"+str(self.stride)+"_"+str(self.W)+"bit"+str(i)+".mem", self.blockTable(i), self.no_of_rules)
+		return blocks
+
+# Minimal prefix cover of [lo, hi) as (value, size) blocks
+def prefixCover(lo, hi):
+	prefixes = []
+	while lo < hi:
+		size = lo & -lo if lo else 1 << (hi-1).bit_length()
+		while lo+size > hi:
+			size >>= 1
+		prefixes.append((lo, size))
+		lo += size
+	return prefixes
+
+# Cheapest (positive, negative) prefixes of the x values at one end of an aligned block of 2**s values
+# starting at base. The positives cover the y values at that end, y being x rounded up to a power of
+# two, and the negatives take back the y-x extra ones (x = 0b0111100 costs 1+1 instead of 4).
+def halfRangeNAF(base, s, x, fromTop):
+	# both covers are aligned on the y side, they take popcount(y) and popcount(y-x) prefixes
+	y = min((-(-x >> j) << j for j in range(s+1)), key=lambda y: bin(y).count("1")+bin(y-x).count("1"))
+	if fromTop:
+		return (prefixCover(base-y, base), prefixCover(base-y, base-x))
+	return (prefixCover(base, base+y), prefixCover(base+x, base+y))
+
+# Signed prefixes of the range [lo, hi] : a value is in the range when it matches a positive prefix and
+# no negative one. The range is split at the middle of the smallest block holding it and each half is
+# encoded by halfRangeNAF, two full halves become that block (1024-65535 gives +[0,65535] -[0,1023]).
+def rangeNAF(lo, hi):
+	t = (lo ^ hi).bit_length()
+	if t == 0:
+		return ([(lo, 1)], [])
+	mid = (hi >> (t-1)) << (t-1)
+	(leftPositive, leftNegative) = halfRangeNAF(mid, t-1, mid-lo, True)
+	(rightPositive, rightNegative) = halfRangeNAF(mid, t-1, hi+1-mid, False)
+	if leftPositive == [(mid-(1 << (t-1)), 1 << (t-1))] and rightPositive == [(mid, 1 << (t-1))]:
+		positive = [(mid-(1 << (t-1)), 1 << t)]
+	else:
+		positive = leftPositive+rightPositive
+	return (positive, leftNegative+rightNegative)
+
+#Class for the FSBV tables of port ranges. Every range is expanded to its signed prefixes, the tables
+#have one column per prefix and PORT_MATCH_WITH_RANGES merges the columns of rule i, ctr[i] to ctr[i+1],
+#into final_mvp/final_mvn by sign_f (0 positive, 1 negative)
+class FSBVplusNAF(FSBV):
+
+	# rangeLists : [min column, max column] of the rules, both inclusive
+	def __init__(self, fieldWidth, stride, rangeLists, memfiles_loc):
+		ranges = np.stack((np.asarray(rangeLists[0], dtype=np.int64), np.asarray(rangeLists[1], dtype=np.int64)), axis=1)
+		# rules share few distinct ranges, each one is expanded once
+		(unique, inverse) = np.unique(ranges, axis=0, return_inverse=True)
+		inverse = inverse.reshape(-1)
+		values = []
+		wilds = []
+		signs = []
+		counts = np.zeros(len(unique), dtype=np.int64)
+		for (u, (lo, hi)) in enumerate(unique.tolist()):
+			(positive, negative) = rangeNAF(lo, hi)
+			for (sign, prefixes) in ((0, positive), (1, negative)):
+				for (value, size) in prefixes:
+					values.append(value)
+					wilds.append(size-1)
+					signs.append(sign)
+			counts[u] = len(positive)+len(negative)
+		# entries of rule r are the entries of its range, in ctr[r] to ctr[r+1]
+		ruleCounts = counts[inverse]
+		self.ctr = np.concatenate(([0], np.cumsum(ruleCounts)))
+		uniqueStart = np.concatenate(([0], np.cumsum(counts)[:-1]))
+		entries = np.repeat(uniqueStart[inverse]-self.ctr[:-1], ruleCounts)+np.arange(self.ctr[-1])
+		self.sign_f = np.asarray(signs, dtype=np.uint8)[entries]
+		FSBV.__init__(self, fieldWidth, stride, [np.asarray(values, dtype=np.int64)[entries]], memfiles_loc, [np.asarray(wilds, dtype=np.int64)[entries]])
+
+	# Writes the stride memories of the expanded entries, ctr[-1] of them, and returns [ctr, sign_f]
+	def generateMemory(self):
+		FSBV.generateMemory(self)
+		return [self.ctr.tolist(), self.sign_f.tolist()]
+
+# "#### ... ####" line of the templates, filled under this name with one of the notices
+TEMPLATE_BANNER = "####"
+TEMPLATE_NOTICE = "/* Auto-generated code. */\n /* DO NOT MODIFY THIS FILE DIRECTLY.*/\n/* #ANY CHANGES SHOULD BE MADE TO THE CORRESPONDING TEMPLATE FILE*/\n"
+DRAM_TEMPLATE_NOTICE = "/* Auto-generated code. */\n /* DO NOT MODIFY THIS FILE DIRECTLY.*/\n/* ANY CHANGES SHOULD BE MADE TO THE CORRESPONDING TEMPLATE FILE*/\n"
+TEMPLATE_HOLES = re.compile("#### [a-zA-Z ]+ ####|#([A-Z0-9_]+)#")
+
+#Template split once into its text and its #NAME# placeholders, parts alternates text and
+#(name, placeholder text) holes. fill substitutes some of the names in a single pass and gives a
+#smaller template, so the values shared by all blocks of a module are only substituted once.
+class Template(object):
+	def __init__(self, parts):
+		self.parts = parts
+
+	@classmethod
+	def parse(cls, text):
+		parts = []
+		last = 0
+		for hole in TEMPLATE_HOLES.finditer(text):
+			parts.append(text[last:hole.start()])
+			parts.append((hole.group(1) or TEMPLATE_BANNER, hole.group(0)))
+			last = hole.end()
+		parts.append(text[last:])
+		return cls(parts)
+
+	def fill(self, values):
+		parts = [self.parts[0]]
+		for i in range(1, len(self.parts), 2):
+			(name, placeholder) = self.parts[i]
+			if name in values:
+				parts[-1] += values[name]+self.parts[i+1]
+			else:
+				parts += [self.parts[i], self.parts[i+1]]
+		return Template(parts)
+
+	# Text with the given values, placeholders without a value are kept
+	def render(self, values={}):
+		return "".join(part if i % 2 == 0 else values.get(part[0], part[1]) for (i, part) in enumerate(self.parts))
+
+# path -> (mtime, Template), every template file is read and parsed once per process
+templateCache = {}
+
+def loadTemplate(path):
+	mtime = os.stat(path).st_mtime_ns
+	cached = templateCache.get(path)
+	if cached is None or cached[0] != mtime:
+		with open(path, "r") as template:
+			cached = (mtime, Template.parse(template.read()))
+		templateCache[path] = cached
+	return cached[1]
+
 class DRAM:
 	def __init__(self, template_file, srcfiles_loc, memfiles_loc, W, stride, dram_depth, no_of_rules,keyword, keyword1):
 		self.template_file = template_file
@@ -392,33 +846,28 @@ class DRAM:
 	
 	def generateSource(self):
 		# open template file.
-		template = open(self.template_file,"r")
-		tcontent = template.read()
-		tcontent = re.sub("#NO_OF_RULES#",str(self.no_of_rules-1),tcontent)
-		tcontent = re.sub("#DRAM_DEPTH#",str(self.dram_depth-1),tcontent)
-		tcontent = re.sub("#STRIDE#",str(self.stride-1),tcontent)
-		tcontent = re.sub("#MODULEID#",str(self.keyword1),tcontent)
-		tcontent = re.sub("#### [a-zA-Z ]+ ####","/* Auto-generated code. */\n /* DO NOT MODIFY THIS FILE DIRECTLY.*/\n/* ANY CHANGES SHOULD BE MADE TO THE CORRESPONDING TEMPLATE FILE*/\n",tcontent);
-
-		template.close()	
+		template = loadTemplate(self.template_file)
+		tcontent = template.fill({"NO_OF_RULES":str(self.no_of_rules-1), "DRAM_DEPTH":str(self.dram_depth-1), "STRIDE":str(self.stride-1),
+			"MODULEID":str(self.keyword1), TEMPLATE_BANNER:DRAM_TEMPLATE_NOTICE})
+
 		noOfBlocks = self.W//self.stride
 		## Generate DRAM Files for IP_Prot_Match Module ##
 		for i in range(0,noOfBlocks):
-			content = tcontent
 			path=self.srcfiles_loc+"dramfiles/"
 			if(os.path.isdir(path) is False):
 				os.mkdir(path)
 			
-			file1=open(path+"dist_"+self.keyword+str(i)+"_"+self.keyword1+".v","w+")
-			content = re.sub("#DRAMNO#",self.keyword+str(i),content)
+			file1=openOutput(path+"dist_"+self.keyword+str(i)+"_"+self.keyword1+".v","w+")
 			path="\""+self.memfiles_loc+"stride"+str(self.stride)+"_"+str(self.W)+"bit"+str(i)+".mem\""
-			content = re.sub("#PATH#",path,content)
+			content = tcontent.render({"DRAMNO":self.keyword+str(i), "PATH":path})
 			file1.write(content)
 			file1.close()
 
 class BRAM:
-	def __init__(self, template_file, srcfiles_loc, memfiles_loc, W, stride, bram_width,keyword, keyword1):
+	# depth : number of words, 2**stride if not given (the bloom filter memories may have any depth)
+	def __init__(self, template_file, srcfiles_loc, memfiles_loc, W, stride, bram_width,keyword, keyword1, depth=None):
 		self.template_file = template_file
+		self.depth = (2**stride) if depth is None else depth
 		self.srcfiles_loc = srcfiles_loc
 		self.stride = stride
 		self.bram_width = bram_width
@@ -428,34 +877,36 @@ class BRAM:
 		self.keyword1 = keyword1	
 	def generateSource(self):
 		# open template file.
-		template = open(self.template_file,"r")
-		tcontent = template.read()
-		tcontent = re.sub("#BRAM_WIDTH#",str(self.bram_width),tcontent)
-		tcontent = re.sub("#STRIDE#",str(self.stride),tcontent)
-		tcontent = re.sub("#MODULEID#",str(self.keyword1),tcontent)
-		tcontent = re.sub("#### [a-zA-Z ]+ ####","/* Auto-generated code. */\n /* DO NOT MODIFY THIS FILE DIRECTLY.*/\n/* #ANY CHANGES SHOULD BE MADE TO THE CORRESPONDING TEMPLATE FILE*/\n",tcontent);
-
-		template.close()	
+		template = loadTemplate(self.template_file)
+		tcontent = template.fill({"BRAM_WIDTH":str(self.bram_width), "STRIDE":str(self.stride), "BRAM_DEPTH":str(self.depth),
+			"MODULEID":str(self.keyword1), TEMPLATE_BANNER:TEMPLATE_NOTICE})
+
 		noOfBlocks = int(self.W//self.stride)
 		for i in range(0,noOfBlocks):
-			content = tcontent
 			path=self.srcfiles_loc+"bramfiles/"
 			if(os.path.isdir(path) is False):
 				os.mkdir(path)
 			
-			file1=open(path+"bram_"+self.keyword+str(i)+"_"+self.keyword1+".v","w+")
+			file1=openOutput(path+"bram_"+self.keyword+str(i)+"_"+self.keyword1+".v","w+")
 			
-			content = re.sub("#BRAMNO#",self.keyword+str(i),content)
-			if(self.keyword=="bloom"):
+			if(self.keyword=="bloom" and noOfBlocks==1):
 				path="\""+self.memfiles_loc+"bloomfilter.mem\""
+			elif(self.keyword=="bloom"):
+				# one memory per bram in the partitioned and blocked layouts, see bloomMemFiles
+				path="\""+self.memfiles_loc+"bloomfilter"+str(i)+".mem\""
+			elif(self.keyword=="cuckoo"):
+				path="\""+self.memfiles_loc+"cuckoofilter.mem\""
+			elif(self.keyword=="exact"):
+				path="\""+self.memfiles_loc+"exactmatch.mem\""
 			else:
 				path="\""+self.memfiles_loc+"stride"+str(self.stride)+"_"+str(self.W)+"bit"+str(i)+".mem\""
-			content = re.sub("#PATH#",path,content)
+			content = tcontent.render({"BRAMNO":self.keyword+str(i), "PATH":path})
 			file1.write(content)
 			file1.close()
 
 class Consolidator:
-	def __init__(self, template_file, srcfiles_loc, W, W1, stride, no_of_instances, rangeMatching):
+	# instanceFile : prefix of the included source files of the instances, "cuckoofilter_" for the cuckoo filter
+	def __init__(self, template_file, srcfiles_loc, W, W1, stride, no_of_instances, rangeMatching, instanceFile="bloomfilter_"):
 		self.template_file = template_file
 		self.srcfiles_loc = srcfiles_loc
 		self.W = W
@@ -463,27 +914,19 @@ class Consolidator:
 		self.stride = stride
 		self.no_of_instances = no_of_instances
 		self.rangeMatching = rangeMatching
+		self.instanceFile = instanceFile
 	
 	
 	def generateSource(self):
 			
-		# open template file.
-		template = open(self.template_file,"r")
-		tcontent = template.read()
-		template.close()
-		
 		if(self.rangeMatching):
 			keyword1 = "_rm"
 		else:
 			keyword1 = "_wrm"
 		
-		tcontent = re.sub("#KEYWORD#", keyword1, tcontent)
-		tcontent = re.sub("#NO_OF_INSTANCES#",str(self.no_of_instances),tcontent)
-		for i in range(self.no_of_instances):
-			tcontent = re.sub("#BRAM_INSTANCES#", "`include \""+str(self.srcfiles_loc)+"bloomfilter_"+str(i)+keyword1+".v\"\n", tcontent)
-		tcontent = re.sub("#W1#",str(self.W1),tcontent)
-		tcontent = re.sub("#W#",str(self.W),tcontent)	
-		tcontent = re.sub("#### [a-zA-Z ]+ ####","/* Auto-generated code. */\n /* DO NOT MODIFY THIS FILE DIRECTLY.*/\n/* #ANY CHANGES SHOULD BE MADE TO THE CORRESPONDING TEMPLATE FILE*/\n",tcontent);
+		includes = "".join("`include \""+str(self.srcfiles_loc)+self.instanceFile+str(i)+keyword1+".v\"\n" for i in range(self.no_of_instances))
+		tcontent = loadTemplate(self.template_file).render({"KEYWORD":keyword1, "NO_OF_INSTANCES":str(self.no_of_instances), "BRAM_INSTANCES":includes,
+			"W1":str(self.W1), "W":str(self.W), TEMPLATE_BANNER:TEMPLATE_NOTICE})
 		buf = ""
 		
 		for i in range(self.no_of_instances):
@@ -506,9 +949,9 @@ class Consolidator:
 			os.mkdir(path)	
 
 		if(self.rangeMatching):
-			outputfile = open(path+"consolidator_rm.v","w+")
+			outputfile = openOutput(path+"consolidator_rm.v","w+")
 		else:
-			outputfile = open(path+"consolidator_wrm.v","w+")
+			outputfile = openOutput(path+"consolidator_wrm.v","w+")
 		
 		outputfile.write(tcontent+buf)
 		outputfile.close()
@@ -524,11 +967,7 @@ class TopModule:
 	
 	def generateSource(self):
 		# open template file.
-		template = open(self.template_file,"r")
-		tcontent = template.read()
-		tcontent = re.sub("#OUT#", self.srcfiles_loc, tcontent)
-		tcontent = re.sub("#W1#",str(self.W1),tcontent)
-		tcontent = re.sub("#W2#",str(self.W),tcontent)
+		tcontent = loadTemplate(self.template_file).render({"OUT":self.srcfiles_loc, "W1":str(self.W1), "W2":str(self.W)})
 		buf=""
 		if(not self.rmNeeded):
 		    buf = buf + "output resultCF; \n consolidator_wrm consolidator_wrm(.src_port(src_port),.dst_port(dst_port),.ip_protocol(ip_protocol),.resultC(resultCF),.test_clk(test_clk));\nendmodule"
@@ -536,13 +975,11 @@ class TopModule:
 		    buf = buf + "output resultCF; \n consolidator_rm consolidator_rm(.src_port(src_port),.dst_port(dst_port),.ip_protocol(ip_protocol),.resultC(resultCF),.test_clk(test_clk));\nendmodule"
 		else:
 		    buf = buf + "output reg resultCF;\nwire cwrm;\nwire crm;\nconsolidator_wrm consolidator_wrm(.src_port(src_port),.dst_port(dst_port),.ip_protocol(ip_protocol),.resultC(cwrm),.test_clk(test_clk));\nconsolidator_rm consolidator_rm(.src_port(src_port),.dst_port(dst_port),.ip_protocol(ip_protocol),.resultC(crm),.test_clk(test_clk));\nalways@(posedge test_clk)\nbegin\nresultCF = cwrm | crm;\nend\nendmodule"
-		    
-		template.close()
 		
 		path=self.srcfiles_loc
 		if(os.path.isdir(path) is False):
 			os.mkdir(path)		
-		outputfile = open(path+"topmodule.v","w+")
+		outputfile = openOutput(path+"topmodule.v","w+")
 		outputfile.write(tcontent+buf)
 		outputfile.close()
 
@@ -561,8 +998,7 @@ class TestBench:
 			print("Not supported yet")
 			exit()
 		
-		template = open(self.template_file, "r")
-		tcontent = template.read()
+		tcontent = loadTemplate(self.template_file).render()
 		
 
 class FinalMatch:
@@ -579,16 +1015,8 @@ class FinalMatch:
 	def generateSource(self):
 		## Generating the Verilog Code FinalMatch.v ##
 			
-		# open template file.
-		template = open(self.template_file,"r")
-		tcontent = template.read()
-		template.close()
-		
-		tcontent = re.sub("#NO_OF_RULES#",str(self.no_of_rules),tcontent)
-		tcontent = re.sub("#W1#",str(self.W1),tcontent)
-		tcontent = re.sub("#W#",str(self.W),tcontent)
-		tcontent = re.sub("#MODULEID#",str(self.keyword),tcontent)	
-		tcontent = re.sub("#### [a-zA-Z ]+ ####","/* Auto-generated code. */\n /* DO NOT MODIFY THIS FILE DIRECTLY.*/\n/* #ANY CHANGES SHOULD BE MADE TO THE CORRESPONDING TEMPLATE FILE*/\n",tcontent);
+		tcontent = loadTemplate(self.template_file).render({"NO_OF_RULES":str(self.no_of_rules), "W1":str(self.W1), "W":str(self.W),
+			"MODULEID":str(self.keyword), TEMPLATE_BANNER:TEMPLATE_NOTICE})
 		
 		
 		noOfLevels = int(math.ceil(math.log(self.no_of_rules,self.stride)))
@@ -617,19 +1045,20 @@ class FinalMatch:
 						input_reg = "final_mv"
 					else:
 						input_reg = "level"+str(i-1)
-						lesserThanStride=0;
+					lesserThanStride=0
 					for k in range(self.stride-1):
 						index = j*self.stride+k
 						if(index < prev_n-2):
 							buf = buf + input_reg+"["+str(index)+"] | "
 						else:
-                                                        lesserThanStride=1
-                                                        k = k-1
+							lesserThanStride=1
+							k = k-1
 							break
-                                        if(lesserThanStride):
-					    buf = buf + input_reg+"["+str(j*self.stride+k+1)+"];\n"
-                                        else:
-					    buf = buf + input_reg+"["+str(j*self.stride+k+1)+"];\n"
+							
+					if(lesserThanStride):
+						buf = buf + input_reg+"["+str(j*self.stride+k+1)+"];\n"
+					else:
+						buf = buf + input_reg+"["+str(j*self.stride+k+1)+"];\n"
 			else:
 				buf = buf+"\tresult="
 				if(i==0):
@@ -649,15 +1078,15 @@ class FinalMatch:
 			buf = buf + "end\n\n"
 			prev_n = length+1	
 
-                if(self.no_of_rules==1):
-                    buf = buf + "always@(posedge test_clk) \n"
-                    buf = buf + "begin\n result = final_mv; \n end\n";
+		if(self.no_of_rules==1):
+			buf = buf + "always@(posedge test_clk) \n"
+			buf = buf + "begin\n result = final_mv; \n end\n";
 
 		buf = buf + "endmodule"
 		path=self.srcfiles_loc+"srcfiles/"
 		if(os.path.isdir(path) is False):
 			os.mkdir(path)		
-		outputfile = open(path+"final_match"+self.keyword+".v","w+")
+		outputfile = openOutput(path+"final_match"+self.keyword+".v","w+")
 		outputfile.write(tcontent+buf)
 		outputfile.close()
 		
@@ -672,16 +1101,8 @@ class IPPROT_MATCH:
 		self.keyword  = keyword
 		
 	def generateSource(self):
-		# open template file.
-		template = open(self.template_file,"r")
-		tcontent = template.read()
-		template.close()
-		
-		tcontent = re.sub("#OUTPUT_WIDTH#",str(self.output_width),tcontent)
-		tcontent = re.sub("#STRIDE#",str(self.stride),tcontent)
-		tcontent = re.sub("#W#",str(self.W),tcontent)
-		tcontent = re.sub("#MODULEID#",self.keyword,tcontent)
-		tcontent = re.sub("#### [a-zA-Z ]+ ####","/* Auto-generated code. */\n /* DO NOT MODIFY THIS FILE DIRECTLY.*/\n/* #ANY CHANGES SHOULD BE MADE TO THE CORRESPONDING TEMPLATE FILE*/\n",tcontent);
+		tcontent = loadTemplate(self.template_file).render({"OUTPUT_WIDTH":str(self.output_width), "STRIDE":str(self.stride), "W":str(self.W),
+			"MODULEID":self.keyword, TEMPLATE_BANNER:TEMPLATE_NOTICE})
 	
 		noOfBlocks = self.W//self.stride
 	
@@ -698,15 +1119,14 @@ class IPPROT_MATCH:
 		buf=buf+"\n // IP_Pro DRAM Match \n\n"
 
 		if(self.isDram):
-		        buf=buf+"reg data; \n\n"
+			buf=buf+"reg data; \n\n"
 			for i in range(noOfBlocks):
 				buf=buf+"dist_ipprot"+str(i)+"_"+self.keyword+" dist_ipprot"+str(i)+"_"+self.keyword+"(.data(data),.addr0(ip_pro["+str(self.stride*(i+1)-1)+":"+str(i*self.stride)+"]),.we(1'b0), .clk(test_clk),.q0(ip_temp"+str(i+1)+")); \n"
 		else:
-                        buf=buf+"reg [n2-1:0] data; \n\n"
+			buf=buf+"reg [n2-1:0] data; \n\n"
 			for i in range(noOfBlocks):
 				buf=buf+"bram_ipprot"+str(i)+"_"+self.keyword+" bram"+str(i)+"_"+self.keyword+"(.clock(test_clk),.ram_enable(1'b1),.write_enable(1'b0),.address(ip_pro["+str(self.stride*(i+1)-1)+":"+str(i*self.stride)+"]),.input_data(data),.output_data(ip_temp"+str(i+1)+"));\n"
 
-
 		buf=buf+"\nalways@(posedge test_clk) \n"
 		buf=buf+"begin \n"
 
@@ -743,19 +1163,19 @@ class IPPROT_MATCH:
 						input_reg = "ip_reg"
 					else:
 						input_reg = "final_match"
-				        lesserThanStride=0	
+					lesserThanStride=0
 					for k in range(self.stride-1):
 						index = j*self.stride+k
 						if(index < prev_n-2):
 							buf1 = buf1 + input_reg+str(index)+" & "
 						else:
-                                                        lesserThanStride=1
-                                                        k = k-1
+							lesserThanStride=1
+							k = k-1
 							break
-                                        if(lesserThanStride):	
-					    buf1 = buf1 + input_reg+str(j*self.stride+k+1)+";\n"
-                                        else:
-					    buf1 = buf1 + input_reg+str(j*self.stride+k+1)+";\n"
+					if(lesserThanStride):	
+						buf1 = buf1 + input_reg+str(j*self.stride+k+1)+";\n"
+					else:
+						buf1 = buf1 + input_reg+str(j*self.stride+k+1)+";\n"
 			else:
 				buf1 = buf1 + "always@(posedge test_clk) \n"
 				buf1 = buf1 + "begin \n"
@@ -766,17 +1186,17 @@ class IPPROT_MATCH:
 					input_reg = "final_match"
 				for k in range(self.stride-1):
 					index = k
-                                        lesserThanStride=0
+					lesserThanStride=0
 					if(index < prev_n-2):
 						buf1 = buf1 + input_reg+str(index)+" & "
 					else:
-                                                lesserThanStride=1
-                                                k = k -1
+						lesserThanStride=1
+						k = k -1
 						break
-                                if(lesserThanStride):
-				    buf1 = buf1 + input_reg+str(k+1)+";\n"		
-                                else:
-				    buf1 = buf1 + input_reg+str(k+1)+";\n"		
+				if(lesserThanStride):
+					buf1 = buf1 + input_reg+str(k+1)+";\n"		
+				else:
+					buf1 = buf1 + input_reg+str(k+1)+";\n"		
 
 			buf1 = buf1 + "end\n"
 			prev_n = length+1
@@ -785,7 +1205,7 @@ class IPPROT_MATCH:
 		path=self.srcfiles_loc+"srcfiles/"
 		if(os.path.isdir(path) is False):
 			os.mkdir(path)				
-		outputfile = open(path+"ip_prot_match_"+self.keyword+".v","w+")
+		outputfile = openOutput(path+"ip_prot_match_"+self.keyword+".v","w+")
 		outputfile.write(tcontent+buf)
 		outputfile.close()
 		
@@ -801,17 +1221,8 @@ class PORT_MATCH:
 		self.keyword = keyword
 		
 	def generateSource(self):
-		# open template file.
-		template = open(self.template_file,"r")
-		tcontent = template.read()
-		template.close()
-		
-		tcontent = re.sub("#OUTPUT_WIDTH#",str(self.output_width),tcontent)
-		tcontent = re.sub("#STRIDE#",str(self.stride),tcontent)
-		tcontent = re.sub("#W#",str(self.W),tcontent)	
-		tcontent = re.sub("#PORT_NUM#",str(self.port_num),tcontent)
-		tcontent = re.sub("#MODULEID#",str(self.keyword),tcontent)
-		tcontent = re.sub("#### [a-zA-Z ]+ ####","/* Auto-generated code. */\n /* DO NOT MODIFY THIS FILE DIRECTLY.*/\n/* #ANY CHANGES SHOULD BE MADE TO THE CORRESPONDING TEMPLATE FILE*/\n",tcontent);
+		tcontent = loadTemplate(self.template_file).render({"OUTPUT_WIDTH":str(self.output_width), "STRIDE":str(self.stride), "W":str(self.W),
+			"PORT_NUM":str(self.port_num), "MODULEID":str(self.keyword), TEMPLATE_BANNER:TEMPLATE_NOTICE})
 	
 		noOfBlocks = self.W//self.stride
 		
@@ -845,11 +1256,11 @@ class PORT_MATCH:
 			keyword="dstport"
 
 		if(self.isDram):			
-		        buf=buf+"reg data; \n\n"
+			buf=buf+"reg data; \n\n"
 			for i in range(noOfBlocks):
 				buf=buf+"dist_"+keyword+str(i)+"_"+self.keyword+" dist_"+keyword+str(i)+"_"+self.keyword+"(.data(data),.addr0(temp_loc"+str(i)+"),.we(1'b0), .clk(test_clk),.q0(temp"+str(i)+"));\n"
 		else:			
-                        buf=buf+"reg [n-1:0] data; \n\n"
+			buf=buf+"reg [n-1:0] data; \n\n"
 			for i in range(noOfBlocks):
 				buf=buf+"bram_"+keyword+str(i)+"_"+self.keyword+" bram_"+keyword+str(i)+"_"+self.keyword+"(.clock(test_clk),.ram_enable(1'b1),.write_enable(1'b0),.address(temp_loc"+str(i)+"),.input_data(data),.output_data(temp"+str(i)+"));\n"
 			
@@ -864,12 +1275,12 @@ class PORT_MATCH:
 		for i in range(noOfBlocks-1):
 			buf=buf+"reg"+str(i)+"&"
 		buf=buf+"reg"+str(i+1)+";\n"
-		buf = buf + "\n endmodule\n";
+		buf = buf + "\n endmodule\n"
 		path=self.srcfiles_loc+"srcfiles/"
 		if(os.path.isdir(path) is False):
 			os.mkdir(path)		
 		
-		outputfile = open(path+"port_match"+str(self.port_num)+"_"+self.keyword+".v","w+")
+		outputfile = openOutput(path+"port_match"+str(self.port_num)+"_"+self.keyword+".v","w+")
 		outputfile.write(tcontent+buf)
 		outputfile.close()
 	
@@ -887,24 +1298,14 @@ class PORT_MATCH_WITH_RANGES:
 		self.sign_f = sign_f
 		
 	def generateSource(self):
-		# open template file.
-		template = open(self.template_file,"r")
-		tcontent = template.read()
-		template.close()
-		
-		tcontent = re.sub("#OUTPUT_WIDTH#",str(self.output_width),tcontent)
-		tcontent = re.sub("#STRIDE#",str(self.stride),tcontent)
-		tcontent = re.sub("#W#",str(self.W),tcontent)	
-		tcontent = re.sub("#PORT_NUM#",str(self.port_num),tcontent)
-		tcontent = re.sub("#MODULEID#",str(self.keyword),tcontent)
-		tcontent = re.sub("#NO_OF_RULES_AFTER_EXPANSION#", str(self.ctr[-1]), tcontent) # last element in the ctr array should contain the last index of the expanded rule set.
-		tcontent = re.sub("#### [a-zA-Z ]+ ####","/* Auto-generated code. */\n /* DO NOT MODIFY THIS FILE DIRECTLY.*/\n/* #ANY CHANGES SHOULD BE MADE TO THE CORRESPONDING TEMPLATE FILE*/\n",tcontent);
+		# last element in the ctr array should contain the last index of the expanded rule set.
+		tcontent = loadTemplate(self.template_file).render({"OUTPUT_WIDTH":str(self.output_width), "STRIDE":str(self.stride), "W":str(self.W),
+			"PORT_NUM":str(self.port_num), "MODULEID":str(self.keyword), "NO_OF_RULES_AFTER_EXPANSION":str(self.ctr[-1]), TEMPLATE_BANNER:TEMPLATE_NOTICE})
 
 		noOfBlocks = self.W//self.stride
 		
 		buf=""
 
-		
 		for i in range(noOfBlocks):
 			buf=buf+"wire [n-1:0] temp"+str(i)+";\n"
 
@@ -932,14 +1333,13 @@ class PORT_MATCH_WITH_RANGES:
 			keyword="dstport"
 
 		if(self.isDram):			
-		        buf=buf+"reg data; \n\n"
+			buf=buf+"reg data; \n\n"
 			for i in range(noOfBlocks):
 				buf=buf+"dist_"+keyword+str(i)+"_"+self.keyword+" dist_"+keyword+str(i)+"_"+self.keyword+"(.data(data),.addr0(temp_loc"+str(i)+"),.we(1'b0), .clk(test_clk),.q0(temp"+str(i)+"));\n"
-		else:			
-                        buf=buf+"reg [n-1:0] data; \n\n"
+		else:
+			buf=buf+"reg [n-1:0] data; \n\n"
 			for i in range(noOfBlocks):
-				buf=buf+"bram_"+keyword+str(i)+"_"+self.keyword+" bram_"+keyword+str(i)+"_"+self.keyword+"(.clock(test_clk),.ram_enable(1'b1),.write_enable(1'b0),.address(temp_loc"+str(i)+"),.input_data(data),.output_data(temp"+str(i)+"));\n"
-			
+				buf=buf+"bram_"+keyword+str(i)+"_"+self.keyword+" bram_"+keyword+str(i)+"_"+self.keyword+"(.clock(test_clk),.ram_enable(1'b1),.write_enable(1'b0),.address(temp_loc"+str(i)+"),.input_data(data),.output_data(temp"+str(i)+"));\n"	
 
 		buf=buf+"always@(posedge test_clk)\nbegin\n"
 		for i in range(noOfBlocks):
@@ -955,39 +1355,39 @@ class PORT_MATCH_WITH_RANGES:
 		buf = buf + "always@(posedge test_clk)\nbegin\n"
 
 		for i in range(0,self.output_width):
-		  
-		  p=[];
-		  n=[];
-		  for j in range(self.ctr[i],self.ctr[i+1]):
-		      if (self.sign_f[j]==0):
-			p.append(j)
-		      elif (self.sign_f[j]==1):
-			n.append(j)
-
-		  buf = buf + "final_mvp["+str(i)+"]="
-
-		  if(len(p)==0):
-		     buf = buf + "0;\n"
-		  else:  
-		     buf = buf + "("
-		     for k in range(len(p)):  
-			if (k!=len(p)-1):
-			   buf = buf + "final_match["+str(p[k])+"] | "
-			elif (k==len(p)-1):
-			   buf = buf + "final_match["+str(p[k])+"] );\n"
-
-		  buf = buf + "final_mvn["+str(i)+"]="
-		  if(len(n)==0):
-		     buf = buf + "0;\n"
-		  else:	
-		     buf = buf + "("
-		     for k in range(len(n)):
-			if (k!=len(n)-1):
-			   buf = buf + "final_match["+str(n[k])+"] | "
-			elif (k==len(n)-1):
-			   buf = buf + "final_match["+str(n[k])+"]);\n"
-		    
-		  buf = buf + "final_mv["+str(i)+"] = final_mvp["+str(i)+"] &~ final_mvn["+str(i)+"];\n"
+			p=[]
+			n=[]
+			for j in range(self.ctr[i],self.ctr[i+1]):
+				if (self.sign_f[j]==0):
+					p.append(j)
+				elif (self.sign_f[j]==1):
+					n.append(j)
+				
+			buf = buf + "final_mvp["+str(i)+"]="
+			
+			if(len(p)==0):
+				buf = buf + "0;\n"
+			else:  
+				buf = buf + "("
+				for k in range(len(p)):  
+					if (k!=len(p)-1):
+						buf = buf + "final_match["+str(p[k])+"] | "
+					elif (k==len(p)-1):
+						buf = buf + "final_match["+str(p[k])+"] );\n"
+			
+			buf = buf + "final_mvn["+str(i)+"]="
+			
+			if(len(n)==0):
+				buf = buf + "0;\n"
+			else:
+				buf = buf + "("
+				for k in range(len(n)):
+					if (k!=len(n)-1):
+						buf = buf + "final_match["+str(n[k])+"] | "
+					elif (k==len(n)-1):
+						buf = buf + "final_match["+str(n[k])+"]);\n"
+					
+			buf = buf + "final_mv["+str(i)+"] = final_mvp["+str(i)+"] &~ final_mvn["+str(i)+"];\n"
 
 		buf = buf + "\nend\n"
 		buf = buf + "endmodule\n"
@@ -996,32 +1396,26 @@ class PORT_MATCH_WITH_RANGES:
 		if(os.path.isdir(path) is False):
 			os.mkdir(path)		
 		
-		outputfile = open(path+"port_match"+str(self.port_num)+"_"+self.keyword+".v","w+")
+		outputfile = openOutput(path+"port_match"+str(self.port_num)+"_"+self.keyword+".v","w+")
 		outputfile.write(tcontent+buf)
 		outputfile.close()						
 				
 		
 class PORT_MATCH_WITH_RANGES_COMP:
-               def __init__ (self, template_loc, srcfiles_loc, stride, noOfRules, port_num, rangeList, keyword, port_width):
-		    self.template_loc = template_loc
-		    self.srcfiles_loc = srcfiles_loc
-		    self.stride = stride
-		    self.port_num = port_num
-		    self.noOfRules = noOfRules
-		    self.rangeList = rangeList      
-		    self.keyword = keyword
-		    self.port_width = port_width
-                                           
-               def generateSource(self):
+	def __init__ (self, template_loc, srcfiles_loc, stride, noOfRules, port_num, rangeList, keyword, port_width):
+		self.template_loc = template_loc
+		self.srcfiles_loc = srcfiles_loc
+		self.stride = stride
+		self.port_num = port_num
+		self.noOfRules = noOfRules
+		self.rangeList = rangeList      
+		self.keyword = keyword
+		self.port_width = port_width
+	
+	def generateSource(self):
 		# open template file for port comparison
-		template = open(self.template_loc+"comparator","r")
-		tcontent = template.read()
-		template.close()
-		
-		tcontent = re.sub("#COMPSIZE#",str(self.port_width),tcontent) 
-		tcontent = re.sub("#PORT_NUM#",str(self.port_num),tcontent)
-		tcontent = re.sub("#MODULEID#",str(self.keyword),tcontent)
-		tcontent = re.sub("#NO_OF_RULES#", str(self.noOfRules), tcontent)
+		tcontent = loadTemplate(self.template_loc+"comparator").render({"COMPSIZE":str(self.port_width), "PORT_NUM":str(self.port_num),
+			"MODULEID":str(self.keyword), "NO_OF_RULES":str(self.noOfRules)})
 		
 		buf = ""
 		for i in range(self.noOfRules):
@@ -1033,7 +1427,6 @@ class PORT_MATCH_WITH_RANGES_COMP:
 		for i in range(self.noOfRules):
 			buf=buf+"wire eqmin"+str(i)+",ltmin"+str(i)+",gtmin"+str(i)+",eqmax"+str(i)+",ltmax"+str(i)+",gtmax"+str(i)+",ir"+str(i)+";\n"
 			
-		
 			buf = buf + "assign minVal"+str(i)+" = { "+str(self.port_width)+"'d"+str(self.rangeList[0][i])+"};\n"
 			buf = buf + "assign maxVal"+str(i)+" = {"+str(self.port_width)+"'d"+str(self.rangeList[1][i])+"};\n"
 			buf = buf + "cmp minComp"+str(i)+"(.a(port_no),.b(minVal"+str(i)+"),.eq(eqmin"+str(i)+"),.lt(ltmin"+str(i)+"),.gt(gtmin"+str(i)+"),.test_clk(test_clk));\n"
@@ -1041,49 +1434,53 @@ class PORT_MATCH_WITH_RANGES_COMP:
 			
 			buf = buf + "assign ir"+str(i)+" = ((eqmin"+str(i)+" | gtmin"+str(i)+") & (~ltmin"+str(i)+")) & ((eqmax"+str(i)+" | ltmax"+str(i)+") & (~gtmax"+str(i)+"));\n"
 			
-	        buf = buf + "always @(posedge test_clk)\nbegin\nfinal_mv= {ir"+str(self.noOfRules-1)
+		buf = buf + "always @(posedge test_clk)\nbegin\nfinal_mv= {ir"+str(self.noOfRules-1)
 		
-	        for i in range(self.noOfRules-2,-1,-1):
-                     buf = buf + ",ir"+str(i)
-                     
-                buf = buf + "};\nend\nendmodule"
-               
-	        path=self.srcfiles_loc+"srcfiles/"
-	        if(os.path.isdir(path) is False):
-	            os.mkdir(path)		
+		for i in range(self.noOfRules-2,-1,-1):
+			buf = buf + ",ir"+str(i)
+			
+		buf = buf + "};\nend\nendmodule"
 		
-                outputfile = open(path+"port_match"+str(self.port_num)+"_"+self.keyword+".v","w+")
-	        outputfile.write(tcontent+buf)
-	        outputfile.close()						
-
-                # open template file for comparator
-		template = open(self.template_loc+"cmp","r")
-		tcontent = template.read()
-		template.close()
+		path=self.srcfiles_loc+"srcfiles/"
+		if(os.path.isdir(path) is False):
+			os.mkdir(path)		
 		
-		tcontent = re.sub("#COMPSIZE#",str(self.port_width),tcontent) 
-		compFile = path+"cmp.v"
-		if(not os.path.isfile(compFile)):
-                    outputfile = open(compFile,"w+")
-	            outputfile.write(tcontent)
-	            outputfile.close()						
-                
-					
+		outputfile = openOutput(path+"port_match"+str(self.port_num)+"_"+self.keyword+".v","w+")
+		outputfile.write(tcontent+buf)
+		outputfile.close()						
+			
+		# open template file for comparator, written by every instance so the manifest keeps it, it
+		# only replaces cmp.v when the content changed
+		tcontent = loadTemplate(self.template_loc+"cmp").render({"COMPSIZE":str(self.port_width)})
+		outputfile = openOutput(path+"cmp.v","w+")
+		outputfile.write(tcontent)
+		outputfile.close()						
+            	
 class BF_PACKET_MATCH:
-	def __init__ (self, template_loc, srcfiles_loc, m, k, keyword):
+	# header is written above the module, BFTop passes the tuned configuration in it
+	# layout is one of BLOOM_LAYOUTS and picks the brams the lookups read, see bloomLookups
+	# hashing "double" instantiates two hash/hash_port cores and derives hash_val_i from them
+	# confirm (buckets, slots) of an ExactMatchTable adds its lookup behind the filter, see confirmLookup
+	# mask (as KEY_CARE_MASK) hashes the masked ip_key of a wildcard group instead of ip_pro
+	def __init__ (self, template_loc, srcfiles_loc, m, k, keyword, header="", layout="replicated", hashing="jenkins", confirm=None, mask=None):
 		self.template_loc = template_loc
 		self.srcfiles_loc = srcfiles_loc
 		self.keyword = keyword	
 		self.m = m
 		self.k = k
+		self.header = header
+		self.layout = layout
+		self.hashing = hashing
+		self.confirm = confirm
+		self.key = "ip_pro" if mask is None else "ip_key"
+		self.mask = mask
 	
 	def generateSource(self):
-	
-		commoncode1_1="module final_match{} (input test_clk, input[15:0] port_no1, input[15:0] port_no2, input[71:0] ip_pro, output result);".format(self.keyword)
-	      
-				  
+		commoncode1_1=self.header+"module final_match{} (input test_clk, input[15:0] port_no1, input[15:0] port_no2, input[71:0] ip_pro, output result);".format(self.keyword)
+	    
 		fullcode1_1=commoncode1_1
-	      
+		if(self.mask is not None):
+			fullcode1_1+="\nwire[71:0] ip_key = ip_pro & 72'h{:018x};\n".format(self.mask)
 		commoncode2_1="wire[31:0]"
 		varcode2_1=""
 		for i in range(1,self.k+1):
@@ -1091,7 +1488,7 @@ class BF_PACKET_MATCH:
 				varcode2_1+="hash_val_{},hash_val_{}_1;".format(i,i)
 			else:
 				varcode2_1+="hash_val_{},hash_val_{}_1,".format(i,i)
-	  
+
 		fullcode2_1=commoncode2_1+varcode2_1
 	      
 		commoncode3_1="wire[31:0]a0,c0,"
@@ -1103,11 +1500,11 @@ class BF_PACKET_MATCH:
 				varcode3_1+="b0{},port0{},".format(i,i)
 	  
 		fullcode3_1=commoncode3_1+varcode3_1
-	      
+
 		commoncode4_1="""
-	  assign a0  = 32'hdeadbef8;
-	  assign c0 =  32'hdeadbef8;
-	      """
+		assign a0  = 32'hdeadbef8;
+		assign c0 =  32'hdeadbef8;
+		"""
 
 		varcode4_1=" "
 		for i in range(1,self.k+1):
@@ -1117,25 +1514,33 @@ class BF_PACKET_MATCH:
 		fullcode4_1=commoncode4_1+varcode4_1 
 	      
 		varcode5_1=" "
-		for i in range(1,self.k+1):
-			varcode5_1+="hash h{}(test_clk,a0[31:0],b0{}[31:0],c0[31:0],ip_pro[71:40],ip_pro[39:8],ip_pro[7:0],hash_val_{}[31:0]);\n".format(i,i,i)
-			varcode5_1+="hash_port h{}_1(test_clk,a0[31:0],port0{}[31:0],c0[31:0],{{port_no1,port_no2}},hash_val_{}_1[31:0]);\n".format(i,i,i)
-		
+		cores = min(2, self.k) if self.hashing=="double" else self.k
+		digest = "double_hash" if self.hashing=="double" else "hash_val"
+		if(self.hashing=="double"):
+			varcode5_1+=self.doubleHashing()
+		for i in range(1,cores+1):
+			varcode5_1+="hash h{}(test_clk,a0[31:0],b0{}[31:0],c0[31:0],{}[71:40],{}[39:8],{}[7:0],{}_{}[31:0]);\n".format(i,i,self.key,self.key,self.key,digest,i)
+			varcode5_1+="hash_port h{}_1(test_clk,a0[31:0],port0{}[31:0],c0[31:0],{{port_no1,port_no2}},{}_{}_1[31:0]);\n".format(i,i,digest,i)
+			
 		for i in range(1,2*self.k+1):
 			varcode5_1+="wire final{};\n".format(i)
 			  
 		fullcode5_1=varcode5_1
-		varcode6_1 = " assign result = final1"
+		varcode6_1 = " assign result = final1" if self.confirm is None else self.confirmLookup()+" assign bloom_pass = final1"
 		for i in range(2,2*self.k+1):
 			varcode6_1 = varcode6_1 + "&& final{}".format(i)
 		varcode6_1 = varcode6_1 + ";\n"
 		
-		bitsReqd = int(math.ceil(math.log(self.m, 2)))
+		if(self.layout=="blocked"):
+			varcode6_1+=self.blockedLookups()
 		for i in range(1,2*self.k+1):
-			if(i<=self.k):
-				varcode6_1+="bram_bloom0_0_wrm bram_{}(.clock(test_clk),.ram_enable(1'b1),.write_enable(1'b0),.address(hash_val_{}   [{}:0]),.input_data(1'b1),.output_data(final{}));\n".format(i,i,bitsReqd-1,i)
-			else:
-				varcode6_1+="bram_bloom0_0_wrm bram_{}(.clock(test_clk),.ram_enable(1'b1),.write_enable(1'b0),.address(hash_val_{}_1[{}:0]),.input_data(1'b1),.output_data(final{}));\n".format(i,i-self.k,bitsReqd-1,i)
+			if(self.layout=="blocked"):
+				break
+			# partitioned: lookup i reads bram_bloom<i-1>, replicated: every lookup reads a copy of bram_bloom0
+			bram = "bram_bloom{}_{}".format(i-1 if self.layout=="partitioned" else 0, self.keyword)
+			digest = "hash_val_{}".format(i) if i<=self.k else "hash_val_{}_1".format(i-self.k)
+			varcode6_1+=self.reduction(digest, self.m)
+			varcode6_1+="{} bram_{}(.clock(test_clk),.ram_enable(1'b1),.write_enable(1'b0),.address({}),.input_data(1'b1),.output_data(final{}));\n".format(bram,i,self.address(digest, self.m),i)
 	  
 		fullcode6_1=varcode6_1+"endmodule\n"   
 
@@ -1149,20 +1554,179 @@ class BF_PACKET_MATCH:
 		
 
 		# open template file for comparator
-		template = open(self.template_loc+"bf_packet_match","r")
-		tcontent = template.read()
-		template.close()
-				
-		outputfile = open(path+"bloomfilter_"+self.keyword+".v","w+")
+		tcontent = loadTemplate(self.template_loc+"bf_packet_match").render()
+
+		outputfile = openOutput(path+"bloomfilter_"+self.keyword+".v","w+")
 		outputfile.write(fullcode+tcontent)
 		outputfile.close()	        
 	      
 		print("[+] source code for bloom filter generated with {} hash functions".format(self.k))
-      
 
-	
-	
-		
-		
-               
-               
+	# Exact-match confirmation, one cycle behind the filter lookup: the bucket addresses of the seed 0
+	# and seed 1 digests are registered while the filter brams are read, bram_exact0 is only read for
+	# headers that pass the filter and the result is set when a valid slot of either bucket holds the
+	# header, which is delayed through the hash pipeline and both reads to meet it. See ExactMatchTable.
+	def confirmLookup(self):
+		(buckets, slots) = self.confirm
+		bits = max(1, int(math.ceil(math.log(buckets, 2))))
+		width = slots*EXACT_SLOT_BITS
+		delay = HASH_PIPELINE_LATENCY+2
+		digest = "double_hash" if self.hashing=="double" else "hash_val"
+		code = "wire bloom_pass;\n"
+		if(self.k < 2):
+			# the filter has only the seed 0 cores
+			digest2 = "confirm_hash_2"
+			code += "wire[31:0] b02,port02,confirm_hash_2,confirm_hash_2_1;\n"
+			code += "assign b02 = 32'hdeadbef2;\nassign port02 = 32'hdeadbef2;\n"
+			code += "hash hc2(test_clk,a0[31:0],b02[31:0],c0[31:0],{}[71:40],{}[39:8],{}[7:0],confirm_hash_2[31:0]);\n".format(self.key,self.key,self.key)
+			code += "hash_port hc2_1(test_clk,a0[31:0],port02[31:0],c0[31:0],{port_no1,port_no2},confirm_hash_2_1[31:0]);\n"
+		else:
+			digest2 = digest+"_2"
+		code += "wire[31:0] exact_digest1 = {}_1 ^ {}_1_1;\n".format(digest, digest)
+		code += "wire[31:0] exact_digest2 = {} ^ {}_1;\n".format(digest2, digest2)
+		code += self.reduction("exact_digest1", buckets)+self.reduction("exact_digest2", buckets)
+		code += "reg[{}:0] exact_bucket1,exact_bucket2;\n".format(bits-1)
+		code += "reg[104:0] exact_key[0:{}];\n".format(delay-1)
+		code += "integer exact_stage;\n"
+		code += "always @(posedge test_clk) begin\n"
+		code += "exact_bucket1 <= {};\nexact_bucket2 <= {};\n".format(self.address("exact_digest1", buckets), self.address("exact_digest2", buckets))
+		code += "exact_key[0] <= {{1'b1,{},port_no1,port_no2}};\n".format(self.key)
+		code += "for(exact_stage=1;exact_stage<{};exact_stage=exact_stage+1) exact_key[exact_stage] <= exact_key[exact_stage-1];\n".format(delay)
+		code += "end\n"
+		code += "wire[{}:0] exact_a,exact_b;\n".format(width-1)
+		code += "bram_exact0_{} bram_exact(.clock(test_clk),.ram_enable(bloom_pass),.write_enable(1'b0),.address(exact_bucket1),.address_b(exact_bucket2),.input_data({}'b0),.output_data(exact_a),.output_data_b(exact_b));\n".format(self.keyword, width)
+		matches = []
+		for j in range(slots):
+			matches.append("(exact_a[{}:{}] == exact_key[{}])".format((j+1)*EXACT_SLOT_BITS-1, j*EXACT_SLOT_BITS, delay-1))
+			matches.append("(exact_b[{}:{}] == exact_key[{}])".format((j+1)*EXACT_SLOT_BITS-1, j*EXACT_SLOT_BITS, delay-1))
+		code += "reg exact_pass;\n"
+		code += "always @(posedge test_clk) exact_pass <= bloom_pass;\n"
+		code += "assign result = exact_pass & ("+" | ".join(matches)+");\n"
+		return code
+
+	# Double hashing: hash_val_i = h1 + (i-1)*h2 of the two cores, with h2 made odd, as hashSequence
+	def doubleHashing(self):
+		code = "wire[31:0] double_hash_1,double_hash_1_1,double_hash_2,double_hash_2_1,double_step,double_step_1;\n"
+		if(self.k > 1):
+			code += "assign double_step = {double_hash_2[31:1],1'b1};\n"
+			code += "assign double_step_1 = {double_hash_2_1[31:1],1'b1};\n"
+		code += "assign hash_val_1 = double_hash_1;\nassign hash_val_1_1 = double_hash_1_1;\n"
+		for i in range(2,self.k+1):
+			code += "assign hash_val_{} = double_hash_1 + 32'd{}*double_step;\n".format(i, i-1)
+			code += "assign hash_val_{}_1 = double_hash_1_1 + 32'd{}*double_step_1;\n".format(i, i-1)
+		return code
+
+	# Address of a digest in a memory of size words, as reduceDigest: its low bits for a power of two,
+	# else the top of the product (low digestBits of the digest)*size declared by reduction
+	def address(self, digest, size, digestBits=32):
+		bits = int(math.ceil(math.log(size, 2)))
+		if(size & (size-1) == 0):
+			return "{}[{}:0]".format(digest, bits-1)
+		return "{}_reduced[{}:{}]".format(digest, digestBits-1+bits, digestBits)
+
+	def reduction(self, digest, size, digestBits=32):
+		if(size & (size-1) == 0):
+			return ""
+		if(digestBits < 32):
+			return "wire[63:0] {}_reduced = {}[{}:0] * 64'd{};\n".format(digest, digest, digestBits-1, size)
+		return "wire[63:0] {}_reduced = {} * 64'd{};\n".format(digest, digest, size)
+
+	# Blocked layout: bram_bloom0 holds the ip/protocol words and bram_bloom1 the port words. Both are
+	# addressed by the low bits of the first digest; the bit of each lookup in the word comes from the
+	# top bits of its digest, registered for the cycle the word is read in.
+	def blockedLookups(self):
+		offsetBits = int(math.log(BLOOM_BLOCK_BITS, 2))
+		words = self.m//BLOOM_BLOCK_BITS
+		# the word is reduced from the bits below the offset, as bloomLookups
+		wordBits = 32-offsetBits
+		code = "wire[{}:0] word1,word2;\n".format(BLOOM_BLOCK_BITS-1)
+		code += self.reduction("hash_val_1", words, wordBits)+self.reduction("hash_val_1_1", words, wordBits)
+		code += "bram_bloom0_{} bram_1(.clock(test_clk),.ram_enable(1'b1),.write_enable(1'b0),.address({}),.input_data({}'b0),.output_data(word1));\n".format(self.keyword, self.address("hash_val_1", words, wordBits), BLOOM_BLOCK_BITS)
+		code += "bram_bloom1_{} bram_2(.clock(test_clk),.ram_enable(1'b1),.write_enable(1'b0),.address({}),.input_data({}'b0),.output_data(word2));\n".format(self.keyword, self.address("hash_val_1_1", words, wordBits), BLOOM_BLOCK_BITS)
+		for i in range(1,self.k+1):
+			code += "reg[{}:0] offset{},offset{}_1;\n".format(offsetBits-1, i, i)
+			code += "always @(posedge test_clk) begin offset{} <= hash_val_{}[31:{}]; offset{}_1 <= hash_val_{}_1[31:{}]; end\n".format(i, i, 32-offsetBits, i, i, 32-offsetBits)
+			code += "assign final{} = word1[offset{}];\n".format(i, i)
+			code += "assign final{} = word2[offset{}_1];\n".format(self.k+i, i)
+		return code
+
+class CF_PACKET_MATCH:
+	# Cuckoo filter lookup: the seed 0 and seed 1 hash/hash_port cores give the first bucket and the
+	# fingerprint, both buckets are read through the two ports of bram_cuckoo0 and the result is set
+	# when one of their slots holds the fingerprint, see cuckooLookups
+	# mask (as KEY_CARE_MASK) hashes the masked ip_key of a wildcard group instead of ip_pro, as BF_PACKET_MATCH
+	def __init__ (self, template_loc, srcfiles_loc, buckets, fingerprintBits, slots, keyword, mask=None):
+		self.template_loc = template_loc
+		self.srcfiles_loc = srcfiles_loc
+		self.keyword = keyword
+		self.buckets = buckets
+		self.fingerprintBits = fingerprintBits
+		self.slots = slots
+		self.key = "ip_pro" if mask is None else "ip_key"
+		self.mask = mask
+
+	def generateSource(self):
+		f = self.fingerprintBits
+		width = self.slots*f
+		code = "module final_match{} (input test_clk, input[15:0] port_no1, input[15:0] port_no2, input[71:0] ip_pro, output result);\n".format(self.keyword)
+		if(self.mask is not None):
+			code += "wire[71:0] ip_key = ip_pro & 72'h{:018x};\n".format(self.mask)
+		code += "wire[31:0] a0,c0,b01,b02;\n"
+		code += "assign a0 = 32'hdeadbef8;\nassign c0 = 32'hdeadbef8;\n"
+		code += "assign b01 = 32'hdeadbef1;\nassign b02 = 32'hdeadbef2;\n"
+		code += "wire[31:0] hash_val_1,hash_val_1_1,hash_val_2,hash_val_2_1;\n"
+		for i in range(1,3):
+			code += "hash h{}(test_clk,a0[31:0],b0{}[31:0],c0[31:0],{}[71:40],{}[39:8],{}[7:0],hash_val_{}[31:0]);\n".format(i,i,self.key,self.key,self.key,i)
+			code += "hash_port h{}_1(test_clk,a0[31:0],b0{}[31:0],c0[31:0],{{port_no1,port_no2}},hash_val_{}_1[31:0]);\n".format(i,i,i)
+
+		# first bucket, fingerprint (0 is an empty slot) and the other bucket (H(fingerprint) - first) mod buckets
+		code += "wire[31:0] bucket_digest = hash_val_1 ^ hash_val_1_1;\n"
+		code += "wire[31:0] fp_digest = hash_val_2 ^ hash_val_2_1;\n"
+		code += "wire[{}:0] fingerprint = (fp_digest[{}:0] == {}'d0) ? {}'d1 : fp_digest[{}:0];\n".format(f-1,f-1,f,f,f-1)
+		code += "wire[31:0] fp_hash = {{{}'d0,fingerprint}} * 32'h{:x};\n".format(32-f, CUCKOO_FP_MULTIPLIER) if f < 32 else "wire[31:0] fp_hash = fingerprint * 32'h{:x};\n".format(CUCKOO_FP_MULTIPLIER)
+		bits = self.addressBits()
+		code += self.reduction("bucket_digest")+self.reduction("fp_hash")
+		code += "wire[{}:0] bucket1 = {};\n".format(bits, self.address("bucket_digest"))
+		code += "wire[{}:0] fp_offset = {};\n".format(bits, self.address("fp_hash"))
+		code += "wire[{}:0] bucket2 = (fp_offset >= bucket1) ? fp_offset - bucket1 : fp_offset + {}'d{} - bucket1;\n".format(bits, bits+1, self.buckets)
+
+		# the fingerprint is registered for the cycle the buckets are read in
+		code += "reg[{}:0] fingerprint_q;\n".format(f-1)
+		code += "always @(posedge test_clk) fingerprint_q <= fingerprint;\n"
+		code += "wire[{}:0] bucket_a,bucket_b;\n".format(width-1)
+		code += "bram_cuckoo0_{} bram_1(.clock(test_clk),.ram_enable(1'b1),.write_enable(1'b0),.address(bucket1[{}:0]),.address_b(bucket2[{}:0]),.input_data({}'b0),.output_data(bucket_a),.output_data_b(bucket_b));\n".format(self.keyword, bits-1, bits-1, width)
+		matches = []
+		for j in range(self.slots):
+			matches.append("(bucket_a[{}:{}] == fingerprint_q)".format((j+1)*f-1, j*f))
+			matches.append("(bucket_b[{}:{}] == fingerprint_q)".format((j+1)*f-1, j*f))
+		code += "assign result = "+" | ".join(matches)+";\n"
+		code += "endmodule\n"
+
+		path=self.srcfiles_loc
+		if(os.path.isdir(path) is False):
+			os.mkdir(path)
+
+		# the hash and hash_port cores
+		tcontent = loadTemplate(self.template_loc+"bf_packet_match").render()
+
+		outputfile = openOutput(path+"cuckoofilter_"+self.keyword+".v","w+")
+		outputfile.write(code+tcontent)
+		outputfile.close()
+
+		print("[+] source code for cuckoo filter generated with {} buckets of {} {} bit fingerprints".format(self.buckets, self.slots, f))
+
+	# Bits of a bucket index, one more holds the sum in the other bucket computation
+	def addressBits(self):
+		return max(1, int(math.ceil(math.log(self.buckets, 2))))
+
+	# Bucket of a digest as reduceDigest, like BF_PACKET_MATCH.address
+	def address(self, digest):
+		bits = self.addressBits()
+		if(self.buckets & (self.buckets-1) == 0):
+			return "{{1'b0,{}[{}:0]}}".format(digest, bits-1)
+		return "{{1'b0,{}_reduced[{}:32]}}".format(digest, 31+bits)
+
+	def reduction(self, digest):
+		if(self.buckets & (self.buckets-1) == 0):
+			return ""
+		return "wire[63:0] {}_reduced = {} * 64'd{};\n".format(digest, digest, self.buckets)
@@ -0,0 +1,135 @@
+#--------------------------------------------------------------------------------------------------
+#Details:
+#
+#Content-addressed writes of the generated srcfiles/ and memfiles/. Every file is written next to
+#its final place while its SHA-256 is computed, and only replaces the old file when the content
+#changed, so unchanged modules keep their modification time and Vivado/make do not rebuild them.
+#The hashes are kept in manifest.json at the output root; the files of the last run that were not
+#written again (instances that no longer exist) are deleted when the run finishes.
+#--------------------------------------------------------------------------------------------------
+
+import os
+import json
+import hashlib
+
+MANIFEST_FILE = "manifest.json"
+HASH_BLOCK = 1 << 20
+
+def fileDigest(filename):
+	digest = hashlib.sha256()
+	with open(filename, "rb") as fh:
+		for block in iter(lambda: fh.read(HASH_BLOCK), b""):
+			digest.update(block)
+	return digest.hexdigest()
+
+class OutputManifest:
+	def __init__(self, root):
+		self.root = root
+		self.path = os.path.join(root, MANIFEST_FILE)
+		# relative path -> [sha256, size, mtime_ns] of the last finished run and of this one
+		self.previous = {}
+		if os.path.isfile(self.path):
+			with open(self.path, "r") as fh:
+				self.previous = json.load(fh)["files"]
+		self.current = {}
+
+	def key(self, filename):
+		return os.path.relpath(filename, self.root)
+
+	# Digest of the file as it is on disk, taken from the manifest while the file is not touched
+	def existingDigest(self, filename):
+		record = self.previous.get(self.key(filename))
+		if not os.path.isfile(filename):
+			return None
+		stat = os.stat(filename)
+		if record is not None and record[1:] == [stat.st_size, stat.st_mtime_ns]:
+			return record[0]
+		return fileDigest(filename)
+
+	# The content of filename was written to partial with the given digest
+	def commit(self, filename, partial, digest):
+		if self.existingDigest(filename) == digest:
+			os.remove(partial)
+		else:
+			os.replace(partial, filename)
+		stat = os.stat(filename)
+		self.current[self.key(filename)] = [digest, stat.st_size, stat.st_mtime_ns]
+
+	def open(self, filename, mode="w"):
+		return ManifestFile(self, filename, "b" in mode)
+
+	# Deletes the files of the last run that this run did not write, and the directories they leave
+	# empty, then saves the manifest of this run
+	def finish(self):
+		for key in sorted(set(self.previous) - set(self.current)):
+			filename = os.path.join(self.root, key)
+			if os.path.isfile(filename):
+				os.remove(filename)
+			directory = os.path.dirname(filename)
+			while os.path.isdir(directory) and not os.listdir(directory) and self.key(directory) != ".":
+				os.rmdir(directory)
+				directory = os.path.dirname(directory)
+		partial = self.path+".partial"+str(os.getpid())
+		with open(partial, "w") as fh:
+			json.dump({"files":self.current}, fh, indent=1, sort_keys=True)
+		os.replace(partial, self.path)
+		self.previous = self.current
+		self.current = {}
+
+#File object of OutputManifest.open, the content goes to <filename>.partial<pid> until it is closed
+class ManifestFile:
+	def __init__(self, manifest, filename, binary):
+		self.manifest = manifest
+		self.filename = filename
+		self.binary = binary
+		self.partial = filename+".partial"+str(os.getpid())
+		self.file = open(self.partial, "wb" if binary else "w")
+		self.digest = hashlib.sha256()
+
+	def write(self, data):
+		self.digest.update(data if self.binary else data.encode())
+		return self.file.write(data)
+
+	def close(self):
+		if self.file.closed:
+			return
+		self.file.close()
+		self.manifest.commit(self.filename, self.partial, self.digest.hexdigest())
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		if excType is None:
+			self.close()
+		else:
+			self.file.close()
+			os.remove(self.partial)
+
+# Manifest the generators write through, None writes the files directly
+activeManifest = None
+
+def setManifest(manifest):
+	global activeManifest
+	previous = activeManifest
+	activeManifest = manifest
+	return previous
+
+def getManifest():
+	return activeManifest
+
+# open() for a generated file
+def openOutput(filename, mode="w"):
+	if activeManifest is None:
+		return open(filename, mode)
+	return activeManifest.open(filename, mode)
+
+# Pool worker: runs function(*args) writing through manifest and returns the records of what it
+# wrote, the parent adds them to its own manifest
+def runWithManifest(manifest, function, *args):
+	previous = setManifest(manifest)
+	try:
+		function(*args)
+	finally:
+		setManifest(previous)
+	return manifest.current if manifest is not None else {}
@@ -0,0 +1,55 @@
+#--------------------------------------------------------------------------------------------------
+#Details:
+#
+#Compiled cache of the validated whitelist. An entry is keyed by a hash of the rules file content
+#and the validation check flags, and holds the RuleTable that is left after the ACCEPT filter and
+#the validation. It is saved with RuleTable.save and memory-mapped when it is loaded, so a run with
+#an unchanged rules file skips parsing and validation.
+#--------------------------------------------------------------------------------------------------
+
+import os
+import json
+import shutil
+import hashlib
+
+from scripts.ruleTable import RuleTable
+
+# Part of every key, bump it when the cached table layout or the validation result changes
+CACHE_VERSION = 1
+HASH_BLOCK = 1 << 20
+
+# Hex digest of the rules file content and the [srcIpCheck, dstIpCheck, protocolCheck, portCheck] flags
+def cacheKey(rulesFile, checks):
+	digest = hashlib.sha256()
+	digest.update(json.dumps({"version":CACHE_VERSION, "checks":checks}).encode())
+	with open(rulesFile, "rb") as fh:
+		for block in iter(lambda: fh.read(HASH_BLOCK), b""):
+			digest.update(block)
+	return digest.hexdigest()
+
+class RuleCache:
+	def __init__(self, path):
+		self.path = path
+
+	def entry(self, key):
+		return os.path.join(self.path, key)
+
+	# (number of rules in the rules file, validated RuleTable) or None if there is no entry
+	def load(self, key):
+		meta = os.path.join(self.entry(key), "cache.json")
+		if not os.path.isfile(meta):
+			return None
+		with open(meta, "r") as fh:
+			numberOfRules = json.load(fh)["numberOfRules"]
+		return (numberOfRules, RuleTable.load(os.path.join(self.entry(key), "rules"), mmap=True))
+
+	# The entry is written next to its final place and renamed, a crashed run leaves no half entry
+	def save(self, key, numberOfRules, table):
+		entry = self.entry(key)
+		partial = entry+".partial"+str(os.getpid())
+		shutil.rmtree(partial, ignore_errors=True)
+		table.save(os.path.join(partial, "rules"))
+		with open(os.path.join(partial, "cache.json"), "w") as fh:
+			json.dump({"numberOfRules":numberOfRules, "rules":len(table)}, fh)
+		shutil.rmtree(entry, ignore_errors=True)
+		os.rename(partial, entry)
@@ -0,0 +1,352 @@
+#--------------------------------------------------------------------------------------------------
+#Details:
+#
+#Columnar storage for firewall rules. The rules file is parsed once into NumPy columns and the
+#validator and the memory generators read from those columns instead of re-parsing the strings.
+#--------------------------------------------------------------------------------------------------
+
+import os
+import re
+import json
+import collections
+import numpy as np
+
+WILDCARD = "*"
+
+# ACCEPT and REJECT always own codes 0 and 1, other actions are appended as they are seen
+ACTION_NAMES = ["ACCEPT", "REJECT"]
+
+# fromFile parses this many rules into Python lists before they are packed into columns,
+# and reads the file in blocks of STREAM_BLOCK characters
+STREAM_CHUNK = 65536
+STREAM_BLOCK = 1 << 20
+
+WHITESPACE = re.compile(r"\s*")
+
+# One rule with its addresses packed into 32 bit words, used by the pairwise checks of the validator.
+# The *_wild words have every don't care bit set, the values are 0 in those bits.
+PackedRule = collections.namedtuple("PackedRule", ["src_ip", "src_wild", "dst_ip", "dst_wild", "protocol", "protocol_wild", "src_port_min", "src_port_max", "dst_port_min", "dst_port_max", "action"])
+
+# Columns of a RuleTable with their dtype and the number of values per rule
+COLUMNS = [
+	("src_ip", np.uint8, 4),
+	("src_wild", np.uint8, 4),
+	("dst_ip", np.uint8, 4),
+	("dst_wild", np.uint8, 4),
+	("protocol", np.uint8, 1),
+	("protocol_wild", np.uint8, 1),
+	("src_port_min", np.uint16, 1),
+	("src_port_max", np.uint16, 1),
+	("dst_port_min", np.uint16, 1),
+	("dst_port_max", np.uint16, 1),
+	("action", np.uint8, 1)]
+
+class RuleTable:
+	def __init__(self, columns, actionNames=None):
+		for (name, dtype, width) in COLUMNS:
+			setattr(self, name, columns[name])
+		if actionNames is None:
+			actionNames = list(ACTION_NAMES)
+		self.actionNames = actionNames
+
+	# Joins tables, action codes are remapped onto the names of the first table
+	@classmethod
+	def concat(cls, tables):
+		actionNames = list(tables[0].actionNames)
+		columns = dict((name, []) for (name, dtype, width) in COLUMNS)
+		for table in tables:
+			for (name, dtype, width) in COLUMNS:
+				if name != "action":
+					columns[name].append(getattr(table, name))
+			codes = np.array([actionCodeIn(actionNames, action) for action in table.actionNames], dtype=np.uint8)
+			columns["action"].append(codes[table.action] if len(table) else table.action)
+		return cls(dict((name, np.concatenate(columns[name])) for name in columns), actionNames)
+
+	# A table is saved as a directory with one .npy file per column, load can memory-map them
+	@classmethod
+	def load(cls, path, mmap=False):
+		columns = {}
+		for (name, dtype, width) in COLUMNS:
+			columns[name] = np.load(os.path.join(path, name+".npy"), mmap_mode="r" if mmap else None)
+		with open(os.path.join(path, "actions.json"), "r") as fh:
+			actionNames = json.load(fh)
+		return cls(columns, actionNames)
+
+	def save(self, path):
+		if not os.path.isdir(path):
+			os.makedirs(path)
+		for (name, dtype, width) in COLUMNS:
+			np.save(os.path.join(path, name+".npy"), np.ascontiguousarray(getattr(self, name)))
+		with open(os.path.join(path, "actions.json"), "w") as fh:
+			json.dump(self.actionNames, fh)
+
+	# Parse a list of rule dicts (as found in the rules file) into a table
+	@classmethod
+	def fromRules(cls, rules):
+		actionNames = list(ACTION_NAMES)
+		fields = dict((name, []) for (name, dtype, width) in COLUMNS)
+		for rule in rules:
+			appendRule(fields, rule, actionNames)
+		return cls(columnsFromLists(fields, len(rules)), actionNames)
+
+	# Streams a rules file into a table, either {"rules":[...]} or NDJSON (one rule object per line)
+	# Rules are packed into columns STREAM_CHUNK at a time, so the parsed dicts never pile up.
+	@classmethod
+	def fromFile(cls, path, chunk=STREAM_CHUNK):
+		actionNames = list(ACTION_NAMES)
+		chunks = []
+		fields = dict((name, []) for (name, dtype, width) in COLUMNS)
+		count = 0
+		for rule in streamRules(path):
+			appendRule(fields, rule, actionNames)
+			count += 1
+			if count == chunk:
+				chunks.append(columnsFromLists(fields, count))
+				fields = dict((name, []) for (name, dtype, width) in COLUMNS)
+				count = 0
+		chunks.append(columnsFromLists(fields, count))
+		# one column at a time, the chunks of a column are dropped once it is joined
+		columns = {}
+		for (name, dtype, width) in COLUMNS:
+			columns[name] = np.concatenate([c.pop(name) for c in chunks])
+		return cls(columns, actionNames)
+
+	def __len__(self):
+		return len(self.action)
+
+	# table[i] gives back the rule dict, slices, index arrays and masks give a new table
+	def __getitem__(self, key):
+		if isinstance(key, (int, np.integer)):
+			return self.rule(key)
+		columns = dict((name, getattr(self, name)[key]) for (name, dtype, width) in COLUMNS)
+		return RuleTable(columns, self.actionNames)
+
+	def columns(self):
+		return dict((name, getattr(self, name)) for (name, dtype, width) in COLUMNS)
+
+	def nbytes(self):
+		return sum(getattr(self, name).nbytes for (name, dtype, width) in COLUMNS)
+
+	def actionCode(self, name):
+		return actionCodeIn(self.actionNames, name)
+
+	# Source and destination addresses as (value, wildcard) 32 bit words
+	def packedSrc(self):
+		return packWords(self.src_ip), packWords(self.src_wild)
+
+	def packedDst(self):
+		return packWords(self.dst_ip), packWords(self.dst_wild)
+
+	def packedRules(self):
+		(src_ip, src_wild) = self.packedSrc()
+		(dst_ip, dst_wild) = self.packedDst()
+		return [PackedRule(*row) for row in zip(src_ip.tolist(), src_wild.tolist(), dst_ip.tolist(), dst_wild.tolist(),
+			self.protocol.tolist(), self.protocol_wild.tolist(), self.src_port_min.tolist(), self.src_port_max.tolist(),
+			self.dst_port_min.tolist(), self.dst_port_max.tolist(), self.action.tolist())]
+
+	# One fixed size byte string per rule, equal rules give equal keys
+	def rowKeys(self):
+		rows = np.concatenate([np.ascontiguousarray(getattr(self, name)).reshape(len(self), -1).view(np.uint8) for (name, dtype, width) in COLUMNS], axis=1)
+		return np.ascontiguousarray(rows).view(np.dtype((np.void, rows.shape[1]))).ravel()
+
+	# Indices of the first occurrence of every distinct rule, in table order
+	def uniqueIndices(self):
+		if len(self) == 0:
+			return np.zeros(0, dtype=np.int64)
+		(values, first) = np.unique(self.rowKeys(), return_index=True)
+		return np.sort(first)
+
+	def unique(self):
+		return self[self.uniqueIndices()]
+
+	def rule(self, i):
+		return {"src_ip":formatAddress(self.src_ip[i], self.src_wild[i]),
+			"dst_ip":formatAddress(self.dst_ip[i], self.dst_wild[i]),
+			"protocol":WILDCARD if self.protocol_wild[i] else str(self.protocol[i]),
+			"src_port_min":str(self.src_port_min[i]),
+			"src_port_max":str(self.src_port_max[i]),
+			"dst_port_min":str(self.dst_port_min[i]),
+			"dst_port_max":str(self.dst_port_max[i]),
+			"action":self.actionNames[self.action[i]]}
+
+	def toRules(self):
+		return [self.rule(i) for i in range(len(self))]
+
+# Yields the rule dicts of a rules file one by one
+# The {"rules":[...]} layout is decoded object by object from blocks of the file. Any other
+# file is read as NDJSON, unless its first line is not a complete object, in which case it is
+# a json document with other keys before "rules" and is loaded as a whole.
+def streamRules(path):
+	with open(path, "r") as fh:
+		stream = JsonStream(fh)
+		if stream.startsRulesList():
+			for rule in stream.listItems():
+				yield rule
+			return
+	with open(path, "r") as fh:
+		first = fh.readline()
+		try:
+			rule = json.loads(first) if first.strip() else None
+		except ValueError:
+			fh.seek(0)
+			for rule in json.load(fh)["rules"]:
+				yield rule
+			return
+		if rule is not None and "rules" in rule:
+			# the whole document on one line
+			for r in rule["rules"]:
+				yield r
+			return
+		if rule is not None:
+			yield rule
+		for line in fh:
+			if line.strip():
+				yield json.loads(line)
+
+# Reads json values one at a time from a file, keeping only the current block in memory
+class JsonStream:
+	def __init__(self, fh, blockSize=STREAM_BLOCK):
+		self.fh = fh
+		self.blockSize = blockSize
+		self.buffer = ""
+		self.pos = 0
+		self.eof = False
+		self.decoder = json.JSONDecoder()
+
+	def fill(self):
+		block = self.fh.read(self.blockSize)
+		if not block:
+			self.eof = True
+			return False
+		self.buffer = self.buffer[self.pos:] + block
+		self.pos = 0
+		return True
+
+	# Next non whitespace character, without consuming it ("" at the end of the file)
+	def peek(self):
+		while True:
+			self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+			if self.pos < len(self.buffer) or not self.fill():
+				return self.buffer[self.pos:self.pos+1]
+
+	def expect(self, char):
+		if self.peek() != char:
+			return False
+		self.pos += 1
+		return True
+
+	def value(self):
+		while True:
+			self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+			try:
+				(value, end) = self.decoder.raw_decode(self.buffer, self.pos)
+				# a number could go on in the next block
+				if end < len(self.buffer) or self.eof:
+					self.pos = end
+					return value
+			except ValueError:
+				if self.eof:
+					raise
+			self.fill()
+
+	# Consumes '{ "rules" : [' if the file starts with it
+	def startsRulesList(self):
+		if not self.expect("{") or self.peek() != '"':
+			return False
+		return self.value() == "rules" and self.expect(":") and self.expect("[")
+
+	def listItems(self):
+		if self.expect("]"):
+			return
+		while True:
+			value = self.value()
+			# the separator is nearly always in the buffer already
+			pos = WHITESPACE.match(self.buffer, self.pos).end()
+			separator = self.buffer[pos:pos+1]
+			if separator in (",", "]"):
+				self.pos = pos+1
+			elif self.expect(","):
+				separator = ","
+			elif self.expect("]"):
+				separator = "]"
+			else:
+				raise ValueError("Expected , or ] after a rule in the rules list")
+			yield value
+			if separator == "]":
+				return
+
+def actionCodeIn(actionNames, name):
+	if name not in actionNames:
+		actionNames.append(name)
+	return actionNames.index(name)
+
+def appendRule(fields, rule, actionNames):
+	parseAddress(rule["src_ip"], fields["src_ip"], fields["src_wild"])
+	parseAddress(rule["dst_ip"], fields["dst_ip"], fields["dst_wild"])
+	protocol = str(rule["protocol"])
+	if protocol == WILDCARD:
+		fields["protocol"].append(0)
+		fields["protocol_wild"].append(1)
+	else:
+		fields["protocol"].append(parseField(protocol, 0xff, "protocol"))
+		fields["protocol_wild"].append(0)
+	for name in ["src_port_min", "src_port_max", "dst_port_min", "dst_port_max"]:
+		fields[name].append(parseField(rule[name], 0xffff, name))
+	fields["action"].append(actionCodeIn(actionNames, rule["action"]))
+
+def columnsFromLists(fields, no_of_rules):
+	columns = {}
+	for (name, dtype, width) in COLUMNS:
+		column = np.array(fields[name], dtype=dtype)
+		if width > 1:
+			column = column.reshape(no_of_rules, width)
+		columns[name] = column
+	return columns
+
+# Appends the 4 octets of an address and their wildcard masks. An address is either dotted with
+# * octets (10.1.*.*) or a CIDR prefix (10.1.0.0/15), whose host bits become wildcard bits.
+def parseAddress(address, values, wild):
+	if "/" in address:
+		parseCidr(address, values, wild)
+		return
+	octets = address.split(".")
+	if len(octets) != 4:
+		raise ValueError("Invalid ip address: "+address)
+	for octet in octets:
+		if octet == WILDCARD:
+			values.append(0)
+			wild.append(0xff)
+		else:
+			values.append(parseField(octet, 0xff, "ip address "+address))
+			wild.append(0)
+
+def parseCidr(address, values, wild):
+	(address, length) = address.split("/", 1)
+	octets = address.split(".")
+	if len(octets) != 4 or WILDCARD in octets:
+		raise ValueError("Invalid ip prefix: "+address+"/"+length)
+	length = parseField(length, 32, "prefix length of "+address)
+	hostBits = (1 << (32-length)) - 1
+	for f in range(4):
+		octetWild = (hostBits >> (24-8*f)) & 0xff
+		values.append(parseField(octets[f], 0xff, "ip address "+address) & ~octetWild)
+		wild.append(octetWild)
+
+def parseField(value, maxValue, name):
+	value = int(value)
+	if value < 0 or value > maxValue:
+		raise ValueError("Value out of range for "+name+": "+str(value))
+	return value
+
+# Whole octet wildcards are written back with *, other prefixes in CIDR notation
+def formatAddress(octets, wild):
+	if all(wild[f] in (0, 0xff) for f in range(4)):
+		return ".".join(WILDCARD if wild[f] else str(octets[f]) for f in range(4))
+	hostBits = 0
+	for f in range(4):
+		hostBits = (hostBits << 8) | int(wild[f])
+	return ".".join(str(octets[f]) for f in range(4)) + "/" + str(32 - hostBits.bit_length())
+
+# (n,4) octet columns to big endian 32 bit words
+def packWords(octets):
+	return np.ascontiguousarray(octets).view(">u4").ravel().astype(np.uint32)
@@ -1,61 +1,96 @@
+import os
 import json
+import math
+import collections
+import bisect
 import argparse 
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
+from scripts.ruleTable import RuleTable
+
+# Peak memory of the temporaries of one findSubsets block, and what one (row, column) pair costs in it
+DEFAULT_TILE_BYTES = 64 << 20
+TILE_BYTES_PER_PAIR = 16
+
+# PortIndex buckets up to this size are scanned instead of searched through the tree
+SMALL_PORT_INDEX = 8
+
+#Rules are kept in a RuleTable, a list of rule dicts is converted on construction.
+#The pairwise checks below take two PackedRule rows (see RuleTable.packedRules).
 class RulesValidator:
-	def __init__(self, rules, srcIpCheck, dstIpCheck, protocolCheck, portCheck):
+	def __init__(self, rules, srcIpCheck, dstIpCheck, protocolCheck, portCheck, maxTileBytes=DEFAULT_TILE_BYTES, processes=1):
+		if not isinstance(rules, RuleTable):
+			rules = RuleTable.fromRules(rules)
 		self.rules = rules
 		self.srcIpCheck = srcIpCheck
 		self.dstIpCheck = dstIpCheck
 		self.protocolCheck = protocolCheck
 		self.portCheck = portCheck
+		self.maxTileBytes = maxTileBytes
+		self.processes = processes
 
-	#To check if src_ips are same(normally or with *)
+	#To check if src_ips are same(normally, with * or as a prefix)
 	def src_ip(self,i,j):
-		x = i['src_ip'].split('.')
-		y = j['src_ip'].split('.')
-		
-		if x[0] == '*' or x[0] == y[0]:
-			if x[1] == '*' or x[1] == y[1]:
-				if x[2] == '*' or x[2] == y[2]:
-					if x[3] == '*' or x[3] == y[3]:
-						return True
+		# every wildcard bit of j has to be a wildcard bit of i, and the other bits of i have to match
+		if (j.src_wild & ~i.src_wild) == 0:
+			if ((i.src_ip ^ j.src_ip) & ~i.src_wild) == 0:
+				return True
 		return False
 	
-	#To check if dst_ips are same(normally or with *)
+	#To check if dst_ips are same(normally, with * or as a prefix)
 	def dst_ip(self,i,j):
-		x = i['dst_ip'].split('.')
-		y = j['dst_ip'].split('.')
-		
-		if x[0] == '*' or x[0] == y[0]:
-			if x[1] == '*' or x[1] == y[1]:
-				if x[2] == '*' or x[2] == y[2]:
-					if x[3] == '*' or x[3] == y[3]:
-						return True
+		if (j.dst_wild & ~i.dst_wild) == 0:
+			if ((i.dst_ip ^ j.dst_ip) & ~i.dst_wild) == 0:
+				return True
 		return False
 	
 	#To check if protocols are same
 	def protocol(self,i, j):
-		if i['protocol'] == j['protocol']:
+		if i.protocol == j.protocol and i.protocol_wild == j.protocol_wild:
 			return True
 		else:
 			return False	
 
 	#To check if src_port and dst_port are subsets
 	def check_subset(self,i,j):
-		if int(i['src_port_min']) <= int(j['src_port_min']):
-			if int(i['src_port_max']) >= int(j['src_port_max']):
-				if int(i['dst_port_min']) <= int(j['dst_port_min']):
-					if int(i['dst_port_max']) >= int(j['dst_port_max']): 
+		if i.src_port_min <= j.src_port_min:
+			if i.src_port_max >= j.src_port_max:
+				if i.dst_port_min <= j.dst_port_min:
+					if i.dst_port_max >= j.dst_port_max: 
 						return True
 		return False 
 	
 	#Remove Contradictions
-	#This function returns a list after removing contradictory rules. 
+	#This function returns a RuleTable after removing contradictory rules. 
 	def findContradiction(self):
 		uniqueRules = self.unique_rules()
 		length = len(uniqueRules)
-		k = []
 		
+		if self.processes > 1:
+			contra = self.shardedContradictions(uniqueRules)
+		else:
+			contra = self.indexedContradictions(uniqueRules)
+		k = set()
+		for (i,j) in contra:
+			k.add(i)
+			k.add(j)
+		
+		keep = np.ones(length, dtype=bool)
+		keep[list(k)] = False
+		outdata = uniqueRules[keep]
+		
+		if len(outdata) != length:
+			print('There are total', len(outdata) , 'rules after removing contradictions')
+			print('Below is the list of all rules indices that are correlations of each other')
+			print(contra)
+		return outdata
+
+	#Pairwise contradiction search, kept as the reference for indexedContradictions
+	#Returns the (i,j) pairs in the order the double loop finds them
+	def pairwiseContradictions(self, uniqueRules):
+		length = len(uniqueRules)
+		uniqueRules = uniqueRules.packedRules()
 		contra=[]
 		for i in range(length):
 			for j in range(i+1, length):
@@ -77,28 +112,67 @@ class RulesValidator:
 						count+=1
 				
 				if count == 4:
-					if uniqueRules[i]['action']!=uniqueRules[j]['action']:
+					if uniqueRules[i].action!=uniqueRules[j].action:
 						contra.append((i,j))
-						if i not in k:
-							k.append(i)
-						if j not in k:
-							k.append(j)
-		
-		outdata = []
-		for p in range(length):
-			if p not in k:
-				outdata.append(uniqueRules[p])
+		return contra
+
+	#Indexed contradiction search, returns the same pairs as pairwiseContradictions
+	#The rules go into a RuleIndex, so a rule is only compared with the rules whose src and dst
+	#prefixes lie on its path down the tries and whose port ranges contain its own.
+	#If a coverers mask is given only those rules are indexed, i.e. can be the i of a pair.
+	def indexedContradictions(self, uniqueRules, coverers=None):
+		# a pair is only counted when all four checks are enabled and pass
+		if not (self.srcIpCheck and self.dstIpCheck and self.protocolCheck and self.portCheck):
+			return []
 		
-		if len(outdata) != length:
-			print('There are total', len(outdata) , 'rules after removing contradictions')
-			print('Below is the list of all rules indices that are correlations of each other')
-			print(contra)
-		return outdata
+		packed = uniqueRules.packedRules()
+		indices = range(len(packed)) if coverers is None else np.flatnonzero(coverers).tolist()
+		index = RuleIndex(packed, indices)
+		contra = []
+		for j in range(len(packed)):
+			for (action, covering) in index.covering(packed[j]):
+				if action != packed[j].action:
+					contra.extend((i,j) for i in covering if i < j)
+		contra.sort()
+		return contra
+
+	#Indices of the rules of the table covering rule j (all four checks), j itself included
+	def coveringRules(self, table, j):
+		if not (self.srcIpCheck and self.dstIpCheck and self.protocolCheck and self.portCheck):
+			return []
+		packed = table.packedRules()
+		return sorted(i for (action, covering) in RuleIndex(packed, range(len(packed))).covering(packed[j]) for i in covering)
 
 	#identify and eliminate subset
-	#this functions returns a list of rules after removing the subsets
-	def findSubsets(self, outdata):
-		l = []
+	#this functions returns a RuleTable after removing the subsets
+	#A rule is shadowed by the first earlier rule that covers it with the same action. That rule
+	#can never be shadowed itself (whatever covers it covers the later rule too), so this is the
+	#same set and the same (i,j) pairs the greedy loop in pairwiseSubsets finds.
+	def findSubsets(self, table):
+		if self.processes > 1:
+			shadow = self.shardedSubsets(table)
+		else:
+			shadow = self.tiledSubsets(table)
+		
+		keep = np.ones(len(table), dtype=bool)
+		keep[[j for (i,j) in shadow]] = False
+		finaldata = table[keep]
+		
+		if len(finaldata) != len(table):
+			print('There are total', len(finaldata) , 'rules after removing subsets')
+			print('Below is the list of all rule  indices that are simply shadowed')
+			print(shadow)
+		return finaldata
+
+	#Shadowed (i,j) pairs found through firstCoverers, in the order pairwiseSubsets gives them
+	def tiledSubsets(self, table):
+		return shadowPairs(self.firstCoverers(table))
+
+	#Greedy pairwise subset search, kept as the reference for tiledSubsets
+	#Returns the (i,j) pairs in the order the double loop finds them
+	def pairwiseSubsets(self, table):
+		outdata = table.packedRules()
+		l = set()
 		shadow = []
 		
 		for i in range(len(outdata)):
@@ -128,30 +202,598 @@ class RulesValidator:
 						count+=1
 					
 				if count == 4:
-					if outdata[i]['action'] == outdata[j]['action']:
+					if outdata[i].action == outdata[j].action:
 						shadow.append((i,j))
+						l.add(j)
+		return shadow
 
-						if j not in l:
-							l.append(j)
+	#For every rule the index of the first earlier rule covering it with the same action, -1 if none
+	#Rules are grouped by protocol and action first, as only those can cover each other. Within a
+	#group a block of rows is broadcast against a block of columns over the packed fields, with
+	#at most maxTileBytes of temporaries per block, and columns drop out once a coverer is found.
+	#If a coverers mask is given only those rules are tried as the earlier rule.
+	def firstCoverers(self, table, coverers=None):
+		first = np.full(len(table), -1, dtype=np.int64)
+		# a pair is only counted when all four checks are enabled and pass
+		if not (self.srcIpCheck and self.dstIpCheck and self.protocolCheck and self.portCheck):
+			return first
+		
+		(src_ip, src_wild) = table.packedSrc()
+		(dst_ip, dst_wild) = table.packedDst()
+		fields = [src_ip, src_wild, dst_ip, dst_wild, table.src_port_min, table.src_port_max, table.dst_port_min, table.dst_port_max]
+		group = table.protocol.astype(np.uint32) | (table.protocol_wild.astype(np.uint32) << 8) | (table.action.astype(np.uint32) << 9)
+		order = np.argsort(group, kind="stable")
+		bounds = np.flatnonzero(np.diff(group[order])) + 1
+		tile = max(1, int(math.sqrt(self.maxTileBytes / TILE_BYTES_PER_PAIR)))
+		for members in np.split(order, bounds):
+			rows = None if coverers is None else np.flatnonzero(coverers[members])
+			local = firstCoverersInGroup([f[members] for f in fields], tile, rows)
+			found = local >= 0
+			first[members[found]] = members[local[found]]
+		return first
+
+	#Sharded versions of indexedContradictions and tiledSubsets, run in a pool of self.processes
+	#Rules with different protocols never cover each other, and neither do rules with different
+	#concrete first src ip octets. Each (protocol, octet) shard is searched on its own. Rules with
+	#a wildcard in the first octet can cover any rule of their protocol; they are handled by a
+	#cross-shard pass per protocol with only those rules as the covering side.
+	def shardedContradictions(self, table):
+		contra = []
+		for (indices, pairs) in self.runShards(table, shardContradictions):
+			contra.extend((int(indices[i]), int(indices[j])) for (i,j) in pairs)
+		contra.sort()
+		return contra
+	
+	def shardedSubsets(self, table):
+		first = np.full(len(table), -1, dtype=np.int64)
+		for (indices, local) in self.runShards(table, shardCoverers):
+			found = np.flatnonzero(local >= 0)
+			candidate = indices[local[found]]
+			current = first[indices[found]]
+			# keep the earlier of the in-shard and the cross-shard coverer
+			first[indices[found]] = np.where((current < 0) | (candidate < current), candidate, current)
+		return shadowPairs(first)
+	
+	def runShards(self, table, function):
+		protocol = table.protocol.astype(np.int64) | (table.protocol_wild.astype(np.int64) << 8)
+		wildFirst = table.src_wild[:,0] != 0
+		shardKey = np.where(wildFirst, -1, (protocol << 8) | table.src_ip[:,0])
 		
-		finaldata=[]
-		for p in range(len(outdata)):
-			if p not in l:
-				finaldata.append(outdata[p])
+		tasks = []
+		for key in np.unique(shardKey[~wildFirst]):
+			tasks.append((np.flatnonzero(shardKey == key), None))
+		for key in np.unique(protocol[wildFirst]):
+			indices = np.flatnonzero(protocol == key)
+			tasks.append((indices, wildFirst[indices]))
 		
-		if len(finaldata) != len(outdata):
-			print('There are total', len(finaldata) , 'rules after removing subsets')
-			print('Below is the list of all rule  indices that are simply shadowed')
-			print(shadow)
-		return finaldata
+		# hand out the biggest shards first, a shard costs about its size squared
+		tasks.sort(key=lambda task: -len(task[0]))
+		checks = (self.srcIpCheck, self.dstIpCheck, self.protocolCheck, self.portCheck, self.maxTileBytes)
+		with ProcessPoolExecutor(max_workers=self.processes) as pool:
+			futures = [pool.submit(function, checks, table[indices], coverers) for (indices, coverers) in tasks]
+			return [(tasks[t][0], futures[t].result()) for t in range(len(tasks))]
+
+	#Report of the rule pairs with conflicting actions whose port ranges overlap only partially
+	#Rules are grouped in buckets of identical addresses and protocol. Two rules of a bucket
+	#overlap partially when their src and dst port ranges both intersect but neither rule's
+	#ranges contain the other's (containment is what findContradiction looks at).
+	#Returns the (i,j) pairs, i<j, sorted.
+	def findOverlaps(self, table):
+		overlaps = sweepOverlaps(table)
+		if len(overlaps) != 0:
+			print('There are total', len(overlaps), 'pairs of rules with conflicting actions and partially overlapping ports')
+			print('Below is the list of those rule indices for every address and protocol')
+			bucket = overlapBuckets(table)
+			groups = {}
+			for (i,j) in overlaps:
+				groups.setdefault(bucket[i], []).append((i,j))
+			for b in sorted(groups):
+				rule = table[groups[b][0][0]]
+				print(rule["src_ip"], rule["dst_ip"], rule["protocol"], groups[b])
+		return overlaps
+
+	#Pairwise overlap search, kept as the reference for sweepOverlaps
+	def pairwiseOverlaps(self, table):
+		rules = table.packedRules()
+		overlaps = []
+		for i in range(len(rules)):
+			for j in range(i+1, len(rules)):
+				(a, b) = (rules[i], rules[j])
+				if a.action == b.action or a[:6] != b[:6]:
+					continue
+				if a.src_port_min > b.src_port_max or b.src_port_min > a.src_port_max:
+					continue
+				if a.dst_port_min > b.dst_port_max or b.dst_port_min > a.dst_port_max:
+					continue
+				if self.check_subset(a, b) or self.check_subset(b, a):
+					continue
+				overlaps.append((i,j))
+		return overlaps
 
 	#Total number of unique rules in the given json file
 	def unique_rules(self):
-		l = []
-		for j in self.rules:
-			if (j in l) is False:
-				l.append(j)
-		return l
+		return self.rules.unique()
+
+
+#Keeps the result of findSubsets(findContradiction()) up to date while rules are added and removed
+#Every rule gets a stable id in rule file order. Per rule it keeps whether it is a duplicate of an
+#earlier rule, how many contradictions it is part of and the id of the first rule shadowing it, so
+#a delta only runs one-vs-all checks for the rules it touches instead of validating the whole set.
+#The state can be saved to a directory and loaded again, the rules are kept as a RuleTable.
+class IncrementalValidator:
+	def __init__(self, rules, srcIpCheck, dstIpCheck, protocolCheck, portCheck, state=None):
+		if not isinstance(rules, RuleTable):
+			rules = RuleTable.fromRules(rules)
+		self.checks = [srcIpCheck, dstIpCheck, protocolCheck, portCheck]
+		self.table = rules
+		self.pack()
+		if state is None:
+			self.build()
+		else:
+			(self.ids, self.active, self.contraCount, self.shadowedBy) = state
+			self.nextId = int(self.ids[-1])+1 if len(self.ids) else 0
+
+	@classmethod
+	def load(cls, path, mmap=False):
+		with open(os.path.join(path, "validator.json"), "r") as fh:
+			meta = json.load(fh)
+		state = [np.array(np.load(os.path.join(path, name+".npy"))) for name in ["ids", "active", "contraCount", "shadowedBy"]]
+		iv = cls(RuleTable.load(os.path.join(path, "rules"), mmap), *meta["checks"], state=state)
+		iv.nextId = meta["nextId"]
+		return iv
+
+	def save(self, path):
+		self.table.save(os.path.join(path, "rules"))
+		for name in ["ids", "active", "contraCount", "shadowedBy"]:
+			np.save(os.path.join(path, name+".npy"), getattr(self, name))
+		with open(os.path.join(path, "validator.json"), "w") as fh:
+			json.dump({"checks":self.checks, "nextId":self.nextId}, fh)
+
+	#Full validation of the current table, the starting point of the deltas
+	def build(self):
+		n = len(self.table)
+		self.ids = np.arange(n, dtype=np.int64)
+		self.nextId = n
+		self.active = np.zeros(n, dtype=bool)
+		self.contraCount = np.zeros(n, dtype=np.int64)
+		self.shadowedBy = np.full(n, -1, dtype=np.int64)
+		
+		rv = RulesValidator(self.table, *self.checks)
+		unique = self.table.uniqueIndices()
+		self.active[unique] = True
+		contra = np.array(rv.indexedContradictions(self.table[unique]), dtype=np.int64).reshape(-1, 2)
+		np.add.at(self.contraCount, unique[contra.ravel()], 1)
+		
+		out = np.flatnonzero(self.outMask())
+		first = rv.firstCoverers(self.table[out])
+		found = first >= 0
+		self.shadowedBy[out[found]] = self.ids[out[first[found]]]
+
+	#Packed columns for the one-vs-all checks, rebuilt whenever the table changes
+	def pack(self):
+		table = self.table
+		(src_ip, src_wild) = table.packedSrc()
+		(dst_ip, dst_wild) = table.packedDst()
+		protocol = table.protocol.astype(np.uint32) | (table.protocol_wild.astype(np.uint32) << 8)
+		self.fields = (src_ip, src_wild, dst_ip, dst_wild, protocol, np.asarray(table.src_port_min), np.asarray(table.src_port_max),
+			np.asarray(table.dst_port_min), np.asarray(table.dst_port_max))
+		self.keys = table.rowKeys() if len(table) else np.zeros(0, dtype="V27")
+		self.action = np.asarray(table.action)
+		self.enabled = all(self.checks)
+
+	#Rules that survive findContradiction and the final whitelist
+	def outMask(self):
+		return self.active & (self.contraCount == 0)
+
+	def validRules(self):
+		return self.table[self.outMask() & (self.shadowedBy < 0)]
+
+	#Mask of the rules covering rule p, and of the rules rule p covers
+	def covering(self, p):
+		(src_ip, src_wild, dst_ip, dst_wild, protocol, src_port_min, src_port_max, dst_port_min, dst_port_max) = self.fields
+		if not self.enabled:
+			return np.zeros(len(src_ip), dtype=bool)
+		cover = (protocol == protocol[p]) & (src_port_min <= src_port_min[p]) & (src_port_max >= src_port_max[p])
+		cover &= (dst_port_min <= dst_port_min[p]) & (dst_port_max >= dst_port_max[p])
+		cover &= ((src_wild[p] & ~src_wild) == 0) & (((src_ip ^ src_ip[p]) & ~src_wild) == 0)
+		cover &= ((dst_wild[p] & ~dst_wild) == 0) & (((dst_ip ^ dst_ip[p]) & ~dst_wild) == 0)
+		return cover
+
+	def covered(self, p):
+		(src_ip, src_wild, dst_ip, dst_wild, protocol, src_port_min, src_port_max, dst_port_min, dst_port_max) = self.fields
+		if not self.enabled:
+			return np.zeros(len(src_ip), dtype=bool)
+		cover = (protocol == protocol[p]) & (src_port_min >= src_port_min[p]) & (src_port_max <= src_port_max[p])
+		cover &= (dst_port_min >= dst_port_min[p]) & (dst_port_max <= dst_port_max[p])
+		cover &= ((src_wild & ~src_wild[p]) == 0) & (((src_ip ^ src_ip[p]) & ~src_wild[p]) == 0)
+		cover &= ((dst_wild & ~dst_wild[p]) == 0) & (((dst_ip ^ dst_ip[p]) & ~dst_wild[p]) == 0)
+		return cover
+
+	#Active rules forming a contradiction with rule p, as positions
+	def contraPartners(self, p):
+		position = np.arange(len(self.ids))
+		partners = (self.covering(p) & (position < p)) | (self.covered(p) & (position > p))
+		partners &= self.active & (self.action != self.action[p])
+		return np.flatnonzero(partners)
+
+	#Id of the first rule left after findContradiction that shadows rule p, -1 if none
+	def firstCoverer(self, p):
+		cover = self.covering(p)[:p] & self.outMask()[:p] & (self.action[:p] == self.action[p])
+		if not cover.any():
+			return -1
+		return int(self.ids[cover.argmax()])
+
+	def setShadow(self, p, coverer):
+		old = int(self.shadowedBy[p])
+		if old != coverer:
+			if old >= 0:
+				self.report["unshadowed"].append((old, int(self.ids[p])))
+			if coverer >= 0:
+				self.report["shadowed"].append((coverer, int(self.ids[p])))
+			self.shadowedBy[p] = coverer
+
+	#Rule q is no longer left after findContradiction, the rules it shadowed look for another coverer
+	def leaveOut(self, q):
+		self.setShadow(q, -1)
+		for r in np.flatnonzero(self.shadowedBy == self.ids[q]):
+			self.setShadow(r, self.firstCoverer(r))
+
+	#Rule q is left after findContradiction again, it may shadow later rules
+	def enterOut(self, q):
+		self.setShadow(q, self.firstCoverer(q))
+		later = self.covered(q) & self.outMask() & (self.action == self.action[q])
+		later[:q+1] = False
+		for r in np.flatnonzero(later):
+			if self.shadowedBy[r] < 0 or self.shadowedBy[r] > self.ids[q]:
+				self.setShadow(r, int(self.ids[q]))
+
+	def contraPair(self, p, q):
+		return (int(self.ids[min(p,q)]), int(self.ids[max(p,q)]))
+
+	#Rule p becomes the first occurrence of its rule
+	def activate(self, p):
+		partners = self.contraPartners(p)
+		self.active[p] = True
+		self.contraCount[p] = len(partners)
+		for q in partners:
+			self.report["contradictions"].append(self.contraPair(p, q))
+			self.contraCount[q] += 1
+			if self.contraCount[q] == 1:
+				self.leaveOut(q)
+		if len(partners) == 0:
+			self.enterOut(p)
+
+	def deactivate(self, p):
+		wasOut = self.outMask()[p]
+		partners = self.contraPartners(p)
+		self.active[p] = False
+		self.contraCount[p] = 0
+		if wasOut:
+			self.leaveOut(p)
+		for q in partners:
+			self.report["resolved"].append(self.contraPair(p, q))
+			self.contraCount[q] -= 1
+			if self.contraCount[q] == 0:
+				self.enterOut(q)
+
+	#Appends rules (dicts or a RuleTable) at the end of the rule file order
+	#Returns the report of the delta, see endReport
+	def add_rules(self, rules):
+		if not isinstance(rules, RuleTable):
+			rules = RuleTable.fromRules(rules)
+		self.report = {"ids":[], "contradictions":[], "resolved":[], "shadowed":[], "unshadowed":[]}
+		start = len(self.table)
+		added = len(rules)
+		self.table = RuleTable.concat([self.table, rules])
+		self.ids = np.concatenate([self.ids, np.arange(self.nextId, self.nextId+added, dtype=np.int64)])
+		self.nextId += added
+		self.active = np.concatenate([self.active, np.zeros(added, dtype=bool)])
+		self.contraCount = np.concatenate([self.contraCount, np.zeros(added, dtype=np.int64)])
+		self.shadowedBy = np.concatenate([self.shadowedBy, np.full(added, -1, dtype=np.int64)])
+		self.pack()
+		
+		for p in range(start, start+added):
+			self.report["ids"].append(int(self.ids[p]))
+			# a later copy of a rule is dropped by unique_rules
+			if not (self.active[:p] & (self.keys[:p] == self.keys[p])).any():
+				self.activate(p)
+		return self.endReport()
+
+	#Removes rules given by id or as rule dicts (the first remaining copy of the rule is removed)
+	#Returns the report of the delta, see endReport
+	def remove_rules(self, rules):
+		self.report = {"ids":[], "contradictions":[], "resolved":[], "shadowed":[], "unshadowed":[]}
+		for rule in rules:
+			p = self.position(rule)
+			self.report["ids"].append(int(self.ids[p]))
+			wasActive = self.active[p]
+			if wasActive:
+				self.deactivate(p)
+			
+			keep = np.ones(len(self.ids), dtype=bool)
+			keep[p] = False
+			self.table = self.table[keep]
+			(self.ids, self.active, self.contraCount, self.shadowedBy) = (self.ids[keep], self.active[keep], self.contraCount[keep], self.shadowedBy[keep])
+			key = self.keys[p]
+			self.pack()
+			
+			# the next copy of a removed first occurrence takes its place
+			if wasActive:
+				copies = np.flatnonzero(self.keys[p:] == key)
+				if len(copies):
+					self.activate(p+copies[0])
+		return self.endReport()
+
+	#Brings the table in line with a new version of the rule file
+	#Rules missing from it are removed, the rules after the last one that is still in order are
+	#removed and added again at the end. Returns the combined report of both deltas.
+	def sync(self, rules):
+		if not isinstance(rules, RuleTable):
+			rules = RuleTable.fromRules(rules)
+		keys = RuleTable.concat([self.table, rules]).rowKeys()
+		(old, new) = (keys[:len(self.table)].tolist(), keys[len(self.table):].tolist())
+		removed = []
+		j = 0
+		for i in range(len(old)):
+			if j < len(new) and old[i] == new[j]:
+				j += 1
+			else:
+				removed.append(int(self.ids[i]))
+		removedReport = self.remove_rules(removed)
+		addedReport = self.add_rules(rules[np.arange(j, len(rules))])
+		for name in removedReport:
+			addedReport[name] = removedReport[name] + addedReport[name]
+		return addedReport
+
+	def position(self, rule):
+		if isinstance(rule, dict):
+			key = RuleTable.concat([self.table[:0], RuleTable.fromRules([rule])]).rowKeys()[0]
+			matches = np.flatnonzero(self.keys == key)
+			if len(matches) == 0:
+				raise ValueError("Rule not found: "+str(rule))
+			return int(matches[0])
+		p = int(np.searchsorted(self.ids, rule))
+		if p == len(self.ids) or self.ids[p] != rule:
+			raise ValueError("Unknown rule id: "+str(rule))
+		return p
+
+	#Report of a delta, all entries are rule ids:
+	#contradictions/resolved are the (i,j) contradiction pairs that appeared/went away,
+	#shadowed/unshadowed the (coverer, rule) shadow pairs that appeared/went away.
+	#A pair that appears and goes away again within the delta is left out.
+	def endReport(self):
+		report = self.report
+		for (new, gone) in [("contradictions", "resolved"), ("shadowed", "unshadowed")]:
+			(appeared, disappeared) = (collections.Counter(report[new]), collections.Counter(report[gone]))
+			report[new] = sorted((appeared - disappeared).elements())
+			report[gone] = sorted((disappeared - appeared).elements())
+		self.report = None
+		return report
+
+
+#(i,j) pairs from a firstCoverers result, sorted like the greedy loop gives them
+def shadowPairs(first):
+	shadowed = np.flatnonzero(first >= 0)
+	return sorted(zip(first[shadowed].tolist(), shadowed.tolist()))
+
+#Bucket number of every rule for RulesValidator.findOverlaps, equal addresses and protocol share it
+def overlapBuckets(table):
+	if len(table) == 0:
+		return np.zeros(0, dtype=np.int64)
+	columns = [table.src_ip, table.src_wild, table.dst_ip, table.dst_wild, table.protocol[:,None], table.protocol_wild[:,None]]
+	rows = np.ascontiguousarray(np.concatenate(columns, axis=1))
+	(values, bucket) = np.unique(rows.view(np.dtype((np.void, rows.shape[1]))).ravel(), return_inverse=True)
+	return bucket.ravel()
+
+#Sweep line search behind RulesValidator.findOverlaps
+#Along one port axis the rules are sorted by (bucket, start). Two intervals intersect iff one of
+#them starts inside the other, so for every rule a binary search gives the contiguous run of
+#rules of the other actions starting inside it, and every intersecting pair is found once.
+#The other axis and containment are then checked on those pairs only. The axis with fewer
+#intersecting pairs is used, so the cost is O(n log n + k) with k the pairs along that axis.
+def sweepOverlaps(table):
+	bucket = overlapBuckets(table)
+	ports = [(table.src_port_min.astype(np.int64), table.src_port_max.astype(np.int64)),
+		(table.dst_port_min.astype(np.int64), table.dst_port_max.astype(np.int64))]
+	action = np.asarray(table.action)
+	
+	# for every action the pairs with the rules of a higher action code, so each pair once
+	sweeps = []
+	for x in np.unique(action)[:-1]:
+		a = np.flatnonzero(action == x)
+		b = np.flatnonzero(action > x)
+		axes = [sweepPairs(bucket, start, end, a, b) for (start, end) in ports]
+		sweeps.append(axes)
+	
+	if not sweeps:
+		return []
+	axis = 0 if sum(len(axes[0][0]) for axes in sweeps) <= sum(len(axes[1][0]) for axes in sweeps) else 1
+	i = np.concatenate([axes[axis][0] for axes in sweeps])
+	j = np.concatenate([axes[axis][1] for axes in sweeps])
+	
+	(start, end) = ports[1-axis]
+	keep = (start[i] <= end[j]) & (start[j] <= end[i])
+	(smin, smax, dmin, dmax) = (ports[0][0], ports[0][1], ports[1][0], ports[1][1])
+	iInJ = (smin[j] <= smin[i]) & (smax[j] >= smax[i]) & (dmin[j] <= dmin[i]) & (dmax[j] >= dmax[i])
+	jInI = (smin[i] <= smin[j]) & (smax[i] >= smax[j]) & (dmin[i] <= dmin[j]) & (dmax[i] >= dmax[j])
+	keep &= ~iInJ & ~jInI
+	pairs = np.stack([np.minimum(i[keep], j[keep]), np.maximum(i[keep], j[keep])], axis=1)
+	return sorted(map(tuple, pairs.tolist()))
+
+#(a, b) pairs of the rules a and b of one bucket whose [start, end] intervals intersect
+#Found as the b starting inside a plus the a starting inside b (after its start).
+def sweepPairs(bucket, start, end, a, b):
+	found = [startsInside(bucket, start, end, a, b, 0), startsInside(bucket, start, end, b, a, 1)]
+	return (np.concatenate([found[0][0], found[1][1]]), np.concatenate([found[0][1], found[1][0]]))
+
+#(o, r) pairs where the rules r start inside the interval of the rules o, at or after start + after
+def startsInside(bucket, start, end, outer, rules, after):
+	key = (bucket[rules] << 17) | start[rules]
+	order = np.argsort(key, kind="stable")
+	(key, rules) = (key[order], rules[order])
+	lo = np.searchsorted(key, (bucket[outer] << 17) | (start[outer] + after), side="left")
+	hi = np.searchsorted(key, (bucket[outer] << 17) | end[outer], side="right")
+	counts = np.maximum(hi - lo, 0)
+	first = np.cumsum(counts) - counts
+	offsets = np.arange(counts.sum()) - np.repeat(first, counts) + np.repeat(lo, counts)
+	return (np.repeat(outer, counts), rules[offsets])
+
+#Pool workers for RulesValidator.runShards, they get the checks and one shard of the table
+def shardContradictions(checks, table, coverers):
+	rv = RulesValidator(table, *checks)
+	return rv.indexedContradictions(table, coverers)
+
+def shardCoverers(checks, table, coverers):
+	rv = RulesValidator(table, *checks)
+	return rv.firstCoverers(table, coverers)
+
+#Runs the tiled search of RulesValidator.firstCoverers over the packed fields of one group
+#Returns positions within the group, -1 where no earlier row covers the row.
+#rows optionally restricts the covering side to the given (sorted) positions.
+def firstCoverersInGroup(fields, tile, rows=None):
+	(src_ip, src_wild, dst_ip, dst_wild, src_port_min, src_port_max, dst_port_min, dst_port_max) = fields
+	n = len(src_ip)
+	if rows is None:
+		rows = np.arange(n)
+	first = np.full(n, -1, dtype=np.int64)
+	for c0 in range(0, n, tile):
+		cols = np.arange(c0, min(c0+tile, n))
+		# only rows before the last column of the block can cover one of its columns
+		candidates = rows[rows < cols[-1]]
+		for r0 in range(0, len(candidates), tile):
+			if len(cols) == 0:
+				break
+			block = candidates[r0:r0+tile]
+			cover = block[:,None] < cols[None,:]
+			cover &= src_port_min[block,None] <= src_port_min[None,cols]
+			cover &= src_port_max[block,None] >= src_port_max[None,cols]
+			cover &= dst_port_min[block,None] <= dst_port_min[None,cols]
+			cover &= dst_port_max[block,None] >= dst_port_max[None,cols]
+			cover &= (src_wild[None,cols] & ~src_wild[block,None]) == 0
+			cover &= ((src_ip[block,None] ^ src_ip[None,cols]) & ~src_wild[block,None]) == 0
+			cover &= (dst_wild[None,cols] & ~dst_wild[block,None]) == 0
+			cover &= ((dst_ip[block,None] ^ dst_ip[None,cols]) & ~dst_wild[block,None]) == 0
+			hit = cover.any(axis=0)
+			if hit.any():
+				first[cols[hit]] = block[cover[:,hit].argmax(axis=0)]
+				cols = cols[~hit]
+	return first
+
+
+#Binary trie over 32 bit address prefixes
+#The nodes of each level are kept in a dict keyed by the prefix bits, and only levels that hold
+#a value are visited, so a walk is at most 33 lookups. An address with wildcard bits is stored
+#at the depth of its first wildcard bit (its prefix length), the bits after it are left to the
+#caller to compare.
+class PrefixTrie:
+	def __init__(self):
+		self.levels = {}
+		self.depths = []
+	
+	#Value stored at the node of the address, created with make() if there is none yet
+	def insert(self, address, wild, make):
+		depth = 32 - wild.bit_length()
+		nodes = self.levels.get(depth)
+		if nodes is None:
+			nodes = self.levels[depth] = {}
+			bisect.insort(self.depths, depth)
+		key = address >> (32-depth)
+		node = nodes.get(key)
+		if node is None:
+			node = nodes[key] = make()
+		return node
+	
+	#Values of the nodes on the path of the address, from the root down to its own depth
+	def walk(self, address, wild):
+		depth = 32 - wild.bit_length()
+		found = []
+		for d in self.depths:
+			if d > depth:
+				break
+			node = self.levels[d].get(address >> (32-d))
+			if node is not None:
+				found.append(node)
+		return found
+
+#Answers "which rules cover this one" for RulesValidator.indexedContradictions
+#The rules go into a src PrefixTrie whose nodes hold dst PrefixTries. A dst node keeps the
+#rules by their exact wildcard pattern, protocol and ip values, and the port ranges of each
+#action in a PortIndex, built on the first query. Built from PackedRule rows, indices are the
+#rows to put in.
+class RuleIndex:
+	def __init__(self, packed, indices):
+		self.src = PrefixTrie()
+		for idx in indices:
+			rule = packed[idx]
+			patterns = self.src.insert(rule.src_ip, rule.src_wild, PrefixTrie).insert(rule.dst_ip, rule.dst_wild, dict)
+			key = (rule.protocol, rule.protocol_wild, rule.src_ip, rule.dst_ip)
+			ports = (rule.src_port_min, rule.src_port_max, rule.dst_port_min, rule.dst_port_max, idx)
+			patterns.setdefault((rule.src_wild, rule.dst_wild), {}).setdefault(key, {}).setdefault(rule.action, []).append(ports)
+	
+	#(action, rule indices) pairs for the rules covering the given PackedRule
+	def covering(self, rule):
+		ports = (rule.src_port_min, rule.src_port_max, rule.dst_port_min, rule.dst_port_max)
+		found = []
+		for dst in self.src.walk(rule.src_ip, rule.src_wild):
+			for patterns in dst.walk(rule.dst_ip, rule.dst_wild):
+				for (src_wild, dst_wild) in patterns:
+					# a wildcard bit of the rule can only be covered by a wildcard bit
+					if (rule.src_wild & ~src_wild) or (rule.dst_wild & ~dst_wild):
+						continue
+					key = (rule.protocol, rule.protocol_wild, rule.src_ip & ~src_wild, rule.dst_ip & ~dst_wild)
+					actions = patterns[(src_wild, dst_wild)].get(key)
+					if actions is None:
+						continue
+					for action in actions:
+						index = actions[action]
+						if type(index) is list:
+							index = actions[action] = PortIndex(index)
+						found.append((action, index.containing(ports)))
+		return found
+
+
+#Port containment index used by RuleIndex
+#Entries are (src_port_min, src_port_max, dst_port_min, dst_port_max, rule index).
+#They are sorted on src_port_min and a max-tree over src_port_max sits on top, so
+#containing() only walks the entries whose src port range covers the query.
+#Up to SMALL_PORT_INDEX entries are simply scanned, most buckets hold one or two rules.
+class PortIndex:
+	def __init__(self, entries):
+		self.entries = sorted(entries)
+		self.tree = None
+		if len(self.entries) <= SMALL_PORT_INDEX:
+			return
+		self.starts = [e[0] for e in self.entries]
+		self.size = 1
+		while self.size < len(self.entries):
+			self.size *= 2
+		self.tree = [-1]*(2*self.size)
+		for e in range(len(self.entries)):
+			self.tree[self.size+e] = self.entries[e][1]
+		for node in range(self.size-1, 0, -1):
+			self.tree[node] = max(self.tree[2*node], self.tree[2*node+1])
+	
+	#Returns the rule indices whose src and dst port ranges both contain the given ones
+	def containing(self, ports):
+		(smin, smax, dmin, dmax) = ports[:4]
+		if self.tree is None:
+			return [e[4] for e in self.entries if e[0] <= smin and e[1] >= smax and e[2] <= dmin and e[3] >= dmax]
+		last = bisect.bisect_right(self.starts, smin)
+		result = []
+		stack = [(1, 0, self.size)]
+		while stack:
+			(node, lo, hi) = stack.pop()
+			if lo >= last or self.tree[node] < smax:
+				continue
+			if node >= self.size:
+				e = self.entries[lo]
+				if e[2] <= dmin and e[3] >= dmax:
+					result.append(e[4])
+				continue
+			mid = (lo+hi)//2
+			stack.append((2*node+1, mid, hi))
+			stack.append((2*node, lo, mid))
+		return result
 
 
 # Use this function below to use this code individually
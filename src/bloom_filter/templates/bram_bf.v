@@ -31,7 +31,8 @@
 
 module bram_#BRAMNO#_#MODULEID#
 	#(	
-		parameter RAM_ADDR_BITS 	= #STRIDE#
+		parameter RAM_ADDR_BITS 	= #STRIDE#,
+		parameter RAM_DEPTH 		= #BRAM_DEPTH#
 	)
 	
 	(
@@ -45,7 +46,7 @@ module bram_#BRAMNO#_#MODULEID#
 	
       (* RAM_STYLE="BLOCK" *)
    
-   reg bram [0:(2**RAM_ADDR_BITS)-1];
+   reg bram [0:RAM_DEPTH-1];
    
    initial
    $readmemb(#PATH#,bram);